@@ -0,0 +1,210 @@
+#!flask/bin/python3.4
+'''
+Annotates whole corpora offline, without going through the HTTP API.
+
+Reads texts, one document per line, or JSON lines files, one document per
+object, analyzes them with the same pipeline and serializers the service
+uses on a pool of worker processes, and writes the analyses to gzipped
+shards of --shard-size documents each:
+
+    annotate.py corpus.txt -o out/                        shard-00000.jsonl.gz, ...
+    annotate.py --format xml corpus.txt.gz -o out/        shard-00000.xml.gz, ...
+    annotate.py --text-field body --id-field request_id requests.jsonl -o out/
+
+A JSON shard has the analysis of one document per line, as the service
+would answer for the text. An XML shard is one rdf document with the
+annotations of all of its documents, each targeting the uri of its
+document: its id, or the file and line it was read from. Body ids are
+derived from the analyses so that a corpus annotated twice with the same
+models comes out the same.
+
+Finished shards are recorded in out/checkpoint.json. Running the same
+command again resumes after the last of them, so an interrupted run only
+loses the shards it was working on.
+'''
+import argparse
+import gzip
+import itertools
+import json
+import os
+import sys
+import time
+
+# the documents are spread over the processes of this script instead
+os.environ['MORPHSERVICE_WORKERS'] = '0'
+
+from app import getengine, bspjson, streambspmorphxml, initworker, model_path, COMPACT_CHUNKER, SNAPSHOT, TEXT, CHUNKS
+from app.workers import WorkerPool
+from datetime import datetime
+
+'''
+gzip level of the shards: most of the size of the best level at a fraction
+of the time
+'''
+COMPRESS_LEVEL = 6
+
+CHECKPOINT = 'checkpoint.json'
+
+def openinput(path):
+    if path.endswith('.gz'):
+        return gzip.open(path, 'rt', encoding='utf-8')
+    return open(path, encoding='utf-8')
+
+def isjsonl(path, jsonl):
+    return jsonl or path.endswith('.jsonl') or path.endswith('.jsonl.gz')
+
+'''
+yields the (uri, text) of every document in the files
+'''
+def readdocuments(paths, jsonl, text_field, id_field):
+    for path in paths:
+        with openinput(path) as lines:
+            for number, line in enumerate(lines, 1):
+                line = line.strip()
+                if not line:
+                    continue
+                uri = '%s#%d' % (path, number)
+                if not isjsonl(path, jsonl):
+                    yield uri, line
+                    continue
+                try:
+                    document = json.loads(line)
+                    text = document[text_field]
+                    if not isinstance(text, str):
+                        raise TypeError('%s is not a text' % text_field)
+                except (ValueError, KeyError, TypeError) as e:
+                    print('skipping %s: %s' % (uri, e), file=sys.stderr)
+                    continue
+                yield str(document.get(id_field) or uri), text
+
+def shardpath(output, number, output_format):
+    return os.path.join(output, 'shard-%05d.%s.gz' % (number, 'jsonl' if output_format == 'json' else 'xml'))
+
+'''
+analyzes the documents of a shard and writes the shard. Runs in the worker
+processes. Returns the number of documents and words in the shard and the
+size of the file written.
+'''
+def annotateshard(shard, settings):
+    number, documents = shard
+    engine = getengine(settings['engine'])
+    analyses = ((list(engine.analyze_text(text, uri, settings['chunks'])), uri) for uri, text in documents)
+    words = [0]
+    def counted(analysis):
+        words[0] += len(analysis)
+        return analysis
+    path = shardpath(settings['output'], number, settings['format'])
+    with gzip.open(path + '.part', 'wb', compresslevel=COMPRESS_LEVEL) as out:
+        if settings['format'] == 'json':
+            for analysis, uri in analyses:
+                out.write(bspjson(counted(analysis), True, settings['created'], settings['shared_bodies']) + b'\n')
+        else:
+            annotations = itertools.chain.from_iterable(counted(analysis) for analysis, uri in analyses)
+            for chunk in streambspmorphxml(annotations, False, True, settings['shared_bodies'], settings['created']):
+                out.write(chunk)
+    os.replace(path + '.part', path)
+    return len(documents), words[0], os.path.getsize(path)
+
+'''
+groups the documents into numbered shards, leaving out the first skip
+'''
+def shards(documents, size, skip):
+    for number in itertools.count():
+        shard = list(itertools.islice(documents, size))
+        if not shard:
+            return
+        if number >= skip:
+            yield number, shard
+
+'''
+reads the checkpoint of an earlier run into the output directory, checking
+that it was made with the same settings
+'''
+def readcheckpoint(output, settings):
+    path = os.path.join(output, CHECKPOINT)
+    if not os.path.exists(path):
+        return None
+    with open(path) as checkpoint:
+        checkpoint = json.load(checkpoint)
+    if checkpoint['settings'] != settings:
+        changed = sorted(name for name in settings if checkpoint['settings'].get(name) != settings[name])
+        sys.exit('%s was annotated with other settings (%s), use another output directory' % (output, ', '.join(changed)))
+    return checkpoint
+
+def writecheckpoint(output, checkpoint):
+    path = os.path.join(output, CHECKPOINT)
+    with open(path + '.part', 'w') as out:
+        json.dump(checkpoint, out, indent=2, sort_keys=True)
+    os.replace(path + '.part', path)
+
+def main():
+    parser = argparse.ArgumentParser(description='Annotate corpora with the morphology service pipeline.')
+    parser.add_argument('files', nargs='+', help='texts, one document per line, or .jsonl files, optionally gzipped')
+    parser.add_argument('-o', '--output', required=True, help='directory to write the shards to')
+    parser.add_argument('--format', choices=['json', 'xml'], default='json', help='output format (default %(default)s)')
+    parser.add_argument('--jsonl', action='store_true', help='read every file as JSON lines, whatever its name')
+    parser.add_argument('--text-field', default='text', help='field of the JSON lines holding the text (default %(default)s)')
+    parser.add_argument('--id-field', default='id', help='field of the JSON lines holding the document uri (default %(default)s)')
+    parser.add_argument('--engine', default='hazm', help='engine to analyze with (default %(default)s)')
+    parser.add_argument('--chunks', action='store_true', help='label the words with their phrase chunks')
+    parser.add_argument('--shared-bodies', action='store_true', help='write the body of each distinct entry of a document or shard once')
+    parser.add_argument('--shard-size', type=int, default=1000, help='documents per shard (default %(default)s)')
+    parser.add_argument('--processes', type=int, default=os.cpu_count() or 1,
+        help='worker processes, 0 to analyze in this one (default %(default)s)')
+    args = parser.parse_args()
+
+    engine = getengine(args.engine)
+    if engine is None:
+        sys.exit('unknown engine ' + args.engine)
+    for capability in [TEXT, CHUNKS] if args.chunks else [TEXT]:
+        if not engine.supports(capability):
+            sys.exit('%s does not offer %s analysis' % (engine.id, capability))
+    os.makedirs(args.output, exist_ok=True)
+    settings = {
+        'files': [os.path.abspath(path) for path in args.files],
+        'format': args.format,
+        'jsonl': args.jsonl,
+        'text_field': args.text_field,
+        'id_field': args.id_field,
+        'engine': engine.id,
+        'version': engine.load().version,
+        'chunks': args.chunks,
+        'shared_bodies': args.shared_bodies,
+        'shard_size': args.shard_size
+    }
+    checkpoint = readcheckpoint(args.output, settings) or {
+        'settings': settings,
+        'created': datetime.utcnow().isoformat(),
+        'shards': 0,
+        'documents': 0,
+        'words': 0,
+        'bytes': 0
+    }
+    if checkpoint['shards']:
+        print('resuming after %d shards, %d documents' % (checkpoint['shards'], checkpoint['documents']), file=sys.stderr)
+
+    documents = readdocuments(args.files, args.jsonl, args.text_field, args.id_field)
+    work = dict(settings, output=args.output, created=checkpoint['created'])
+    pool = WorkerPool(args.processes, initworker, (model_path, COMPACT_CHUNKER, SNAPSHOT))
+    start = time.time()
+    documents_done = words_done = 0
+    try:
+        for shard_documents, shard_words, shard_bytes in pool.imap(annotateshard, shards(documents, args.shard_size, checkpoint['shards']), work):
+            checkpoint['shards'] += 1
+            checkpoint['documents'] += shard_documents
+            checkpoint['words'] += shard_words
+            checkpoint['bytes'] += shard_bytes
+            writecheckpoint(args.output, checkpoint)
+            documents_done += shard_documents
+            words_done += shard_words
+            elapsed = time.time() - start
+            print('%d shards, %d documents, %d words, %.0f documents/s, %.0f words/s, %.1fMB written' % (
+                checkpoint['shards'], checkpoint['documents'], checkpoint['words'], documents_done / elapsed,
+                words_done / elapsed, checkpoint['bytes'] / 1e6), file=sys.stderr)
+    finally:
+        pool.shutdown()
+    print('annotated %d documents, %d words into %d shards in %s in %.1fs' % (checkpoint['documents'],
+        checkpoint['words'], checkpoint['shards'], args.output, time.time() - start))
+
+if __name__ == '__main__':
+    main()
@@ -4,48 +4,42 @@ Created on Nov 7, 2015
 @author: elijah Cooke
 '''
 from __future__ import unicode_literals
-from flask import Flask,abort,make_response
+import time
+# when this process started importing the app, for the cold start metrics
+import_started = time.time()
+from flask import Flask,make_response,request,Response,stream_with_context,has_request_context
 from flask_restful import Resource, Api, reqparse
-from hazm import POSTagger,word_tokenize, sent_tokenize
-from hazm.Stemmer import Stemmer
-from hazm.Lemmatizer import Lemmatizer
-from hazm.Normalizer import Normalizer
+from lxml import etree
+from app.pipeline import get_pipeline, load_worker_pipeline, headword, hazmversion
+from app.workers import WorkerPool, Slots
+from app.cache import TieredCache, makecachekey
+from app.lexicon import openlexicon
+from app.jobs import JobQueue, QUEUED, DONE, FAILED
+from app.fetch import DocumentFetcher, FetchError
+from app.metrics import Metrics
+from app.model import Analysis, Entry, Inflection
+from app.tagset import gettagmap, hazmtagset
+from app.encoders import make_annotation_uri, make_creator_uri, make_body_uri, BodyIds
+from app.encoders import XML_DECLARATION, RDF_ROOT, BspXmlWriter, bspxml, bspjson, bspjsonannotation, alpheiosxml, dumpjson, JSON_BACKEND
+from app.engines import Engine, register, engines, getengine, preload, WORD, WORDS, TEXT, DOCUMENT, CHUNKS
 from datetime import datetime
-import urllib
-import uuid
+import calendar
+import itertools
+import hashlib
 import os
 from json import dumps
 from werkzeug.contrib.cache import SimpleCache, MemcachedCache
-
-try:
-    from lxml import etree
-    print("running with lxml.etree")
-except ImportError:
-    try:
-        # Python 2.5
-        import xml.etree.cElementTree as etree
-        print("running with cElementTree on Python 2.5+")
-    except ImportError:
-        try:
-            # Python 2.5
-            import xml.etree.ElementTree as etree
-            print("running with ElementTree on Python 2.5+")
-        except ImportError:
-            try:
-                # normal cElementTree install
-                import cElementTree as etree
-                print("running with cElementTree")
-            except ImportError:
-                try:
-                    # normal ElementTree install
-                    import elementtree.ElementTree as etree
-                    print("running with ElementTree")
-                except ImportError:
-                    print("Failed to import ElementTree from any known place")
+from werkzeug.http import http_date
 
 app = Flask(__name__)
 api = Api(app)
 
+'''
+Stage timings and cache hit/miss counts are served at /morphologyservice/metrics.
+Set MORPHSERVICE_SERVER_TIMING to also send each request its own timings in a Server-Timing header.
+'''
+metrics = Metrics(server_timing=bool(os.environ.get('MORPHSERVICE_SERVER_TIMING')), started=import_started)
+
 '''
 Setup cache for storing analysis, Memcache recomended form of caching but if unable to set up memcache server use the SimpleCache setup.
 '''
@@ -53,9 +47,71 @@ Setup cache for storing analysis, Memcache recomended form of caching but if una
 cache = SimpleCache()
 #memcache setup
 cache = MemcachedCache(["Enter_memcache_server_Ip_here"])
+#keep the hottest word analyses, form stems and lemmas and responses in process in front of
+#whichever cache is used above; text and document analyses are too large to keep 10000 of.
+#Set MORPHSERVICE_STALE_WHILE_REVALIDATE to a number of seconds to analyze words
+#again in the background when their analysis has less than that left to live
+cache = TieredCache(cache, maxsize=10000, timer=metrics.timer, local_kinds=('word', 'form', 'response'),
+    stale_while_revalidate=int(os.environ.get('MORPHSERVICE_STALE_WHILE_REVALIDATE', 0)))
+
+'''
+Document analyses requested with wait=false run as background jobs
+whose state is kept in the cache. Job state changes, so it is kept in the
+shared cache only: a copy in the process tier would go stale.
+'''
+jobs = JobQueue(cache.backend, workers=2)
 
 model_path = os.path.dirname(__file__)
 
+'''
+The hazm models are loaded once per worker process and shared by all requests.
+Set MORPHSERVICE_CHUNKER to compact to chunk with the compiled chunker model,
+which is memory mapped and so shared by all the worker processes, rather
+than with hazm's Chunker. The pipeline snapshot is kept in app/pipeline.snapshot
+unless MORPHSERVICE_SNAPSHOT names another file, or is empty for none.
+'''
+COMPACT_CHUNKER = os.environ.get('MORPHSERVICE_CHUNKER', 'hazm') == 'compact'
+SNAPSHOT = os.environ.get('MORPHSERVICE_SNAPSHOT', os.path.join(model_path, 'pipeline.snapshot')) or None
+pipeline = get_pipeline(model_path, COMPACT_CHUNKER, SNAPSHOT)
+pipeline.observe = metrics.observe
+
+'''
+Tags are mapped to parts of speech with the table for the tag set the
+installed hazm's tagger uses. Set MORPHSERVICE_TAGSET to bijankhan or
+universal to use another.
+'''
+tagmap = gettagmap(os.environ.get('MORPHSERVICE_TAGSET') or hazmtagset(hazmversion()))
+
+'''
+Precomputed analyses are read from the lexicon built by buildlexicon.py when there is one.
+Set MORPHSERVICE_LEXICON to read it from somewhere other than app/lexicon.db.
+'''
+lexicon_path = os.environ.get('MORPHSERVICE_LEXICON', os.path.join(model_path, 'lexicon.db'))
+lexicon = openlexicon(lexicon_path, pipeline)
+
+metrics.gauge('pipeline_warmup_seconds', lambda: pipeline.warmup_seconds, 'Time it took to load the hazm models.')
+metrics.gauge('pipeline_memory_kb', lambda: pipeline.memory_kb, 'Memory the hazm models took up when loaded.')
+for memo in ('form', 'stem', 'lemma', 'tag'):
+    metrics.gauge('memo_%s_hit_ratio' % memo, lambda memo=memo: pipeline.memostats()[memo]['hit_ratio'],
+        'Share of %s lookups answered by the memo table.' % memo)
+metrics.gauge('pos_coverage', lambda: tagmap.stats()['coverage'], 'Share of the tags given that were mapped to a part of speech.')
+metrics.gauge('local_cache_size', lambda: cache.stats()['local']['size'], 'Analyses held in the in-process cache.')
+for tier, counter, help in [
+        ('local', 'hits', 'Lookups answered by the in-process cache.'),
+        ('local', 'misses', 'Lookups the in-process cache passed on to the shared cache.'),
+        ('backend', 'hits', 'Lookups answered by the shared cache.'),
+        ('backend', 'misses', 'Lookups the shared cache had no analysis for.'),
+        ('flights', 'computed', 'Analyses computed on a cache miss.'),
+        ('flights', 'coalesced', 'Cache misses that waited for the same analysis being computed for another request.'),
+        ('flights', 'revalidated', 'Analyses computed again in the background before they expired.')]:
+    metrics.gauge('cache_%s_%s' % (tier, counter), lambda tier=tier, counter=counter: cache.stats()[tier][counter], help)
+
+'''
+counts a cache lookup as a hit or a miss and passes its result on
+'''
+def counted(value,engine,event='cache'):
+    metrics.count(event, 'miss' if value is None else 'hit', engine)
+    return value
 
 '''
 makes an error response that can be represented in either
@@ -71,106 +127,49 @@ def toalpheiosxml(analysis):
     root = etree.Element('words')
     for item in analysis:
         word = etree.SubElement(root,'word')
-        form = etree.SubElement(word, 'form', {'{http://www.w3.org/XML/1998/namespace}lang': item['form']['lang']})
-        form.text = item['form']['text']
-        for entry in item['entries']:
+        form = etree.SubElement(word, 'form', {'{http://www.w3.org/XML/1998/namespace}lang': item.lang})
+        form.text = item.form
+        for entry in item.entries:
             word.append(entrytoxml(entry))
     return root
 
+'''
+represents the state of a background job
+'''
+def jobtoxml(job):
+    root = etree.Element('job', {'id': job['id']})
+    for name in ('status', 'uri', 'error'):
+        if name in job:
+            etree.SubElement(root, name).text = job[name]
+    return root
+
 '''
 represents an entry from an analysis in an xml fragment per the alpheios schema
 '''
 def entrytoxml(entry):
     root = etree.Element('entry')
     dic = etree.SubElement(root,'dict')
-    hdwd = etree.SubElement(dic,'hdwd', {'{http://www.w3.org/XML/1998/namespace}lang':entry['dict']['hdwd']['lang']})
-    hdwd.text = entry['dict']['hdwd']['text']
-    for i in entry['infls']:
+    hdwd = etree.SubElement(dic,'hdwd', {'{http://www.w3.org/XML/1998/namespace}lang':entry.lang})
+    hdwd.text = entry.hdwd
+    for i in entry.infls:
       infl = etree.SubElement(root,'infl')
-      term = etree.SubElement(infl, 'term', {'{http://www.w3.org/XML/1998/namespace}lang':i['stem']['lang']})
+      term = etree.SubElement(infl, 'term', {'{http://www.w3.org/XML/1998/namespace}lang':i.lang})
       stem = etree.SubElement(term, 'stem')
-      stem.text = i['stem']['text']
-      if (i['pofs'] and i['pofs']['text']):
-        pofs = etree.SubElement(infl, 'pofs', {'order':i['pofs']['order']})
-        pofs.text = i['pofs']['text']
+      stem.text = i.stem
+      if i.pofs:
+        pofs = etree.SubElement(infl, 'pofs', {'order':i.pofs.order})
+        pofs.text = i.pofs.name
     return root
 
-'''
-makes a uri for the annotation. This can be whatever makes sense
-for the service provider as long as its a valid URI
-'''
-def make_annotation_uri(word,engine):
-  return 'urn:PersDigUMDMorphologyService:'+word + ':' + engine
-
-'''
-makes a uri for the annotation creator. This can be whatever makes sense
-for the service provider as long as its a valid URI
-'''
-def make_creator_uri(engine):
-  return 'org.PersDigUMD:tools.' + engine + '.v1'
-
-'''
-makes a uri for an annotation body. Should be unique in the response
-'''
-def make_annotation_uri(word,engine):
-  return 'urn:PersDigUMDMorphologyService:'+word + ':' + engine
-
 '''
 represents an analysis as a dict object adhering to the morphology service 
-api output format and which can be dumped directly to JSON
+api output format and which can be dumped directly to JSON. The annotations
+are created now unless created gives another time. With shared, entries
+the analysis had before refer to their first body instead of repeating it.
 '''
-def tobspmorphjson(analysis):
-    annotations = []
-    for word in analysis:
-        annotation = {}
-        annotation_id = make_annotation_uri(word['form']['text'],word['engine'])
-        annotation['about'] = annotation_id
-        annotation['hasTarget'] = {}
-        annotation['hasTarget']['Description'] = {}
-        annotation['hasTarget']['Description']['about'] = word['uri'] 
-        annotation['title'] = "Morphology of " + word['form']['text']
-        annotation['creator'] = {}
-        annotation['creator']['Agent'] = {}
-        annotation['creator']['Agent']['about'] = make_creator_uri(word['engine'])
-        annotation['created'] = datetime.utcnow().isoformat()
-        hasbodies = []
-        bodies = []
-        for entry in word['entries']:
-            entry_id = str(uuid.uuid1().urn)
-            resource = {}
-            resource['resource'] = entry_id
-            hasbodies.append(resource)
-            body = {}
-            body['about'] = entry_id
-            body['rest'] = {}
-            body['rest']['entry'] = {}
-            body['rest']['entry']['dict'] = {}
-            body['rest']['entry']['dict']['hdwd'] = {}
-            body['rest']['entry']['dict']['hdwd']['lang'] = entry['dict']['hdwd']['lang']
-            body['rest']['entry']['dict']['hdwd']['$'] = entry['dict']['hdwd']['text']
-            infls = []
-            for i in entry['infls']:
-                infl = {}
-                infl['term'] = {}
-                infl['term']['lang'] = i['stem']['lang']
-                infl['term']['stem'] = i['stem']['text']
-                if (i['pofs'] and i['pofs']['text']):
-                    infl['pofs'] = {}
-                    infl['pofs']['order'] = i['pofs']['order']
-                    infl['pofs']['$'] = i['pofs']['text']
-                infls.append(infl)
-            if len(infls) > 1:
-                body['rest']['entry']['infl'] = infls
-            elif len(infls) == 1:
-                body['rest']['entry']['infl'] = infls[0]
-            bodies.append(body)
-        if len(bodies) > 1:
-            annotation['hasBody'] = hasbodies
-            annotation['Body'] = bodies
-        elif len(bodies) == 1:
-            annotation['hasBody'] = hasbodies[0]
-            annotation['Body'] = bodies[0]
-        annotations.append(annotation)
+def tobspmorphjson(analysis,stable_ids=False,created=None,shared=False):
+    bodies = BodyIds(stable_ids,shared)
+    annotations = [annotationtojson(word,stable_ids,created,bodies) for word in analysis]
     result = {}
     result['RDF'] = {}
     if len(annotations) > 1:
@@ -178,221 +177,455 @@ def tobspmorphjson(analysis):
     elif len(annotations) == 1:
         result['RDF']['Annotation'] = annotations[0]
     return result
-        
 
+'''
+represents the analysis of one word as an annotation dict
+'''
+def annotationtojson(word,stable_ids=False,created=None,bodies=None):
+    bodies = bodies or BodyIds(stable_ids)
+    annotation = {}
+    annotation_id = make_annotation_uri(word.form,word.engine)
+    annotation['about'] = annotation_id
+    annotation['hasTarget'] = {}
+    annotation['hasTarget']['Description'] = {}
+    annotation['hasTarget']['Description']['about'] = word.uri
+    annotation['title'] = "Morphology of " + word.form
+    if word.chunk:
+        annotation['chunk'] = word.chunk
+    annotation['creator'] = {}
+    annotation['creator']['Agent'] = {}
+    annotation['creator']['Agent']['about'] = make_creator_uri(word.engine)
+    annotation['created'] = created or datetime.utcnow().isoformat()
+    hasbodies = []
+    written = []
+    for entry in word.entries:
+        entry_id, new = bodies.uri(entry,word.engine)
+        resource = {}
+        resource['resource'] = entry_id
+        hasbodies.append(resource)
+        if not new:
+            continue
+        body = {}
+        body['about'] = entry_id
+        body['rest'] = {}
+        body['rest']['entry'] = {}
+        body['rest']['entry']['dict'] = {}
+        body['rest']['entry']['dict']['hdwd'] = {}
+        body['rest']['entry']['dict']['hdwd']['lang'] = entry.lang
+        body['rest']['entry']['dict']['hdwd']['$'] = entry.hdwd
+        infls = []
+        for i in entry.infls:
+            infl = {}
+            infl['term'] = {}
+            infl['term']['lang'] = i.lang
+            infl['term']['stem'] = i.stem
+            if i.pofs:
+                infl['pofs'] = {}
+                infl['pofs']['order'] = i.pofs.order
+                infl['pofs']['$'] = i.pofs.name
+            infls.append(infl)
+        if len(infls) > 1:
+            body['rest']['entry']['infl'] = infls
+        elif len(infls) == 1:
+            body['rest']['entry']['infl'] = infls[0]
+        written.append(body)
+    if len(hasbodies) > 1:
+        annotation['hasBody'] = hasbodies
+    elif len(hasbodies) == 1:
+        annotation['hasBody'] = hasbodies[0]
+    if len(written) > 1:
+        annotation['Body'] = written
+    elif len(written) == 1:
+        annotation['Body'] = written[0]
+    return annotation
+
+'''
+serializes an iterable of analyses to JSON one annotation at a time.
+The chunks join up to exactly what dumps(tobspmorphjson(analysis)) gives.
+'''
+def streambspmorphjson(analysis,stable_ids=False,shared=False):
+    bodies = BodyIds(stable_ids,shared)
+    annotations = (annotationchunk(word,bodies) for word in analysis)
+    first = next(annotations, None)
+    if first is None:
+        yield b'{"RDF": {}}'
+        return
+    second = next(annotations, None)
+    if second is None:
+        yield b'{"RDF": {"Annotation": ' + first + b'}}'
+        return
+    yield b'{"RDF": {"Annotation": [' + first
+    yield b', ' + second
+    for annotation in annotations:
+        yield b', ' + annotation
+    yield b']}}'
+
+def annotationchunk(word,bodies):
+    with metrics.timer('serialize'):
+        return bspjsonannotation(word,bodies=bodies).encode('ascii')
 
 '''
 represents an analysis as an xml object adhering to the morphology service 
 api output format 
 '''
-def tobspmorphxml(analysis):
+def tobspmorphxml(analysis,stable_ids=False,created=None,shared=False):
     root = etree.Element("{http://www.w3.org/1999/02/22-rdf-syntax-ns#}RDF")    
+    bodies = BodyIds(stable_ids,shared)
     for word in analysis:
-        annotation_id = make_annotation_uri(word['form']['text'],word['engine'])
-        oaannotation = etree.SubElement(root,'{http://www.w3.org/ns/oa#}Annotation',{'{http://www.w3.org/1999/02/22-rdf-syntax-ns#}about': annotation_id})
-        oahastarget = etree.SubElement(oaannotation,'{http://www.w3.org/ns/oa#}hasTarget')
-        desc = etree.SubElement(oahastarget,'{http://www.w3.org/1999/02/22-rdf-syntax-ns#}Description',{'{http://www.w3.org/1999/02/22-rdf-syntax-ns#}about':word['uri']})
-        title = etree.SubElement(oaannotation, '{http://purl.org/dc/elements/1.1/}title', {'{http://www.w3.org/XML/1998/namespace}lang':'eng'})
-        title.text = "Morphology of " + word['form']['text']
-        creator = etree.SubElement(oaannotation,'{http://purl.org/dc/terms/}creator')
-        creator_uri = make_creator_uri(word['engine'])
-        agent = etree.SubElement(creator,'{http://xmlns.com/foaf/0.1/}Agent',{'{http://www.w3.org/1999/02/22-rdf-syntax-ns#}about':creator_uri})
-        creator = etree.SubElement(oaannotation,'{http://purl.org/dc/terms/}created')
-        creator.text = datetime.utcnow().isoformat()
-        for entry in word['entries']:
-            entry_id = str(uuid.uuid1().urn)
-            oahasbody = etree.SubElement(oaannotation, '{http://www.w3.org/ns/oa#}hasBody',{'{http://www.w3.org/1999/02/22-rdf-syntax-ns#}resource':entry_id})
-            oabody = etree.SubElement(oaannotation, '{http://www.w3.org/ns/oa#}Body',{'{http://www.w3.org/1999/02/22-rdf-syntax-ns#}resource':entry_id})
-            bodytype = etree.SubElement(oabody, '{http://www.w3.org/1999/02/22-rdf-syntax-ns#}type',{'{http://www.w3.org/1999/02/22-rdf-syntax-ns#}resource':'http://www.w3.org/2008/content#ContentAsXML'})
-            content = etree.SubElement(oabody, '{http://www.w3.org/2008/content#}rest')
-            content.append(entrytoxml(entry))
+        annotationtoxml(root, word, stable_ids, created, bodies)
     return root
 
+'''
+adds the annotation for the analysis of one word to an rdf root element
+'''
+def annotationtoxml(root, word, stable_ids=False, created=None, bodies=None):
+    bodies = bodies or BodyIds(stable_ids)
+    annotation_id = make_annotation_uri(word.form,word.engine)
+    oaannotation = etree.SubElement(root,'{http://www.w3.org/ns/oa#}Annotation',{'{http://www.w3.org/1999/02/22-rdf-syntax-ns#}about': annotation_id})
+    oahastarget = etree.SubElement(oaannotation,'{http://www.w3.org/ns/oa#}hasTarget')
+    desc = etree.SubElement(oahastarget,'{http://www.w3.org/1999/02/22-rdf-syntax-ns#}Description',{'{http://www.w3.org/1999/02/22-rdf-syntax-ns#}about':word.uri})
+    title = etree.SubElement(oaannotation, '{http://purl.org/dc/elements/1.1/}title', {'{http://www.w3.org/XML/1998/namespace}lang':'eng'})
+    title.text = "Morphology of " + word.form
+    if word.chunk:
+        chunk = etree.SubElement(oaannotation, 'chunk')
+        chunk.text = word.chunk
+    creator = etree.SubElement(oaannotation,'{http://purl.org/dc/terms/}creator')
+    creator_uri = make_creator_uri(word.engine)
+    agent = etree.SubElement(creator,'{http://xmlns.com/foaf/0.1/}Agent',{'{http://www.w3.org/1999/02/22-rdf-syntax-ns#}about':creator_uri})
+    creator = etree.SubElement(oaannotation,'{http://purl.org/dc/terms/}created')
+    creator.text = created or datetime.utcnow().isoformat()
+    for entry in word.entries:
+        entry_id, new = bodies.uri(entry,word.engine)
+        oahasbody = etree.SubElement(oaannotation, '{http://www.w3.org/ns/oa#}hasBody',{'{http://www.w3.org/1999/02/22-rdf-syntax-ns#}resource':entry_id})
+        if not new:
+            continue
+        oabody = etree.SubElement(oaannotation, '{http://www.w3.org/ns/oa#}Body',{'{http://www.w3.org/1999/02/22-rdf-syntax-ns#}resource':entry_id})
+        bodytype = etree.SubElement(oabody, '{http://www.w3.org/1999/02/22-rdf-syntax-ns#}type',{'{http://www.w3.org/1999/02/22-rdf-syntax-ns#}resource':'http://www.w3.org/2008/content#ContentAsXML'})
+        content = etree.SubElement(oabody, '{http://www.w3.org/2008/content#}rest')
+        content.append(entrytoxml(entry))
+    return oaannotation
+
+'''
+serializes an iterable of analyses to xml one annotation at a time. The
+chunks join up to exactly what tostring(tobspmorphxml(analysis)) gives
+while only one annotation is ever held in memory.
+'''
+def streambspmorphxml(analysis, pretty_print=False, stable_ids=False, shared=False, created=None):
+    writer = BspXmlWriter(stable_ids, created, shared)
+    newline = b'\n' if pretty_print else b''
+    root = RDF_ROOT.encode('utf-8')
+    started = False
+    for word in analysis:
+        with metrics.timer('serialize'):
+            chunk = writer.annotation(word, pretty_print).encode('utf-8')
+        if not started:
+            started = True
+            yield XML_DECLARATION + root + b'>' + newline
+        yield chunk
+    if started:
+        yield b'</rdf:RDF>' + newline
+    else:
+        yield XML_DECLARATION + root + b'/>' + newline
+
+'''
+collects the analyses passing through a stream and caches them once the
+stream is exhausted, unless there turned out to be too many to keep.
+If entry is given the analyses are cached as its 'analysis'.
+'''
+def cachestream(key, analysis, limit, entry=None):
+    collected = []
+    for word in analysis:
+        if collected is not None:
+            collected.append(word)
+            if len(collected) > limit:
+                collected = None
+        yield word
+    if collected is not None:
+        cache.set(key, collected if entry is None else dict(entry, analysis=collected))
+
 def hazmtoalpheios(word,uri):
-    wordslist = etree.Element("words")
-    normalizer = Normalizer()
-    item = normalizer.normalize(word)
+    with metrics.timer('normalize', 'hazm'):
+        item = pipeline.normalizeform(word)
+    known = counted(lexicon.get(item),'hazm','lexicon') if lexicon else None
+    if known:
+        wordstem, wordlema, wordpofs = known
+    else:
+        with metrics.timer('stem', 'hazm'):
+            wordstem = pipeline.stem(item)
+            wordlema = pipeline.lemmatize(item)
+        with metrics.timer('tag', 'hazm'):
+            wordpofs = pipeline.tagword(item)
+    wordpofs = tagmap.map(wordpofs)
+    return [makeanalysis(item,wordstem,wordpofs,uri,wordlema=wordlema)]
+
+'''
+the stem and lemma of a normalized form are shared in the cache by every
+text, document and process that has the form
+'''
+def formcachekey(item):
+    return makecachekey('form', HazmEngine.id, 'per', item, '%s-r%d' % (pipeline.version, ANALYSIS_REVISION))
+
+'''
+stems and lemmatizes each of a set of distinct normalized forms once,
+taking the forms found in the lexicon from there and the others from the
+cache, or from the pipeline, whose results are then cached. Returns a dict
+of form to (stem, lemma, tag), tag being the lexicon's tag, or None for
+forms that aren't in the lexicon.
+'''
+def analyzeforms(items):
+    known = {}
+    if lexicon:
+        with metrics.timer('lexicon', 'hazm'):
+            known = lexicon.get_many(items)
+    missing = [item for item in items if item not in known]
+    if not missing:
+        return known
+    keys = dict((item, formcachekey(item)) for item in missing)
+    computed = {}
+    with metrics.timer('stem', 'hazm'):
+        for item, cached in zip(missing, cache.get_many(*[keys[item] for item in missing])):
+            if cached is not None:
+                known[item] = tuple(cached)
+            else:
+                known[item] = computed[keys[item]] = (pipeline.stem(item), pipeline.lemmatize(item), None)
+    if computed:
+        cache.set_many(computed)
+    return known
+
+'''
+analyzes a list of words with the hazm engine, normalizing, stemming and
+lemmatizing each distinct form once and POS-tagging all of them in a
+single tagger pass. Returns one list of analyses per word, in order.
+'''
+def hazmtoalpheiosbatch(words,uris):
+    with metrics.timer('normalize', 'hazm'):
+        items = [pipeline.normalizeform(word) for word in words]
+    forms = analyzeforms(set(items))
+    with metrics.timer('tag', 'hazm'):
+        tags = pipeline.tagwords([item for item, (wordstem, wordlema, wordpofs) in forms.items() if wordpofs is None])
     analyses = []
-    stemmer = Stemmer()
-    wordstem = stemmer.stem(item)
-    lemmatizer = Lemmatizer()
-    wordlema = lemmatizer.lemmatize(item)
-    if '#' in wordlema:
-        worldleam, garbage = wordlema.split("#")
-    tagger = POSTagger(model=os.path.join(model_path,"postagger.model"))
-    wordtagged = tagger.tag(word_tokenize(item))
-    wordpofs = wordtagged[0][1]
-    wordpofs = maptohazm(wordpofs)
-    # a better way to do this would be to create a Python class
-    # to formalize the abstraction
-    analysis = {}
-    analysis['engine'] = 'hazm'
-    analysis['uri'] = uri
-    analysis['form'] = {}
-    analysis['form']['text'] = item
-    analysis['form']['lang'] = 'per'
-    analysis['entries'] = []
-    entry = {}
-    entry['dict'] = {}
-    entry['dict']['hdwd'] = {}
-    entry['dict']['hdwd']['lang'] = 'per'
-    entry['dict']['hdwd']['text'] = wordstem
-    entry['infls'] = []
-    infl = {}
-    infl['stem'] = {} 
-    infl['stem']['text'] = wordstem
-    infl['stem']['lang'] = 'per'
-    infl['pofs'] = {}
-    if wordpofs:
-        infl['pofs']['order'] = str(wordpofs[1])
-        infl['pofs']['text'] = wordpofs[0]
-    entry['infls'].append(infl)
-    analysis['entries'].append(entry)
-    analyses.append(analysis)
+    for item, uri in zip(items,uris):
+        wordstem, wordlema, wordpofs = forms[item]
+        analyses.append([makeanalysis(item,wordstem,tagmap.map(tags.get(item, wordpofs)),uri,wordlema=wordlema)])
     return analyses
 
-def maptohazm(wordpofs):
-    if wordpofs == "N":
-        wordpofs = ["noun",1]
-        return wordpofs
-    if wordpofs == "INT":
-        wordpofs = ["interjection",2]
-        return wordpofs
-    if wordpofs == "DET":
-        wordpofs = ["determiner",3]
-        return wordpofs
-    if wordpofs == "AJ":
-        wordpofs = ["adjective",4]
-        return wordpofs
-    if wordpofs == "P":
-        wordpofs = ["preposition",5]
-        return wordpofs
-    if wordpofs == "PRO":
-        wordpofs = ["pronoun",6]
-        return wordpofs
-    if wordpofs == "CONJ":
-        wordpofs = ["conjunction",7]
-        return wordpofs
-    if wordpofs == "V":
-        wordpofs = ["verb",8]
-        return wordpofs
-    if wordpofs == "ADV":
-        wordpofs = ["adverb",9]
-        return wordpofs
-    if wordpofs == "POSTP":
-        wordpofs = ["postposition",10]
-        return wordpofs
-    if wordpofs == "Num":
-        wordpofs = ["numeral",11]
-        return wordpofs
-    if wordpofs == "CL":
-        wordpofs = ["classifier",12]
-        return wordpofs
-    if wordpofs == "e":
-        wordpofs = ["ezafe",13]
-        return wordpofs
-
-# this hasn't been updated ...
-def hazmtoalpheiosfile(data,uri):
-    root = etree.Element("{http://www.w3.org/1999/02/22-rdf-syntax-ns#}RDF")    
-    oaannotation = etree.SubElement(root,'{http://www.w3.org/ns/oa#}Annotation',{'{http://www.w3.org/1999/02/22-rdf-syntax-ns#}about':'http://services.projectbamboo.org/morphology'+uri})
-    oahasbody = etree.SubElement(oaannotation, '{http://www.w3.org/ns/oa#}hasBody',)
-    oahastarget = etree.SubElement(oaannotation,'{http://www.w3.org/ns/oa#}hasTarget')
-    hasbodydesc = etree.SubElement(oahastarget,'{http://www.w3.org/1999/02/22-rdf-syntax-ns#}Description',{'{http://www.w3.org/1999/02/22-rdf-syntax-ns#}about':uri})
-    ispartof = etree.SubElement(hasbodydesc,'{http://purl.org/dc/terms/}isPartOf',{'{http://www.w3.org/1999/02/22-rdf-syntax-ns#}about':uri})
-    source = etree.SubElement(hasbodydesc,'{http://purl.org/dc/terms/}source',{'{http://www.w3.org/1999/02/22-rdf-syntax-ns#}resource':uri})
-    title = etree.SubElement(oaannotation, '{http://purl.org/dc/elements/1.1/}title', {'{http://www.w3.org/XML/1998/namespace}lang':'eng'})
-    title.text = "Morphology of " + uri
-    wordslist = etree.SubElement("words")
-    normalizer = Normalizer()
-    data = normalizer.normalize(data)
-    sentences = sent_tokenize(data)
-    words = []
-    for sentence in sentences:
-        if words:
-            words = words.append(word_tokenize(sentence))
-        else:
-            words = word_tokenize(sentence)
-    for item in words:
-        stemmer = Stemmer()
-        wordstem = stemmer.stem(item)
-        lemmatizer = Lemmatizer()
-        wordlema = lemmatizer.lemmatize(item)
-        if '#' in wordlema:
-            worldleam, garbage = wordlema.split("#")
-        tagger = POSTagger(model=os.path.join(model_path,"postagger.model"))
-        wordtagged = tagger.tag(item)
-        wordpofs = wordtagged[0][1]
-        word = etree.SubElement(wordslist,'word')
-        form = etree.SubElement(word, 'form', {'{http://www.w3.org/XML/1998/namespace}lang':'per'})
-        form.text = item
-        entry = etree.SubElement(word, 'entry')
-        infl = etree.SubElement(entry,'inlf')
-        term = etree.SubElement(infl, 'term', {'{http://www.w3.org/XML/1998/namespace}lang':'per'})
-        stem = etree.SubElement(term, 'stem')
-        stem.text = wordstem
-        pofs = etree.SubElement(infl, 'pofs')
-        pofs.text = wordpofs
+'''
+builds the analysis of a single word from the output of the engine,
+wordpofs being its part of speech from the tag map, if it has one. The
+headword is the lemma, or the stem when there is no lemma.
+'''
+def makeanalysis(item,wordstem,wordpofs,uri,engine='hazm',chunk=None,wordlema=None):
+    return Analysis(item, 'per', uri, engine, [makeentry(wordstem,wordpofs,wordlema)], chunk)
+
+def makeentry(wordstem,wordpofs,wordlema=None):
+    return Entry(headword(wordlema) or wordstem, 'per', [Inflection(wordstem, 'per', wordpofs)])
+
+'''
+streamed text and document analyses with more words than this are not cached
+'''
+STREAM_CACHE_LIMIT = 20000
+
+'''
+Texts are analyzed TAG_SENTENCES sentences at a time. Set MORPHSERVICE_WORKERS
+to spread those chunks over that many worker processes, each with its own
+loaded pipeline; by default they are analyzed in the request thread.
+'''
+TAG_SENTENCES = int(os.environ.get('MORPHSERVICE_CHUNK_SENTENCES', 32))
+
+'''
+sets up the pipeline of an analysis worker process
+'''
+def initworker(path,compact_chunker,snapshot):
+    # the worker opened its lexicon, and may have preloaded its pipeline,
+    # when it imported the app
+    load_worker_pipeline(path,compact_chunker,snapshot)
+
+workers = WorkerPool(int(os.environ.get('MORPHSERVICE_WORKERS', 0)), initworker, (model_path,COMPACT_CHUNKER,SNAPSHOT))
+
+'''
+hazm analysis is done in these slots, which don't limit it unless a server
+sizes them (see app/asgi.py). Fetches and cache round trips are done
+outside of them.
+'''
+analysis_slots = Slots()
+
+'''
+analyzes a whole text with the hazm engine. The text is normalized and
+sentence tokenized once, each sentence is POS-tagged as a unit so the tags
+get their context, and the analyses are yielded one sentence at a time
+so that long texts never have to be held in memory as a whole.
+With chunks, every word is labeled with its phrase chunk too.
+'''
+def hazmtoalpheiostext(data,uri,chunks=False):
+    with analysis_slots, metrics.timer('normalize', 'hazm'):
+        sentences = pipeline.sent_tokenize(pipeline.normalize(data))
+    parts = (sentences[start:start + TAG_SENTENCES] for start in range(0, len(sentences), TAG_SENTENCES))
+    results = workers.imap(hazmtoalpheiossentences, parts, uri, chunks)
+    while True:
+        # the parts may be analyzed in other processes, so they are timed
+        # as a whole, from here
+        with analysis_slots, metrics.timer('analyze', 'hazm'):
+            analyses = next(results, None)
+        if analyses is None:
+            return
+        for sentence in analyses:
+            yield sentence
+
+'''
+analyzes a part of a text, a list of sentences, returning a list of
+analyses per sentence. Runs in the analysis workers when there are any.
+Only tagging and chunking, which depend on the context of a word, are
+done per sentence: the part's vocabulary, its distinct forms, is stemmed
+and lemmatized once, and the words with the same form and tag share one
+entry.
+'''
+def hazmtoalpheiossentences(sentences,uri,chunks=False):
+    tokens = [pipeline.word_tokenize(sentence) for sentence in sentences]
+    with metrics.timer('tag', 'hazm'):
+        tagged_sents = pipeline.tag_sents([t for t in tokens if t])
+    if chunks:
+        labels = pipeline.chunk_sents(tagged_sents)
+    else:
+        labels = [[None] * len(tagged) for tagged in tagged_sents]
+    forms = analyzeforms(set(item for tagged in tagged_sents for item, tag in tagged))
+    entries = {}
+    analyses = []
+    for tagged, chunk_labels in zip(tagged_sents, labels):
+        sentence = []
+        for (item, tag), label in zip(tagged, chunk_labels):
+            entry = entries.get((item, tag))
+            if entry is None:
+                wordstem, wordlema, wordpofs = forms[item]
+                entry = entries[(item, tag)] = makeentry(wordstem,tagmap.map(tag),wordlema)
+            sentence.append(Analysis(item, 'per', uri, 'hazm', [entry], label))
+        analyses.append(sentence)
+    return analyses
+
+'''
+bumped whenever the analyses made from the pipeline's output change, so
+that analyses cached before aren't served after
+'''
+ANALYSIS_REVISION = 5
+
+'''
+the hazm engine, backed by the pipeline of this process
+'''
+class HazmEngine(Engine):
+    id = 'hazm'
+    description = 'Persian morphological analysis with hazm: normalization, stemming, lemmatization and part of speech tagging'
+    languages = ['per']
+    options = ['word_uri', 'text_uri', 'mime_type', 'wait', 'pretty', 'chunks', 'shared_bodies']
+    capabilities = [WORD, WORDS, TEXT, DOCUMENT, CHUNKS]
+    sample = 'سلام'
+
+    @property
+    def version(self):
+        return '%s-r%d' % (pipeline.version, ANALYSIS_REVISION)
+
+    @property
+    def modified(self):
+        return pipeline.modified
+
+    @property
+    def loaded(self):
+        return pipeline.loaded
+
+    def load(self):
+        pipeline.load()
+        return self
+
+    def normalizeform(self, word):
+        return pipeline.normalizeform(word)
+
+    def analyze(self, word, uri):
+        with analysis_slots:
+            return hazmtoalpheios(word, uri)
+
+    def analyze_batch(self, words, uris):
+        with analysis_slots:
+            return hazmtoalpheiosbatch(words, uris)
+
+    def analyze_text(self, text, uri, chunks=False):
+        return itertools.chain.from_iterable(hazmtoalpheiostext(text, uri, chunks))
+
+'''
+the CASL analyzer isn't available yet. It is registered so that it is
+listed, and requests for it are answered as not implemented.
+'''
+class CaslEngine(Engine):
+    id = 'casl'
+    description = 'Persian morphological analysis with the CASL analyzer (not available yet)'
+    languages = ['per']
+
+register(HazmEngine())
+register(CaslEngine())
+
+'''
+Engines load their models on first use. Set MORPHSERVICE_PRELOAD to a comma
+separated list of engine ids, or to all, to load them at import time instead.
+'''
+preload(os.environ.get('MORPHSERVICE_PRELOAD'))
+
+'''
+represents engine descriptions as an EngineListXMLRepresentation
+'''
+def enginestoxml(engines):
+    root = etree.Element("EngineListXMLRepresentation")
+    listmeta = etree.SubElement(root, "listMetadata")
+    size = etree.SubElement(listmeta, "size")
+    size.text = str(len(engines))
+    listentries = etree.SubElement(root, "listEntries")
+    for engine in engines:
+        entry = etree.SubElement(listentries, "listEntry", {'id': engine['id']})
+        description = etree.SubElement(entry, "description")
+        description.text = engine['description']
+        for lang in engine['languages']:
+            etree.SubElement(entry, "supportsLanguageCode").text = lang
+        for option in engine['options']:
+            etree.SubElement(entry, "supportsOption").text = option
+        for capability in engine['capabilities']:
+            etree.SubElement(entry, "supportsCapability").text = capability
     return root
 
-def casltoalphioes():
-    pass
-        
+'''
+The engine list and the description of each engine don't change while the
+service runs, so they are serialized once per media type at startup and
+served as they are, with an ETag so that clients polling them get a 304.
+Keyed by (engine id, media type), the list having None for engine id.
+'''
+def representengines(engines):
+    representations = {}
+    for engine_id, selected in [(None, engines)] + [(engine['id'], [engine]) for engine in engines]:
+        if engine_id is None:
+            obj = { 'engines': selected }
+        else:
+            obj = { 'engine': selected[0] }
+        # sorted so every worker process serves the same bytes and ETag
+        json = dumps(obj, sort_keys=True).encode('utf-8')
+        xml = etree.tostring(enginestoxml(selected), pretty_print=True, xml_declaration=True, encoding='utf-8')
+        for mediatype, body in (('application/json', json), ('application/xml', xml)):
+            representations[(engine_id, mediatype)] = (body, hashlib.sha1(body).hexdigest())
+    return representations
+
+ENGINE_REPRESENTATIONS = representengines([engine.describe() for engine in engines()])
+
+def engineresponse(engine_id):
+    mediatype = bestmediatype()
+    body, etag = ENGINE_REPRESENTATIONS[(engine_id, mediatype)]
+    resp = Response(body, 200, mimetype=mediatype)
+    resp.set_etag(etag)
+    resp.vary.add('Accept')
+    return resp.make_conditional(request)
+
 class EngineListAPI(Resource):
     def get(self):
-        cached_enginelist = cache.get("engine_list")
-        if cached_enginelist is None
-            root = etree.Element("EngineListXMLRepresentation")
-            ouput = etree.ElementTree(root)
-            listmeta = etree.SubElement(root, "listMetadata", {'type':'bsp:listMetadataType'})
-            listentries = etree.SubElement(root, "listEntries")
-            engineone = etree.SubElement(listentries, "listEntry", {"type":"EngineListEntry", 'maxOccurs':"unbounded",'minOccours':'1'})
-            terms1 = etree.SubElement(engineone, "description")
-            slcode1 = etree.SubElement(engineone, "supportsLanguageCode", {'type':'xs:string', 'maxOccurs':'unbounded', 'minOccours':'1'})
-            supopt1 = etree.SubElement(engineone, "supportsOption", {'type':'xs:string','maxOccurs':'unbounded','minOccurs':'1'})
-            enginetwo = etree.SubElement(listentries, "listEntry", {"type":"EngineListEntry", 'maxOccurs':"unbounded",'minOccours':'1'})
-            terms2 = etree.SubElement(enginetwo, "description")
-            slcode2 = etree.SubElement(enginetwo, "supportsLanguageCode", {'type':'xs:string', 'maxOccurs':'unbounded', 'minOccours':'1'})
-            supopt2 = etree.SubElement(enginetwo, "supportsOption", {'type':'xs:string','maxOccurs':'unbounded','minOccurs':'1'})
-            cache.set('engine_list', root)
-            return root
-        else:
-            return cached_enginelist
+        return engineresponse(None)
 
 class EngineAPI(Resource):
-    def get(self, id):
-        if id == "hazm":
-            cached_enginehazm = cache.get("engine_hazm")
-            if cached_enginehazm is None:
-                root = etree.Element("EngineListXMLRepresentation")
-                ouput = etree.ElementTree(root)
-                listmeta = etree.SubElement(root, "listMetadata", {'type':'bsp:listMetadataType'})
-                listentries = etree.SubElement(root, "listEntries")
-                engine = etree.SubElement(listentries, "listEntry", {"type":"EngineListEntry", 'maxOccurs':"unbounded",'minOccours':'1'})
-                terms = etree.SubElement(engine, "description")
-                slcode = etree.SubElement(engine, "supportsLanguageCode", {'type':'xs:string', 'maxOccurs':'unbounded', 'minOccours':'1'})
-                supopt = etree.SubElement(engine, "supportsOption", {'type':'xs:string','maxOccurs':'unbounded','minOccurs':'1'})
-                cache.set('engine_hazm', root)
-            else:
-                root = cached_enginehazm
-        if id == "casl":
-            cached_enginecasl = cache.get("engine_casl")
-            if cached_enginecasl is None:
-                root = etree.Element("EngineListXMLRepresentation")
-                ouput = etree.ElementTree(root)
-                listmeta = etree.SubElement(root, "listMetadata", {'type':'bsp:listMetadataType'})
-                listentries = etree.SubElement(root, "listEntries")
-                engine = etree.SubElement(listentries, "listEntry", {"type":"EngineListEntry", 'maxOccurs':"unbounded",'minOccours':'1'})
-                terms = etree.SubElement(engine, "description")
-                slcode = etree.SubElement(engine, "supportsLanguageCode", {'type':'xs:string', 'maxOccurs':'unbounded', 'minOccours':'1'})
-                supopt = etree.SubElement(engine, "supportsOption", {'type':'xs:string','maxOccurs':'unbounded','minOccurs':'1'})
-                cache.set('engine_casl', root)
-            else:
-                root = cached_enginecasl
-        if root:
-            return root
-        else:
-            abort(404)
+    def get(self, EngineId):
+        if getengine(EngineId) is None:
+            return make_error('unknown engine',404)
+        return engineresponse(EngineId)
 
 '''    
 class RepoListAPI(Resource):
@@ -404,23 +637,188 @@ class RepoAPI(Resource):
         pass
 '''
 
+'''
+looks up the engine to analyze a request with, checking that it analyzes
+lang and offers all the capabilities. Returns (engine, None), or
+(None, error) with the error response to give when it can't be used.
+'''
+def selectengine(engine_id,lang,*capabilities):
+    engine = getengine(engine_id)
+    if engine is None:
+        return None, make_error("unknown engine",404)
+    if lang not in engine.languages:
+        return None, make_error("unsupported language",404)
+    for capability in capabilities:
+        if not engine.supports(capability):
+            return None, make_error("%s does not offer %s analysis" % (engine.id, capability),501)
+    return engine, None
+
+'''
+reads a yes/no request argument that defaults to no
+'''
+def isyes(value):
+    return value is not None and value.lower() in ('1', 'true', 'yes')
+
+'''
+texts analyzed with chunks are cached apart from those analyzed without
+'''
+def textkind(kind,chunks):
+    return kind + ':chunks' if chunks else kind
+
+'''
+makes the cache key for an analysis. what is the word, text or uri analyzed
+'''
+def analysiscachekey(kind,what,engine,lang):
+    return makecachekey(kind, engine.id, lang, what.strip(), engine.version)
+
+'''
+words are cached by their normalized form, so spellings that normalize
+the same share one entry
+'''
+def wordcachekey(word,engine,lang):
+    return analysiscachekey('word',engine.normalizeform(word),engine,lang)
+
+'''
+cached analyses are shared by every uri the same form was requested with,
+so they get the requested uri put back on the way out
+'''
+def withuri(analysis,uri):
+    return [word.withuri(uri) for word in analysis]
+
+'''
+returns the analysis of a single word, from the cache if it is there.
+Concurrent requests for the same word that isn't share one analysis.
+'''
+def wordanalysis(word,word_uri,engine,lang):
+    analysis, result = cache.getorcompute(wordcachekey(word,engine,lang), lambda: engine.analyze(word,word_uri))
+    metrics.count('cache', result, engine.id)
+    return withuri(analysis,word_uri)
+
+'''
+Set MORPHSERVICE_CACHE_RESPONSES to also cache the serialized responses for
+single words, per form, uri and format. Cached responses use stable body ids
+and keep the created time of when they were first serialized.
+'''
+CACHE_RESPONSES = bool(os.environ.get('MORPHSERVICE_CACHE_RESPONSES'))
+
+'''
+returns the media type the response to the current request will be
+represented in, picked the same way flask-restful does
+'''
+def bestmediatype():
+    for mediatype in api.mediatypes() + [api.default_mediatype]:
+        if mediatype in api.representations:
+            return mediatype
+
+'''
+makes the cache key for the serialized response to a word request,
+output_format being the api format (bsp or alpheios) of the response.
+Responses created when the models changed (see stablecreated) are kept
+apart from those created when they were first serialized, so that an ETag
+is only ever sent with one body.
+'''
+def responsecachekey(output_format,word,word_uri,engine,lang,stable_created=False):
+    form = engine.normalizeform(word)
+    created = 'models' if stable_created else 'first'
+    return analysiscachekey('response','\x1f'.join([output_format,bestmediatype(),created,word_uri,form]),engine,lang)
+
+'''
+returns the cached serialized response for key, if there is one
+'''
+def cachedresponse(key,code,headers=None,mimetype=None):
+    body = counted(cache.get(key),None,'response')
+    if body is None:
+        return None
+    response = Response(body, code, mimetype=mimetype or bestmediatype())
+    response.headers.extend(headers or {})
+    return response
+
+'''
+Set MORPHSERVICE_HTTP_MAX_AGE to a number of seconds to let browsers and
+reverse proxies cache the analyses of single words for that long. The
+responses to GET requests then have stable body ids, are created when the
+engine's models last changed, and carry a strong ETag derived from the
+engine version and the request, Cache-Control and Last-Modified headers.
+Conditional requests are answered with 304 before anything is analyzed.
+'''
+HTTP_MAX_AGE = os.environ.get('MORPHSERVICE_HTTP_MAX_AGE')
+
+'''
+returns the http caching headers of the response to the current request
+for the analysis of a word, or None if it isn't cacheable
+'''
+def wordcacheheaders(output_format,word,word_uri,engine,lang):
+    if HTTP_MAX_AGE is None or request.method != 'GET':
+        return None
+    request_id = '\x1f'.join([engine.id, engine.version, lang, output_format, bestmediatype(), word_uri, word])
+    headers = {
+        'ETag': '"%s"' % hashlib.sha1(request_id.encode('utf-8')).hexdigest(),
+        'Cache-Control': 'public, max-age=%d' % int(HTTP_MAX_AGE),
+        'Vary': 'Accept'
+    }
+    if engine.modified is not None:
+        headers['Last-Modified'] = http_date(engine.modified)
+    return headers
+
+'''
+the created time of cacheable analyses, which is when the models of the
+engine last changed
+'''
+def stablecreated(engine):
+    return datetime.utcfromtimestamp(engine.modified or 0).isoformat()
+
+'''
+returns a 304 response when the client already has the response with the
+given caching headers, None when it needs the response
+'''
+def notmodified(headers,engine):
+    if request.if_none_match:
+        fresh = request.if_none_match.contains_weak(headers['ETag'][1:-1])
+    else:
+        since = request.if_modified_since
+        fresh = since is not None and engine.modified is not None and calendar.timegm(since.utctimetuple()) >= engine.modified
+    if not fresh:
+        return None
+    response = Response(status=304)
+    response.headers.extend(headers)
+    return response
+
 '''
 Responds to a Alpheios Legacy API Request
 '''        
+'''
+the legacy alpheios api is xml only, whatever the client accepts
+'''
+def alpheiosresponse(data, code, headers=None):
+    response = output_xml(data, code, headers)
+    response.mimetype = 'application/xml'
+    return response
+
 class AlpheiosWordList(Resource):
     def get(self):
         parser = reqparse.RequestParser()
         parser.add_argument('word')
         args = parser.parse_args()
         word = args['word']
+        if not word:
+            return alpheiosresponse(*make_error("must supply a word",400))
         word_uri = 'urn:word:'+word
-        cached_word = cache.get(word)
-        if cached_word is None:
-            analysis = hazmtoalpheios(word,word_uri)
-            cache.set(word, analysis)
-        else:
-            analysis = cached_word
-        return { 'data': analysis, 'format': 'alpheios' }
+        engine = getengine('hazm')
+        headers = wordcacheheaders('alpheios',word,word_uri,engine,'per')
+        if headers:
+            response = notmodified(headers,engine)
+            if response is not None:
+                return response
+        if CACHE_RESPONSES:
+            response_key = responsecachekey('alpheios',word,word_uri,engine,'per')
+            response = cachedresponse(response_key,200,headers,'application/xml')
+            if response is not None:
+                return response
+        analysis = wordanalysis(word,word_uri,engine,'per')
+        result = { 'data': analysis, 'format': 'alpheios' }
+        if CACHE_RESPONSES:
+            result['response_key'] = response_key
+        return alpheiosresponse(result,200,headers)
  
 '''
 Responds to Request for analysis of a single word
@@ -431,231 +829,369 @@ class AnalysisWord(Resource):
         parser.add_argument('engine')
         parser.add_argument('lang')
         parser.add_argument('word')
-        parser.add_argument('word_uri', required = False, type = str, location = 'HTTP')
+        parser.add_argument('words', action = 'append')
+        parser.add_argument('word_uri', required = False, type = str)
         args = parser.parse_args()
         lang = args['lang']
         engine = args['engine']
-        word = args['word']
-        word_uri = args["word_uri"]
-        cached_word = cache.get(word)
-        if cached_word is None:
-            if not word_uri:
-                word_uri = 'urn:word:'+word
-            if lang != 'per':
-                return make_error("unsupported language",404)
-            if engine == "hazm":
-                analysis = hazmtoalpheios(word,word_uri)
-                cache.set(word, analysis)
-                return { 'data': analysis, 'format':'bsp' },201
-            else:
-                return make_error("unknown engine",404)
-        else:
-            analysis = cached_word
-            return { 'data': analysis, 'format':'bsp' },201
+        if args['words']:
+            return self.analyzebatch(args['words'],engine,lang)
+        return self.analyzeword(args['word'],args['word_uri'],engine,lang)
     
     def post(self):
         parser = reqparse.RequestParser()
         parser.add_argument('engine')
         parser.add_argument('lang')
         parser.add_argument('word')
-        parser.add_argument('word_uri', required = False, type = str, location = 'HTTP')
+        parser.add_argument('words', action = 'append')
+        parser.add_argument('word_uri', required = False, type = str)
         args = parser.parse_args()
         lang = args['lang']
         engine = args['engine']
-        word = args['word']
-        word_uri = args['word_uri']
-        cached_word = cache.get(word)
-        if cached_word is None:
-            if not word_uri:
-                word_uri = 'urn:word:'+word
-            if lang != 'per':
-                return make_error("unsupported language",404)
-            if engine == "hazm":
-                analysis = hazmtoalpheios(word,word_uri)
-                cache.set(word, analysis)
-                return { 'data': analysis, 'format':'bsp' },201
-            else:
-                return make_error("unknown engine",404)
-        else:
-            analysis = cached_word
-            return { 'data': analysis, 'format':'bsp' },201 
+        if args['words']:
+            return self.analyzebatch(args['words'],engine,lang)
+        return self.analyzeword(args['word'],args['word_uri'],engine,lang)
+
+    def analyzeword(self, word, word_uri, engine_id, lang):
+        if not word:
+            return make_error("must supply a word or words",400)
+        engine, error = selectengine(engine_id,lang,WORD)
+        if error:
+            return error
+        if not word_uri:
+            word_uri = 'urn:word:'+word
+        headers = wordcacheheaders('bsp',word,word_uri,engine,lang)
+        if headers:
+            response = notmodified(headers,engine)
+            if response is not None:
+                return response
+        # cacheable answers are plain 200s, which http caches store
+        code = 200 if headers else 201
+        if CACHE_RESPONSES:
+            response_key = responsecachekey('bsp',word,word_uri,engine,lang,headers is not None)
+            response = cachedresponse(response_key,code,headers)
+            if response is not None:
+                return response
+        analysis = wordanalysis(word,word_uri,engine,lang)
+        result = { 'data': analysis, 'format':'bsp' }
+        if headers:
+            result['created'] = stablecreated(engine)
+        if CACHE_RESPONSES:
+            result['response_key'] = response_key
+        return result,code,headers
+
+    '''
+    analyzes a list of words in one engine pass, returning one annotation
+    per distinct word. Words already in the cache don't reach the engine.
+    '''
+    def analyzebatch(self, words, engine_id, lang):
+        engine, error = selectengine(engine_id,lang,WORDS)
+        if error:
+            return error
+        distinct = []
+        keys = {}
+        seen = set()
+        for word in words:
+            if word:
+                key = wordcachekey(word,engine,lang)
+                if key not in seen:
+                    seen.add(key)
+                    keys[word] = key
+                    distinct.append(word)
+        cached = dict(zip(distinct, cache.get_many(*[keys[word] for word in distinct])))
+        misses = [word for word in distinct if counted(cached[word],engine.id) is None]
+        if misses:
+            results = engine.analyze_batch(misses,['urn:word:'+word for word in misses])
+            computed = dict(zip(misses, results))
+            cache.set_many(dict((keys[word], computed[word]) for word in misses))
+            cached.update(computed)
+        analysis = []
+        for word in distinct:
+            analysis.extend(withuri(cached[word],'urn:word:'+word))
+        return { 'data': analysis, 'format':'bsp' },201
     
+'''
+Remote documents and texts are only fetched when their analysis isn't cached.
+A cached analysis is served for DOCUMENT_MAX_AGE seconds and after that
+revalidated with a conditional request, so unchanged documents are neither
+transferred nor analyzed again.
+'''
+fetcher = DocumentFetcher(timeout=10, max_bytes=10 * 1024 * 1024)
+DOCUMENT_MAX_AGE = 300
+
+'''
+the environ key of the DeferredFetches of a request whose server makes its
+fetches itself (see app/asgi.py)
+'''
+DEFERRED_FETCHES = 'morphservice.deferred_fetches'
+
+'''
+fetches uri, or takes the outcome of the fetch from the server when it
+makes the request's fetches
+'''
+def fetchremote(uri,etag=None,last_modified=None):
+    deferred = request.environ.get(DEFERRED_FETCHES) if has_request_context() else None
+    if deferred is None:
+        with metrics.timer('fetch'):
+            return fetcher.fetch(uri, etag, last_modified)
+    fetched, seconds = deferred.fetch(uri, etag, last_modified)
+    metrics.observe('fetch', seconds)
+    return fetched
+
+'''
+looks up the cached analysis of a remote text, revalidating it once it has
+gone stale. Returns (analysis, None) when there is an analysis to serve and
+(None, fetched) when the freshly fetched text needs analyzing.
+'''
+def cachedremote(cache_key,uri,engine):
+    entry = counted(cache.get(cache_key),engine.id)
+    if entry is None:
+        return None, fetchremote(uri)
+    if time.time() - entry['checked'] < DOCUMENT_MAX_AGE:
+        return entry['analysis'], None
+    fetched = fetchremote(uri, entry['etag'], entry['last_modified'])
+    metrics.count('revalidate', 'modified' if fetched.modified else 'unmodified')
+    if fetched.modified:
+        return None, fetched
+    cache.set(cache_key, dict(entry, checked=time.time()))
+    return entry['analysis'], None
+
+'''
+makes the cache entry for the analysis of a fetched text, minus the analysis
+'''
+def remoteentry(fetched):
+    return { 'etag': fetched.etag, 'last_modified': fetched.last_modified, 'checked': time.time() }
+
+'''
+analyzes a remote document in full and caches the analysis, returning
+the cache key it is stored under. This is what document jobs run.
+'''
+def analyzedocument(engine,doc_id,cache_key,chunks=False):
+    analysis, fetched = cachedremote(cache_key,doc_id,engine)
+    if analysis is None:
+        analysis = list(engine.analyze_text(fetched.text,doc_id,chunks))
+        # the result is only handed over through the cache, so a job whose
+        # analysis can't be kept there fails instead of being done without one
+        if len(analysis) > STREAM_CACHE_LIMIT:
+            raise ValueError('the analysis of %s has %d words, too many to keep as a job result; request it with wait=true' % (doc_id, len(analysis)))
+        if not cache.set(cache_key, dict(remoteentry(fetched), analysis=analysis)):
+            cache.delete(cache_key)
+            raise ValueError('the analysis of %s could not be stored as a job result; request it with wait=true' % doc_id)
+    return cache_key
+
+'''
+reads the wait argument of a document request. Requests wait for their
+analysis unless they say otherwise.
+'''
+def iswait(value):
+    return value is None or value.lower() in ('1', 'true', 'yes')
+
 class AnalysisDoc(Resource):
-    def get(self, doc):
-        parser = reqparse.RequestParser()
-        parser.add_argument('document_id', required = True, type=str, location = 'HTTP')
-        parser.add_argument('engine', required = True, type = str, location = 'HTTP')
-        parser.add_argument('lang', required = True, type = str, location = 'HTTP')
-        parser.add_argument('wait', required = False, type = str, location = 'HTTP')
-        args = parser.parse_args()
-        doc_id = args['document_id']
-        engine = args['engine']
-        lang = args['lang']
-        doc = urllib.request.urlopen(doc_id)
-        cached_doc = cache.get(doc_id)
-        if cached_doc is None:
-            if lang != 'per':
-                return make_error('unsupported language',404)
-            if engine == 'hazm':
-                analysis = hazmtoalpheios(doc)
-                cache.set(doc_id, analysis)
-                return { 'data': analysis, 'format':'bsp' },201
-            else:
-                return make_error('unsupported engine',404)
-        else:
-            analysis = cached_doc
-            return { 'data': analysis, 'format':'bsp' },201
-        
-    def post(self, doc):
+    def get(self):
+        return self.analyze()
+
+    def post(self):
+        return self.analyze()
+
+    def analyze(self):
         parser = reqparse.RequestParser()
-        parser.add_argument('document_id', required = True, type=str, location = 'HTTP')
-        parser.add_argument('engine', required = True, type = str, location = 'HTTP')
-        parser.add_argument('lang', required = True, type = str, location = 'HTTP')
-        parser.add_argument('wait', required = False, type = str, location = 'HTTP')
+        parser.add_argument('document_id', required = True, type=str)
+        parser.add_argument('engine', required = True, type = str)
+        parser.add_argument('lang', required = True, type = str)
+        parser.add_argument('wait', required = False, type = str)
+        parser.add_argument('chunks', required = False, type = str)
         args = parser.parse_args()
         doc_id = args['document_id']
-        engine = args['engine']
         lang = args['lang']
-        wait = args['wait']
-        doc = urllib.request.urlopen(doc_id)
-        cached_doc = cache.get(doc_id)
-        if cached_doc is None:
-            if lang != 'per':
-                return make_error('unsupported language',404)
-            if wait == True:
-                if engine == 'hazm':
-                    analysis = hazmtoalpheios(doc)
-                    cache.set(doc_id, analysis)
-                    return { 'data': analysis, 'format':'bsp' },201
-                else:
-                    return make_error('unsupported engine',404)
-        else:
-            analysis = cached_doc
-            return { 'data': analysis, 'format':'bsp' },201
-            
+        wait = iswait(args['wait'])
+        chunks = isyes(args['chunks'])
+        engine, error = selectengine(args['engine'],lang,*([DOCUMENT, CHUNKS] if chunks else [DOCUMENT]))
+        if error:
+            return error
+        cache_key = analysiscachekey(textkind('document',chunks),doc_id,engine,lang)
+        if not wait:
+            cached_doc = cache.get(cache_key)
+            if cached_doc is not None and time.time() - cached_doc['checked'] < DOCUMENT_MAX_AGE:
+                return { 'data': cached_doc['analysis'], 'format':'bsp', 'stream': True },201
+            job_id = jobs.submit(analyzedocument, engine, doc_id, cache_key, chunks)
+            # without a place to keep the job, the analysis is answered
+            # here as if the client had waited for it
+            if job_id is not None:
+                job_uri = api.url_for(AnalysisJob, job_id=job_id, _external=True)
+                return { 'data': { 'id': job_id, 'status': QUEUED, 'uri': job_uri }, 'format':'job' },202,{ 'Location': job_uri }
+        try:
+            analysis, fetched = cachedremote(cache_key,doc_id,engine)
+        except FetchError as e:
+            return make_error(str(e),e.code)
+        if analysis is not None:
+            return { 'data': analysis, 'format':'bsp', 'stream': True },201
+        analysis = engine.analyze_text(fetched.text,doc_id,chunks)
+        analysis = cachestream(cache_key, analysis, STREAM_CACHE_LIMIT, remoteentry(fetched))
+        return { 'data': analysis, 'format':'bsp', 'stream': True },201
+
+'''
+Reports on a document analysis job, serving its analysis once it is done
+'''
+class AnalysisJob(Resource):
+    def get(self, job_id):
+        job = jobs.get(job_id)
+        if job is None:
+            return make_error('unknown job',404)
+        status = { 'id': job_id, 'status': job['status'], 'uri': api.url_for(AnalysisJob, job_id=job_id, _external=True) }
+        if job['status'] == DONE:
+            cached_doc = cache.get(job['result_key'])
+            if cached_doc is None:
+                return make_error('job result has expired',410)
+            return { 'data': cached_doc['analysis'], 'format':'bsp', 'stream': True },200
+        if job['status'] == FAILED:
+            # the job failed, not the request for its status
+            status['error'] = job['error']
+            return { 'data': status, 'format':'job' },200
+        return { 'data': status, 'format':'job' },202
+
 class AnalysisText(Resource):
-    def get(self, text):
-        parser = reqparse.RequestParser()
-        parser.add_argument('mime_type')
-        parser.add_argument('lang')
-        parser.add_argument('engine', required = False)
-        parser.add_argument('text_uri', required = False, type = str, location = 'HTTP')
-        parser.add_argument('text', required = False, type = str, location = 'HTTP')        
-        args = parser.parse_args()
-        lang = args['lang']
-        engine = args['engine']
-        mime_type = args['mime_type']
-        text = args['text']
-        text_uri = ["text_uri"]
-        cached_text = cache.get(text_uri)
-        if cached_text is None:
-            if not engine:
-                engine = 'hazm'
-            if not text_uri or text:
-                return make_error("must supply either a text or a text URI",400)
-            if not text_uri:
-                text_uri = "unknown text"
-            if not text:
-                text = urllib.request.urlopen(text_uri)
-            if lang != 'per':
-                return make_error("unsupported language",404)
-            if mime_type == 'text/plain':           
-                if engine == "hazm":
-                    analysis = hazmtoalpheios(text,text_uri)
-                    cache.set(text_uri, anaylsis)
-                    return { 'data': analysis, 'format':'bsp' },201
-                else:
-                    return make_error("unknown engine",404)
-            else:
-                if mime_type == 'text/html':
-                    return make_error("unsupported Mime_type",415)
-                else:
-                    if mime_type == 'text/xml':
-                        return make_error('unsupported Mime_type',415)
-                    else:
-                        return make_error('unsupported Mime_type',415)
-        else:
-            analysis = cached_text
-            return { 'data': analysis, 'format':'bsp' },201
-        
-    def post(self, text):
+    def get(self):
+        return self.analyze()
+
+    def post(self):
+        return self.analyze()
+
+    def analyze(self):
         parser = reqparse.RequestParser()
         parser.add_argument('mime_type')
         parser.add_argument('lang')
         parser.add_argument('engine', required = False)
-        parser.add_argument('text_uri', required = False, type = str, location = 'HTTP')
-        parser.add_argument('text', required = False, type = str, location = 'HTTP')        
+        parser.add_argument('text_uri', required = False, type = str)
+        parser.add_argument('text', required = False, type = str)
+        parser.add_argument('chunks', required = False, type = str)
         args = parser.parse_args()
         lang = args['lang']
-        engine = args['engine']
         mime_type = args['mime_type']
         text = args['text']
-        text_uri = ["text_uri"]
-        cached_text = cache.get(text_uri)
+        text_uri = args['text_uri']
+        chunks = isyes(args['chunks'])
+        if not (text_uri or text):
+            return make_error("must supply either a text or a text URI",400)
+        engine, error = selectengine(args['engine'] or 'hazm',lang,*([TEXT, CHUNKS] if chunks else [TEXT]))
+        if error:
+            return error
+        if mime_type != 'text/plain':
+            return make_error('unsupported Mime_type',415)
+        if not text:
+            # texts only given by uri are cached like documents
+            cache_key = analysiscachekey(textkind('text_uri',chunks),text_uri,engine,lang)
+            try:
+                analysis, fetched = cachedremote(cache_key,text_uri,engine)
+            except FetchError as e:
+                return make_error(str(e),e.code)
+            if analysis is not None:
+                return { 'data': analysis, 'format':'bsp', 'stream': True },201
+            analysis = engine.analyze_text(fetched.text,text_uri,chunks)
+            analysis = cachestream(cache_key, analysis, STREAM_CACHE_LIMIT, remoteentry(fetched))
+            return { 'data': analysis, 'format':'bsp', 'stream': True },201
+        # texts supplied in the request are cached by their content
+        if not text_uri:
+            text_uri = "unknown text"
+        cache_key = analysiscachekey(textkind('text',chunks),text,engine,lang)
+        cached_text = counted(cache.get(cache_key),engine.id)
         if cached_text is None:
-            if not engine:
-                engine = 'hazm'
-            if not text_uri or text:
-                return make_error("must supply either a text or a text URI",400)
-            if not text_uri:
-                text_uri = "unknown text"
-            if not text:
-                text = urllib.request.urlopen(text_uri)
-            if lang != 'per':
-                return make_error("unsupported language",404)
-            if mime_type == 'text/plain':           
-                if engine == "hazm":
-                    analysis = hazmtoalpheios(text,text_uri)
-                    cache.set(text_uri, anaylsis)
-                    return { 'data': analysis, 'format':'bsp' },201
-                else:
-                    return make_error("unknown engine",404)
-            else:
-                if mime_type == 'text/html':
-                    return make_error("unsupported Mime_type",415)
-                else:
-                    if mime_type == 'text/xml':
-                        return make_error('unsupported Mime_type',415)
-                    else:
-                        return make_error('unsupported Mime_type',415)
+            analysis = engine.analyze_text(text,text_uri,chunks)
+            analysis = cachestream(cache_key, analysis, STREAM_CACHE_LIMIT)
+            return { 'data': analysis, 'format':'bsp', 'stream': True },201
         else:
-            analysis = cached_text
-            return { 'data': analysis, 'format':'bsp' },201
-        
-    def _init_(self):
-        self.reqparse = reqparse.RequestParser()
-        self.reqparse.add_argument('mime_type', required = True, type=str, location = 'HTTP')
-        self.reqparse.add_argument('text', required = False, type=str, location = 'HTTP')
-        self.reqparse.add_argument('text_uri', required = False, type=str, location = 'HTTP')
-        self.reqparse.add_argument('engine', required = True, type = str, location = 'HTTP')
-        self.reqparse.add_argument('lang', required = True, type = str, location = 'HTTP')
-        super(AnalysisWord, self).__init__()
-    
+            analysis = withuri(cached_text,text_uri)
+            return { 'data': analysis, 'format':'bsp', 'stream': True },201
+
 @api.representation('application/json')
 def output_json(data, code, headers=None): 
-    if data['format'] == 'bsp':
-        obj = tobspmorphjson(data['data'])
-    else:
-        # legacy alpheios api doesn't support json
-        # so only errors here
-        obj = {"error" : data['data'] }
-    resp = make_response(dumps(obj),code)
+    if data.get('stream') and data['format'] == 'bsp':
+        return streamresponse(streambspmorphjson(data['data'], shared=issharedbodies()), code, headers)
+    with metrics.timer('serialize'):
+        if data['format'] == 'bsp' and JSON_BACKEND == 'json':
+            body = bspjson(data['data'],isstable(data),data.get('created'),issharedbodies())
+        elif data['format'] == 'bsp':
+            body = dumpjson(tobspmorphjson(data['data'],isstable(data),data.get('created'),issharedbodies()))
+        elif data['format'] == 'job':
+            body = dumpjson({ 'job': data['data'] })
+        else:
+            body = dumpjson({"error" : data['data'] })
+    resp = make_response(body,code)
     resp.headers.extend(headers or {})
+    if 'response_key' in data:
+        cache.set(data['response_key'], resp.get_data())
     return resp
     
 @api.representation('application/xml')
 def output_xml(data, code, headers=None): 
-    if data['format'] == 'bsp':
-      xml = tobspmorphxml(data['data'])
-    elif data['format'] == 'alpheios':
-      xml = toalpheiosxml(data['data'])
-    else:
-        xml = etree.Element('error')
-        xml.text = data['data']
-    resp = make_response(etree.tostring(xml, pretty_print=True, xml_declaration=True, encoding='utf-8').decode(),code)
+    # text and document analyses are streamed whether they were cached or
+    # not, so that a url is answered the same way either way
+    if data.get('stream') and data['format'] == 'bsp':
+        return streamresponse(streambspmorphxml(data['data'], ispretty(), shared=issharedbodies()), code, headers)
+    with metrics.timer('serialize'):
+        if data['format'] == 'bsp':
+          body = bspxml(data['data'],isstable(data),data.get('created'),issharedbodies())
+        elif data['format'] == 'alpheios':
+          body = alpheiosxml(data['data'])
+        else:
+          if data['format'] == 'job':
+            xml = jobtoxml(data['data'])
+          else:
+            xml = etree.Element('error')
+            xml.text = data['data']
+          body = etree.tostring(xml, pretty_print=True, xml_declaration=True, encoding='utf-8')
+    resp = make_response(body,code)
     resp.headers.extend(headers or {})
+    if 'response_key' in data:
+        cache.set(data['response_key'], resp.get_data())
     return resp
     
+'''
+responses that are cached, here or by http caches, are serialized with
+stable body ids
+'''
+def isstable(data):
+    return 'response_key' in data or 'created' in data
+
+'''
+sends the chunks of a serializer as a chunked response as they are produced
+'''
+def streamresponse(chunks, code, headers=None):
+    resp = Response(stream_with_context(chunks), code)
+    resp.headers.extend(headers or {})
+    return resp
+
+'''
+Serves the stage timings and cache counters of this process in the
+Prometheus text format
+'''
+class MetricsAPI(Resource):
+    def get(self):
+        return Response(metrics.render(), 200, mimetype='text/plain; version=0.0.4')
+
+@app.before_request
+def startrequest():
+    metrics.startrequest()
+
+@app.after_request
+def endrequest(response):
+    timing = metrics.endrequest()
+    if timing:
+        response.headers['Server-Timing'] = timing
+    return response
+
+'''
+streamed xml is compact unless the client asks for it to be pretty printed
+'''
+def ispretty():
+    return request.values.get('pretty', '').lower() in ('1', 'true', 'yes')
+
+'''
+analyses list the body of each distinct entry once, the annotations of
+the words after it referring to it, when the client asks for shared bodies
+'''
+def issharedbodies():
+    return isyes(request.values.get('shared_bodies'))
+
 api.add_resource(EngineListAPI, '/morphologyservice/engine')
 api.add_resource(EngineAPI, '/morphologyservice/engine/<EngineId>')
 #api.add_resource(RepoListAPI, '/morphologyservice/repository', endpoint = 'tasks')
@@ -663,10 +1199,41 @@ api.add_resource(EngineAPI, '/morphologyservice/engine/<EngineId>')
 api.add_resource(AnalysisWord, '/morphologyservice/analysis/word')
 api.add_resource(AnalysisDoc, '/morphologyservice/analysis/document')
 api.add_resource(AnalysisText, '/morphologyservice/analysis/text')
+api.add_resource(AnalysisJob, '/morphologyservice/analysis/job/<job_id>')
+api.add_resource(MetricsAPI, '/morphologyservice/metrics')
 
 #this is the legacy Alpheios Service API
 api.add_resource(AlpheiosWordList, '/alpheiosservice/hazm')
 
+import_seconds = time.time() - import_started
+metrics.gauge('import_seconds', lambda: import_seconds, 'Time it took to import the app.')
+
+'''
+gets this process ready to answer requests: loads the models of the
+engines named in engine_ids (see preload), runs their sample word through
+them and the serializers, and answers a first request, so that none of
+that happens while a user waits. Returns how long it took, in seconds
+from when the process started importing the app.
+'''
+def warmup(engine_ids='all'):
+    start = time.time()
+    preload(engine_ids)
+    loaded = time.time()
+    for engine in engines():
+        if engine.loaded and engine.sample:
+            analysis = engine.analyze(engine.sample, 'urn:word:' + engine.sample)
+            bspjson(analysis)
+            bspxml(analysis)
+    client = app.test_client()
+    for mediatype in ('application/json', 'application/xml'):
+        client.get('/morphologyservice/engine', headers={'Accept': mediatype})
+    return {
+        'import_seconds': import_seconds,
+        'load_seconds': loaded - start,
+        'from_snapshot': pipeline.from_snapshot,
+        'first_response_seconds': metrics.first_response,
+        'ready_seconds': time.time() - import_started
+    }
 
 if __name__ == '__main__':
     app.run(debug=True)
@@ -0,0 +1,362 @@
+'''
+ASGI serving mode.
+
+Serves the same app, resources and serializers as app.wsgi from an asyncio
+event loop, under uvicorn, hypercorn or any other ASGI server:
+
+    uvicorn app.asgi:application --workers 4
+
+The event loop holds the connections, reads the request bodies and fetches
+remote documents, so idle keep-alive connections and slow document hosts
+don't tie up a thread each. A request goes to a pool of I/O threads once
+its body has arrived, and the app handles it there. When it gets to a
+document fetch, it stops: the fetch is made on the event loop and the
+request is then run again with the document (see app/fetch.py). Cache
+round trips are short and stay in the threads, as the cache clients are
+synchronous. Only a few of the threads at a time may analyze: the hazm
+analysis itself runs in the app's analysis slots, which are sized here.
+When the backlog of requests waiting for a slot, or for an I/O thread, is
+full, further requests are answered with 503 and Retry-After straight away
+instead of queuing up without bound. Requests waiting on a fetch don't
+count towards it.
+
+Responses are handed to the event loop as they are produced, and a thread
+only waits for the client once STREAM_BUFFER bytes of its response are
+unsent. A slow client reading a large streamed response does keep its I/O
+thread waiting (but not an analysis slot). A client that goes away stops
+its response from being produced any further.
+
+MORPHSERVICE_ASGI_THREADS sets how many requests may analyze at once (8
+by default), MORPHSERVICE_ASGI_IO_THREADS the size of the I/O pool (64)
+and MORPHSERVICE_ASGI_BACKLOG how many requests may wait for either (64).
+'''
+from __future__ import unicode_literals
+from concurrent.futures import ThreadPoolExecutor
+from app.fetch import AsyncDocumentFetcher, DeferredFetches
+import asyncio
+import io
+import os
+import sys
+import threading
+
+'''
+how many bytes of a response may be waiting to be sent before the thread
+producing them waits for the client to take some
+'''
+STREAM_BUFFER = 1024 * 1024
+
+'''
+how many times a request is run to make the fetches it wants on the event
+loop. A request still wanting one after that fetches in its thread.
+'''
+FETCH_ROUNDS = 3
+
+'''
+an error to answer a request with before it reaches the app
+'''
+class _HttpError(Exception):
+
+    def __init__(self, status, message, headers=()):
+        Exception.__init__(self, message)
+        self.status = status
+        self.headers = list(headers)
+
+'''
+makes the WSGI environ of an ASGI http request with the given body
+'''
+def makeenviron(scope, body):
+    root_path = scope.get('root_path', '')
+    path = scope['path']
+    if root_path and path.startswith(root_path):
+        path = path[len(root_path):]
+    server = scope.get('server') or ('localhost', None)
+    client = scope.get('client') or ('', 0)
+    environ = {
+        'REQUEST_METHOD': scope['method'],
+        'SCRIPT_NAME': root_path.encode('utf-8').decode('latin-1'),
+        'PATH_INFO': path.encode('utf-8').decode('latin-1'),
+        'QUERY_STRING': scope.get('query_string', b'').decode('latin-1'),
+        'SERVER_NAME': server[0],
+        'SERVER_PORT': str(server[1] or 80),
+        'SERVER_PROTOCOL': 'HTTP/' + scope.get('http_version', '1.1'),
+        'REMOTE_ADDR': client[0],
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        'wsgi.input': io.BytesIO(body),
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': True,
+        'wsgi.run_once': False
+    }
+    for name, value in scope.get('headers', []):
+        name = name.decode('latin-1').lower()
+        if name in ('content-type', 'content-length'):
+            key = name.upper().replace('-', '_')
+        else:
+            key = 'HTTP_' + name.upper().replace('-', '_')
+        value = value.decode('latin-1')
+        environ[key] = environ[key] + ',' + value if key in environ else value
+    # the body has been read whole, chunked or not
+    environ['CONTENT_LENGTH'] = str(len(body))
+    return environ
+
+'''
+the unsent part of a response, which the producing thread waits on once it
+is full
+'''
+class _Buffer(object):
+
+    def __init__(self, size):
+        self.size = size
+        self.unsent = 0
+        self.closed = False
+        self._changed = threading.Condition()
+
+    '''
+    makes room for a message of size bytes, which always fits an empty
+    buffer. Returns False if the response was abandoned.
+    '''
+    def take(self, size):
+        with self._changed:
+            while self.unsent and self.unsent + size > self.size and not self.closed:
+                self._changed.wait()
+            if self.closed:
+                return False
+            self.unsent += size
+            return True
+
+    def sent(self, size):
+        with self._changed:
+            self.unsent -= size
+            self._changed.notify()
+
+    def close(self):
+        with self._changed:
+            self.closed = True
+            self._changed.notify()
+
+def _startmessage(status, headers):
+    return {
+        'type': 'http.response.start',
+        'status': int(status.split(' ', 1)[0]),
+        'headers': [(name.lower().encode('latin-1'), value.encode('latin-1')) for name, value in headers]
+    }
+
+'''
+serves a WSGI app over ASGI, running it on a pool of io_threads threads.
+slots, if given, are the app's analysis slots, and are sized to let threads
+requests analyze at once. fetches_key, if given, is the environ key under
+which the app takes the DeferredFetches of a request, which fetcher makes.
+Requests are refused while backlog of them are waiting for a slot or for a
+thread. Request bodies larger than max_body bytes are refused. warmup, if
+given, is called on a pool thread when the server starts up, before it
+takes requests.
+'''
+class AsgiAdapter(object):
+
+    def __init__(self, wsgi_app, threads=8, backlog=64, io_threads=64, slots=None, fetches_key=None,
+            fetcher=None, max_body=16 * 1024 * 1024, warmup=None):
+        self.wsgi_app = wsgi_app
+        self.threads = threads
+        self.backlog = backlog
+        self.io_threads = io_threads
+        self.slots = slots
+        if slots is not None:
+            slots.size = threads
+        self.fetches_key = fetches_key
+        self.fetcher = fetcher or AsyncDocumentFetcher()
+        self.max_body = max_body
+        self.warmup = warmup
+        # only ever changed on the event loop
+        self.inflight = 0
+        self.threaded = 0
+        self.fetching = 0
+        self.rejected = 0
+        self._executor = ThreadPoolExecutor(max_workers=io_threads)
+
+    '''
+    whether the backlog of requests waiting for an analysis slot, or for a
+    thread, is full
+    '''
+    def busy(self):
+        if self.slots is not None and self.slots.waiting >= self.backlog:
+            return True
+        return self.threaded >= self.io_threads + self.backlog
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            return await self._lifespan(receive, send)
+        if scope['type'] != 'http':
+            if scope['type'] == 'websocket':
+                await send({'type': 'websocket.close'})
+            return
+        try:
+            body = await self._readbody(receive)
+            if body is None:
+                return
+            if self.busy():
+                self.rejected += 1
+                raise _HttpError(503, 'too busy, try again', [('Retry-After', '1')])
+        except _HttpError as e:
+            return await self._error(send, e)
+        self.inflight += 1
+        disconnected = asyncio.ensure_future(self._disconnected(receive))
+        try:
+            await self._respond(scope, body, send, disconnected)
+        finally:
+            disconnected.cancel()
+            self.inflight -= 1
+
+    '''
+    returns once the client has gone away
+    '''
+    async def _disconnected(self, receive):
+        while (await receive())['type'] != 'http.disconnect':
+            pass
+
+    '''
+    returns the whole body of the request, or None if the client went away
+    '''
+    async def _readbody(self, receive):
+        chunks = []
+        size = 0
+        while True:
+            message = await receive()
+            if message['type'] == 'http.disconnect':
+                return None
+            chunk = message.get('body', b'')
+            size += len(chunk)
+            if size > self.max_body:
+                raise _HttpError(413, 'request body too large')
+            chunks.append(chunk)
+            if not message.get('more_body'):
+                return b''.join(chunks)
+
+    async def _error(self, send, error):
+        await send(_startmessage('%d' % error.status, [('Content-Type', 'text/plain; charset=utf-8')] + error.headers))
+        await send({'type': 'http.response.body', 'body': str(error).encode('utf-8')})
+
+    '''
+    answers a request, making the fetches it wants on the event loop
+    between runs of the app
+    '''
+    async def _respond(self, scope, body, send, disconnected):
+        fetches = DeferredFetches() if self.fetches_key else None
+        for attempt in range(FETCH_ROUNDS):
+            environ = makeenviron(scope, body)
+            if fetches is not None and attempt < FETCH_ROUNDS - 1:
+                environ[self.fetches_key] = fetches
+            if not await self._run_app(environ, send, fetches, disconnected):
+                return
+            self.fetching += 1
+            try:
+                fetching = asyncio.ensure_future(fetches.run(self.fetcher))
+                await asyncio.wait([fetching, disconnected], return_when=asyncio.FIRST_COMPLETED)
+                if not fetching.done():
+                    fetching.cancel()
+                    return
+            finally:
+                self.fetching -= 1
+
+    '''
+    runs the app on a pool thread and sends the messages it produces as
+    they arrive. The thread waits once STREAM_BUFFER bytes of them are
+    unsent, so a large streamed response is produced only as fast as the
+    client reads it, while a smaller one frees its thread straight away.
+    Returns True if the app stopped to have a fetch made instead.
+    '''
+    async def _run_app(self, environ, send, fetches, disconnected):
+        loop = asyncio.get_running_loop()
+        messages = asyncio.Queue()
+        buffer = _Buffer(STREAM_BUFFER)
+        def put(message):
+            loop.call_soon_threadsafe(messages.put_nowait, message)
+        self.threaded += 1
+        try:
+            running = loop.run_in_executor(self._executor, self._run, environ, put, buffer, fetches)
+            try:
+                while True:
+                    message = asyncio.ensure_future(messages.get())
+                    await asyncio.wait([message, disconnected], return_when=asyncio.FIRST_COMPLETED)
+                    if not message.done():
+                        # the client went away: have the thread stop producing
+                        message.cancel()
+                        buffer.close()
+                        break
+                    message = message.result()
+                    if message is None:
+                        break
+                    await send(message)
+                    buffer.sent(len(message.get('body', b'')))
+            except BaseException:
+                buffer.close()
+                raise
+            return await running
+        finally:
+            self.threaded -= 1
+
+    def _run(self, environ, put, buffer, fetches):
+        response = {'sent': False}
+        def start_response(status, headers, exc_info=None):
+            if exc_info and response['sent']:
+                raise exc_info[1].with_traceback(exc_info[2])
+            response['start'] = _startmessage(status, headers)
+        def emit(message):
+            if not buffer.take(len(message.get('body', b''))):
+                return False
+            put(message)
+            return True
+        result = None
+        try:
+            result = self.wsgi_app(environ, start_response)
+            if fetches is not None and fetches.wanted is not None:
+                return True
+            for chunk in result:
+                if not response['sent']:
+                    if not emit(response['start']):
+                        return
+                    response['sent'] = True
+                if chunk and not emit({'type': 'http.response.body', 'body': chunk, 'more_body': True}):
+                    return
+            if not response['sent']:
+                emit(response['start'])
+            emit({'type': 'http.response.body', 'body': b'', 'more_body': False})
+            return False
+        finally:
+            if hasattr(result, 'close'):
+                result.close()
+            put(None)
+
+    async def _lifespan(self, receive, send):
+        loop = asyncio.get_running_loop()
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                try:
+                    if self.warmup is not None:
+                        await loop.run_in_executor(self._executor, self.warmup)
+                except Exception as e:
+                    await send({'type': 'lifespan.startup.failed', 'message': str(e)})
+                    return
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                self._executor.shutdown(wait=True)
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+from app import app, metrics, warmup, analysis_slots, DEFERRED_FETCHES
+
+application = AsgiAdapter(app,
+    threads=int(os.environ.get('MORPHSERVICE_ASGI_THREADS', 8)),
+    backlog=int(os.environ.get('MORPHSERVICE_ASGI_BACKLOG', 64)),
+    io_threads=int(os.environ.get('MORPHSERVICE_ASGI_IO_THREADS', 64)),
+    slots=analysis_slots,
+    fetches_key=DEFERRED_FETCHES,
+    warmup=lambda: warmup(os.environ.get('MORPHSERVICE_PRELOAD', 'hazm')))
+
+metrics.gauge('asgi_inflight', lambda: application.inflight, 'Requests being handled, in a thread or not.')
+metrics.gauge('asgi_threaded', lambda: application.threaded, 'Requests running in a thread or waiting for one.')
+metrics.gauge('asgi_fetching', lambda: application.fetching, 'Requests waiting on a document fetch, in no thread.')
+metrics.gauge('asgi_rejected', lambda: application.rejected, 'Requests turned away because the backlog was full.')
+metrics.gauge('asgi_analyzing', lambda: analysis_slots.busy, 'Requests analyzing in a slot.')
+metrics.gauge('asgi_analysis_waiting', lambda: analysis_slots.waiting, 'Requests waiting for an analysis slot.')
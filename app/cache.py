@@ -0,0 +1,326 @@
+'''
+Analysis cache.
+
+Cache keys are built from everything that determines an analysis (what is
+being analyzed, the engine and its version, the language and the form) and
+hashed so that they are always valid memcached keys. The TieredCache keeps
+a bounded in-process LRU in front of the shared cache so that hot words are
+served without leaving the worker.
+
+Analyses missing from the cache are computed once however many requests
+ask for them at the same time (single flight): the threads of a worker
+wait for the one computing it, and the workers sharing the cache wait
+for the one holding a short lease on it, taken with the backend's add.
+'''
+from __future__ import unicode_literals
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from werkzeug.contrib.cache import BaseCache
+import hashlib
+import os
+import threading
+import time
+
+'''
+how long, in seconds, a worker may compute a missing value for before the
+others stop waiting for it, and how often they check whether it is done
+'''
+LEASE_TIMEOUT = 5
+LEASE_POLL = 0.02
+
+'''
+makes a memcached-safe key for a cached analysis. kind distinguishes what is
+cached (a word analysis, a text analysis, ...), form is the word, text or
+uri that was analyzed.
+'''
+def makecachekey(kind, engine, lang, form, version):
+    raw = '\x1f'.join([kind, engine or '', lang or '', version or '', form or ''])
+    return 'morph:' + kind + ':' + hashlib.sha1(raw.encode('utf-8')).hexdigest()
+
+class _Untimed(object):
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        pass
+
+_untimed = _Untimed()
+
+'''
+a computation other threads can wait for the value of
+'''
+class _Flight(object):
+    __slots__ = ('done', 'value', 'error')
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.value = None
+        self.error = None
+
+'''
+a two-tier cache: a bounded in-process LRU in front of a shared backend
+such as MemcachedCache. It implements the werkzeug cache API so it can
+be used wherever the backend was. The LRU is bounded by its number of
+values, so local_kinds, if given, limits it to the keys of those kinds
+(see makecachekey) whose values are small; the others are only kept in
+the backend. If timer is given, every round trip to
+the backend is timed in a timer('cache') block. With stale_while_revalidate,
+values got with getorcompute() that have less than that many seconds left
+to live are still served, but computed again in the background.
+'''
+class TieredCache(BaseCache):
+
+    def __init__(self, backend, maxsize=10000, default_timeout=300, timer=None, stale_while_revalidate=0, local_kinds=None):
+        BaseCache.__init__(self, default_timeout)
+        self.backend = backend
+        self.maxsize = maxsize
+        self._local_prefixes = None if local_kinds is None else tuple('morph:%s:' % kind for kind in local_kinds)
+        self.timer = timer
+        self.stale_while_revalidate = stale_while_revalidate
+        self._local = OrderedDict()
+        self._lock = threading.Lock()
+        self._flights = {}
+        self._revalidating = set()
+        self._revalidator = None
+        self._stats = {
+            'local': {'hits': 0, 'misses': 0},
+            'backend': {'hits': 0, 'misses': 0},
+            'flights': {'computed': 0, 'coalesced': 0, 'revalidated': 0}
+        }
+
+    def _expires(self, timeout):
+        if timeout is None:
+            timeout = self.default_timeout
+        if timeout == 0:
+            return None
+        return time.time() + timeout
+
+    def _islocal(self, key):
+        return self._local_prefixes is None or key.startswith(self._local_prefixes)
+
+    def _getlocal(self, key):
+        if not self._islocal(key):
+            return None
+        with self._lock:
+            item = self._local.get(key)
+            if item is not None and item[0] is not None and item[0] < time.time():
+                del self._local[key]
+                item = None
+            if item is None:
+                self._stats['local']['misses'] += 1
+                return None
+            self._local.move_to_end(key)
+            self._stats['local']['hits'] += 1
+            return item[1]
+
+    def _setlocal(self, key, value, timeout=None):
+        if not self._islocal(key):
+            return
+        with self._lock:
+            self._local[key] = (self._expires(timeout), value)
+            self._local.move_to_end(key)
+            while len(self._local) > self.maxsize:
+                self._local.popitem(last=False)
+
+    def _timed(self):
+        return self.timer('cache') if self.timer else _untimed
+
+    def _count(self, tier, hit):
+        self._bump(tier, 'hits' if hit else 'misses')
+
+    def _bump(self, tier, counter):
+        with self._lock:
+            self._stats[tier][counter] += 1
+
+    def get(self, key):
+        value = self._getlocal(key)
+        if value is not None:
+            return value
+        with self._timed():
+            value = self.backend.get(key)
+        self._count('backend', value is not None)
+        if value is not None:
+            self._setlocal(key, value)
+        return value
+
+    def get_many(self, *keys):
+        values = [self._getlocal(key) for key in keys]
+        missing = [key for key, value in zip(keys, values) if value is None]
+        if missing:
+            with self._timed():
+                found = dict(zip(missing, self.backend.get_many(*missing)))
+            for key in missing:
+                self._count('backend', found[key] is not None)
+                if found[key] is not None:
+                    self._setlocal(key, found[key])
+            values = [found[key] if value is None else value for key, value in zip(keys, values)]
+        return values
+
+    def set(self, key, value, timeout=None):
+        self._setlocal(key, value, timeout)
+        with self._timed():
+            return self.backend.set(key, value, timeout)
+
+    def set_many(self, mapping, timeout=None):
+        for key, value in mapping.items():
+            self._setlocal(key, value, timeout)
+        with self._timed():
+            return self.backend.set_many(mapping, timeout)
+
+    def add(self, key, value, timeout=None):
+        with self._timed():
+            added = self.backend.add(key, value, timeout)
+        if added:
+            self._setlocal(key, value, timeout)
+        return added
+
+    def has(self, key):
+        with self._lock:
+            if key in self._local:
+                return True
+        with self._timed():
+            return self.backend.has(key)
+
+    def delete(self, key):
+        with self._lock:
+            self._local.pop(key, None)
+        with self._timed():
+            return self.backend.delete(key)
+
+    def clear(self):
+        with self._lock:
+            self._local.clear()
+        return self.backend.clear()
+
+    '''
+    returns (value, result), the value cached for key or, if there is none,
+    the one compute() returns, which is then cached. result tells where the
+    value came from: 'hit' for the cache, 'miss' if it was computed here and
+    'coalesced' if it was computed by a concurrent request for the same key.
+    '''
+    def getorcompute(self, key, compute, timeout=None):
+        now = time.time()
+        item = None
+        if self._islocal(key):
+            with self._lock:
+                item = self._local.get(key)
+                if item is not None and item[0] is not None and item[0] < now:
+                    del self._local[key]
+                    item = None
+                if item is not None:
+                    self._local.move_to_end(key)
+                self._stats['local']['hits' if item is not None else 'misses'] += 1
+        if item is not None:
+            if self.stale_while_revalidate and item[0] is not None and item[0] - now < self.stale_while_revalidate:
+                self._revalidate(key, compute, timeout)
+            return item[1], 'hit'
+        with self._timed():
+            value = self.backend.get(key)
+        self._count('backend', value is not None)
+        if value is not None:
+            self._setlocal(key, value, timeout)
+            return value, 'hit'
+        return self._fly(key, compute, timeout)
+
+    def _fly(self, key, compute, timeout):
+        with self._lock:
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = _Flight()
+        if not leader:
+            # another thread of this worker is computing it
+            if flight.done.wait(LEASE_TIMEOUT):
+                if flight.error is not None:
+                    raise flight.error
+                self._bump('flights', 'coalesced')
+                return flight.value, 'coalesced'
+            value = compute()
+            self.set(key, value, timeout)
+            self._bump('flights', 'computed')
+            return value, 'miss'
+        try:
+            flight.value, result = self._leased(key, compute, timeout)
+            return flight.value, result
+        except Exception as e:
+            flight.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._flights[key]
+            flight.done.set()
+
+    def _lease(self, key):
+        with self._timed():
+            return self.backend.add(key + ':lease', os.getpid(), LEASE_TIMEOUT)
+
+    def _release(self, key):
+        with self._timed():
+            self.backend.delete(key + ':lease')
+
+    def _leased(self, key, compute, timeout):
+        leased = self._lease(key)
+        deadline = time.time() + LEASE_TIMEOUT
+        while not leased:
+            # another worker is computing it: wait for its value until the
+            # lease runs out
+            with self._timed():
+                value = self.backend.get(key)
+            if value is not None:
+                self._setlocal(key, value, timeout)
+                self._bump('flights', 'coalesced')
+                return value, 'coalesced'
+            with self._timed():
+                holder = self.backend.get(key + ':lease')
+            if holder is None:
+                # the lease was given up without a value, or the backend
+                # isn't keeping leases at all
+                leased = self._lease(key)
+                break
+            if time.time() >= deadline:
+                break
+            time.sleep(LEASE_POLL)
+        try:
+            value = compute()
+            self.set(key, value, timeout)
+            self._bump('flights', 'computed')
+            return value, 'miss'
+        finally:
+            if leased:
+                self._release(key)
+
+    def _revalidate(self, key, compute, timeout):
+        with self._lock:
+            if key in self._revalidating:
+                return
+            self._revalidating.add(key)
+            if self._revalidator is None:
+                self._revalidator = ThreadPoolExecutor(max_workers=1)
+        self._revalidator.submit(self._revalidated, key, compute, timeout)
+
+    def _revalidated(self, key, compute, timeout):
+        try:
+            # only one of the workers computes it again, the others keep
+            # serving what they have until it arrives
+            if not self._lease(key):
+                return
+            try:
+                self.set(key, compute(), timeout)
+                self._bump('flights', 'revalidated')
+            finally:
+                self._release(key)
+        except Exception as e:
+            print("unable to revalidate %s: %s" % (key, e))
+        finally:
+            with self._lock:
+                self._revalidating.discard(key)
+
+    '''
+    returns the hits and misses of each tier and the size of the local one
+    '''
+    def stats(self):
+        with self._lock:
+            stats = dict((tier, dict(counts)) for tier, counts in self._stats.items())
+            stats['local']['size'] = len(self._local)
+            stats['local']['maxsize'] = self.maxsize
+        return stats
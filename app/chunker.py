@@ -0,0 +1,332 @@
+'''
+Compact phrase chunker.
+
+hazm's Chunker runs a Wapiti CRF model through libwapiti, which parses the
+text model into its own structures in every process that loads it. Here
+the model is compiled once into a flat binary file instead: the weights as
+a dense array of doubles, the observation strings with an open addressing
+hash table over them, and the offsets of each observation's weights. The
+file is memory mapped read only, so every worker process on a machine
+shares the same pages, and labeled with the same Viterbi decoding Wapiti
+does.
+
+Only the %x[offset,column] pattern command is supported, which is all the
+hazm models use. compilemodel() raises ValueError for a model using others.
+'''
+from __future__ import unicode_literals
+import json
+import mmap
+import os
+import struct
+import threading
+import zlib
+
+MAGIC = b'MSCRF001'
+NONE = 0xFFFFFFFF
+
+'''
+splits a Wapiti pattern such as u:wl=%x[-1,0] into its literal parts and
+(offset, column) references
+'''
+def parsepattern(pattern):
+    parts = []
+    rest = pattern
+    while rest:
+        start = rest.find('%')
+        if start == -1:
+            parts.append(rest)
+            break
+        if not rest.startswith('%x[', start):
+            raise ValueError('unsupported pattern command in ' + pattern)
+        end = rest.index(']', start)
+        if start:
+            parts.append(rest[:start])
+        offset, column = rest[start + 3:end].split(',')
+        parts.append((int(offset), int(column)))
+        rest = rest[end + 1:]
+    return parts
+
+def _readquarks(lines, count):
+    # quarks are written as <length in bytes>:<string>, with a trailing comma
+    quarks = []
+    for i in range(count):
+        length, _, text = next(lines).partition(b':')
+        quarks.append(text[:int(length)].decode('utf-8'))
+    return quarks
+
+'''
+reads a Wapiti text model, returning its patterns, labels, observations
+and the non-zero weights by index
+'''
+def readmodel(path):
+    with open(path, 'rb') as model:
+        lines = (line.rstrip(b'\n') for line in model)
+        header = next(lines)
+        if not header.startswith(b'#mdl#'):
+            raise ValueError('not a wapiti model: ' + path)
+        active = int(header.split(b'#')[3])
+        reader = next(lines)
+        if not reader.startswith(b'#rdr#'):
+            raise ValueError('not a wapiti model: ' + path)
+        patterns = _readquarks(lines, int(reader[5:].split(b'/')[0]))
+        labels = _readquarks(lines, int(next(lines)[5:]))
+        observations = _readquarks(lines, int(next(lines)[5:]))
+        weights = {}
+        for i in range(active):
+            index, _, value = next(lines).partition(b'=')
+            weights[int(index)] = float.fromhex(value.decode('ascii'))
+    return patterns, labels, observations, weights
+
+def _align(blob):
+    blob.extend(b'\0' * (-len(blob) % 8))
+
+'''
+compiles the Wapiti text model at model_path into the binary at path,
+writing it next to path first so that readers never see half of it
+'''
+def compilemodel(model_path, path):
+    patterns, labels, observations, weights = readmodel(model_path)
+    for pattern in patterns:
+        parsepattern(pattern)
+    Y = len(labels)
+    # the weights of each observation are laid out the way Wapiti does it:
+    # Y unigram weights for u: observations, Y * Y bigram weights for b:
+    # ones and both, unigram first, for * ones
+    uoffs = []
+    boffs = []
+    size = 0
+    for observation in observations:
+        uoff = boff = NONE
+        if observation[0] in 'u*':
+            uoff, size = size, size + Y
+        if observation[0] in 'b*':
+            boff, size = size, size + Y * Y
+        uoffs.append(uoff)
+        boffs.append(boff)
+    dense = [0.0] * size
+    for index, weight in weights.items():
+        dense[index] = weight
+    encoded = [observation.encode('utf-8') for observation in observations]
+    slots = 1
+    while slots < len(encoded) * 2:
+        slots *= 2
+    table = [0] * slots
+    for index, observation in enumerate(encoded):
+        slot = zlib.crc32(observation) & (slots - 1)
+        while table[slot]:
+            slot = (slot + 1) & (slots - 1)
+        table[slot] = index + 1
+    offsets = [0]
+    for observation in encoded:
+        offsets.append(offsets[-1] + len(observation))
+
+    sections = {}
+    body = bytearray()
+    for name, fmt, values in (('weights', 'd', dense), ('uoff', 'I', uoffs), ('boff', 'I', boffs),
+            ('table', 'I', table), ('offsets', 'I', offsets)):
+        sections[name] = (len(body), len(values))
+        body.extend(struct.pack('<%d%s' % (len(values), fmt), *values))
+        _align(body)
+    sections['strings'] = (len(body), offsets[-1])
+    body.extend(b''.join(encoded))
+    header = bytearray(json.dumps({
+        'patterns': patterns,
+        'labels': labels,
+        'sections': sections,
+        'source': os.path.basename(model_path)
+    }).encode('utf-8'))
+    _align(header)
+    # every process compiling the model at once writes a file of its own
+    building = '%s.%d' % (path, os.getpid())
+    try:
+        with open(building, 'wb') as out:
+            out.write(MAGIC)
+            out.write(struct.pack('<Q', len(header)))
+            out.write(header)
+            out.write(body)
+        os.replace(building, path)
+    except (IOError, OSError):
+        try:
+            os.remove(building)
+        except OSError:
+            pass
+        raise
+    return path
+
+'''
+a compiled chunker model, memory mapped read only. Labels sentences of
+(word, tag) pairs with the chunk labels Wapiti would give them.
+'''
+class CompactChunker(object):
+
+    def __init__(self, path):
+        with open(path, 'rb') as model:
+            self._mmap = mmap.mmap(model.fileno(), 0, access=mmap.ACCESS_READ)
+        if self._mmap[:8] != MAGIC:
+            raise ValueError('not a compiled chunker model: ' + path)
+        length = struct.unpack('<Q', self._mmap[8:16])[0]
+        header = json.loads(bytes(self._mmap[16:16 + length]).rstrip(b'\0').decode('utf-8'))
+        self.labels = header['labels']
+        self.patterns = [(pattern[0], parsepattern(pattern)) for pattern in header['patterns']]
+        start = 16 + length
+        view = memoryview(self._mmap)
+        def section(name, fmt):
+            offset, count = header['sections'][name]
+            size = struct.calcsize(fmt)
+            return view[start + offset:start + offset + count * size].cast(fmt)
+        self._weights = section('weights', 'd')
+        self._uoff = section('uoff', 'I')
+        self._boff = section('boff', 'I')
+        self._table = section('table', 'I')
+        self._offsets = section('offsets', 'I')
+        offset, count = header['sections']['strings']
+        self._strings = view[start + offset:start + offset + count]
+        self._mask = len(self._table) - 1
+
+    def __len__(self):
+        return len(self._uoff)
+
+    def _find(self, observation):
+        observation = observation.encode('utf-8')
+        slot = zlib.crc32(observation) & self._mask
+        while True:
+            index = self._table[slot]
+            if not index:
+                return None
+            index -= 1
+            if self._strings[self._offsets[index]:self._offsets[index + 1]] == observation:
+                return index
+            slot = (slot + 1) & self._mask
+
+    def _observations(self, tokens, t):
+        T = len(tokens)
+        for kind, parts in self.patterns:
+            observation = []
+            for part in parts:
+                if isinstance(part, tuple):
+                    position = t + part[0]
+                    if position < 0:
+                        observation.append('_x%d' % position)
+                    elif position >= T:
+                        observation.append('_x+%d' % (position - T + 1))
+                    else:
+                        observation.append(tokens[position][part[1]])
+                else:
+                    observation.append(part)
+            yield kind, ''.join(observation)
+
+    '''
+    returns the chunk label of every (word, tag) pair in sentence
+    '''
+    def tag(self, sentence):
+        if not sentence:
+            return []
+        Y = len(self.labels)
+        weights = self._weights
+        # Wapiti splits its input on whitespace, so hazm joins the words
+        # of multi word tokens with underscores
+        tokens = [[column.replace(' ', '_') for column in token] for token in sentence]
+        unigrams = []
+        bigrams = []
+        for t in range(len(tokens)):
+            ublocks = []
+            bblocks = []
+            for kind, observation in self._observations(tokens, t):
+                index = self._find(observation)
+                if index is None:
+                    continue
+                uoff = self._uoff[index]
+                if uoff != NONE:
+                    ublocks.append(weights[uoff:uoff + Y].tolist())
+                boff = self._boff[index]
+                if boff != NONE and t > 0:
+                    bblocks.append(weights[boff:boff + Y * Y].tolist())
+            # summed in the order Wapiti sums them, so the scores come out
+            # exactly the same
+            unigrams.append(list(map(sum, zip(*ublocks))) if ublocks else [0.0] * Y)
+            bigrams.append(list(map(sum, zip(*bblocks))) if bblocks else [0.0] * (Y * Y))
+        return [self.labels[y] for y in self._viterbi(unigrams, bigrams, Y)]
+
+    def _viterbi(self, unigrams, bigrams, Y):
+        # bigram[yp * Y + y] scores label yp followed by y, so the column
+        # bigram[y::Y] holds the scores of every label before y. Ties go to
+        # the lowest label, as in Wapiti.
+        scores = unigrams[0]
+        backpointers = []
+        for t in range(1, len(unigrams)):
+            bigram = bigrams[t]
+            current = []
+            pointers = []
+            for y, unigram in enumerate(unigrams[t]):
+                paths = [score + weight for score, weight in zip(scores, bigram[y::Y])]
+                best = max(paths)
+                current.append(best + unigram)
+                pointers.append(paths.index(best))
+            scores = current
+            backpointers.append(pointers)
+        y = scores.index(max(scores))
+        path = [y]
+        for pointers in reversed(backpointers):
+            y = pointers[y]
+            path.append(y)
+        path.reverse()
+        return path
+
+    def tag_sents(self, sentences):
+        return [self.tag(sentence) for sentence in sentences]
+
+'''
+labels sentences with hazm's own Chunker, for when the compact one isn't
+wanted. libwapiti isn't reentrant, so it is used by one thread at a time,
+and it runs sentences given to it together into one sequence, so they are
+labeled one at a time.
+'''
+class HazmChunker(object):
+
+    def __init__(self, model_path):
+        from hazm import Chunker
+        self._chunker = Chunker(model=model_path)
+        self._lock = threading.Lock()
+
+    def tag(self, sentence):
+        if not sentence:
+            return []
+        with self._lock:
+            tagged = self._chunker.tag_sents([sentence])[0]
+        return [word[-1] for word in tagged]
+
+    def tag_sents(self, sentences):
+        return [self.tag(sentence) for sentence in sentences]
+
+'''
+loads the chunker for the Wapiti model at model_path. A compact one is
+read from the compiled model next to it, which is (re)compiled when it is
+missing or older than the model. If it can't be written there the model is
+compiled into a temporary file, which then isn't shared with other workers
+and is removed once it is mapped.
+'''
+def loadchunker(model_path, compact=True):
+    if not compact:
+        return HazmChunker(model_path)
+    path = model_path + '.bin'
+    try:
+        fresh = os.path.getmtime(path) >= os.path.getmtime(model_path)
+    except OSError:
+        fresh = False
+    if not fresh:
+        try:
+            compilemodel(model_path, path)
+        except (IOError, OSError) as e:
+            import tempfile
+            print("unable to write %s, compiling the chunker model privately: %s" % (path, e))
+            handle, path = tempfile.mkstemp(suffix='.bin')
+            os.close(handle)
+            try:
+                compilemodel(model_path, path)
+                return CompactChunker(path)
+            finally:
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+    return CompactChunker(path)
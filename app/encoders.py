@@ -0,0 +1,309 @@
+'''
+Fast encoders for analyses.
+
+The lxml serializers in app build an element tree per response and the
+JSON one a tree of dicts, only to write them out straight away. These
+encoders write the same documents from string templates instead, byte for
+byte what lxml (pretty printed, with the namespace prefixes it makes up)
+and json.dumps give, and return them as UTF-8 bytes. The lxml and dict
+serializers stay the reference the encoders are checked against, see
+benchmarks/bench.py.
+
+Set MORPHSERVICE_JSON to orjson or ujson, when installed, to write JSON
+with those instead of json. They write the dicts of whole analyses faster
+still than the template does, as the same JSON but with less whitespace
+(and, with orjson, non-ASCII characters as UTF-8 rather than escaped).
+Streamed analyses are always written from the template.
+'''
+from __future__ import unicode_literals
+from json.encoder import encode_basestring_ascii
+import hashlib
+import json
+import os
+import re
+import uuid
+
+'''
+makes a uri for the annotation. This can be whatever makes sense
+for the service provider as long as its a valid URI
+'''
+def make_annotation_uri(word,engine):
+  return 'urn:PersDigUMDMorphologyService:'+word + ':' + engine
+
+'''
+makes a uri for the annotation creator. This can be whatever makes sense
+for the service provider as long as its a valid URI
+'''
+def make_creator_uri(engine):
+  return 'org.PersDigUMD:tools.' + engine + '.v1'
+
+'''
+makes a uri for an annotation body. Should be unique in the response.
+Bodies get a fresh uuid unless stable ids are asked for, in which case
+the uri is derived from the content of the entry so that the same
+analysis is always serialized the same way
+'''
+def make_body_uri(entry,engine,stable_ids=False):
+  if not stable_ids:
+    return str(uuid.uuid1().urn)
+  content = [engine, entry.lang, entry.hdwd]
+  for i in entry.infls:
+    content.extend([i.lang, i.stem] + ([i.pofs.order, i.pofs.name] if i.pofs else ['', '']))
+  return 'urn:PersDigUMDMorphologyService:body:' + hashlib.sha1('\x1f'.join(content).encode('utf-8')).hexdigest()
+
+'''
+hands out the uris of the bodies of a document. With shared, an entry the
+document had before keeps the uri of its first body, and the annotations
+after it refer to that body instead of repeating it, so a document has as
+many bodies as it has distinct entries rather than one per word.
+'''
+class BodyIds(object):
+
+    def __init__(self, stable_ids=False, shared=False):
+        self.stable_ids = stable_ids
+        self.shared = shared
+        self._uris = {}
+
+    '''
+    returns the uri of the body of entry, and whether the body is yet to be
+    written
+    '''
+    def uri(self, entry, engine):
+        if not self.shared:
+            return make_body_uri(entry, engine, self.stable_ids), True
+        key = (engine, entry.hdwd, entry.lang, tuple((i.stem, i.lang, i.pofs) for i in entry.infls))
+        uri = self._uris.get(key)
+        if uri is not None:
+            return uri, False
+        uri = self._uris[key] = make_body_uri(entry, engine, self.stable_ids)
+        return uri, True
+
+XML_DECLARATION = b"<?xml version='1.0' encoding='utf-8'?>\n"
+
+# characters lxml refuses to serialize
+_NOT_XML = re.compile('[\x00-\x08\x0b\x0c\x0e-\x1f\ud800-\udfff\ufffe\uffff]')
+_TEXT_ESCAPES = re.compile('[&<>\r]')
+_ATTRIBUTE_ESCAPES = re.compile('[&<>"\n\r\t]')
+
+def _checkxml(value):
+    if _NOT_XML.search(value):
+        raise ValueError('All strings must be XML compatible: Unicode or ASCII, no NULL bytes or control characters')
+
+'''
+escapes text content the way lxml does
+'''
+def xmltext(value):
+    _checkxml(value)
+    if _TEXT_ESCAPES.search(value):
+        value = value.replace('&', '&amp;').replace('<', '&lt;').replace('>', '&gt;').replace('\r', '&#13;')
+    return value
+
+'''
+escapes an attribute value the way lxml does
+'''
+def xmlattribute(value):
+    _checkxml(value)
+    if _ATTRIBUTE_ESCAPES.search(value):
+        value = value.replace('&', '&amp;').replace('<', '&lt;').replace('>', '&gt;').replace('"', '&quot;')
+        value = value.replace('\n', '&#10;').replace('\r', '&#13;').replace('\t', '&#9;')
+    return value
+
+def _leaf(name, text, attributes=''):
+    if text is None:
+        return '<%s%s/>' % (name, attributes)
+    return '<%s%s>%s</%s>' % (name, attributes, xmltext(text), name)
+
+'''
+joins the (depth, markup) lines of a document, indented two spaces per
+level as lxml pretty prints, or all on one line
+'''
+def _join(lines, pretty_print):
+    if pretty_print:
+        return ''.join('  ' * depth + markup + '\n' for depth, markup in lines)
+    return ''.join(markup for depth, markup in lines)
+
+def _entrylines(lines, entry, depth):
+    lines.append((depth, '<entry>'))
+    lines.append((depth + 1, '<dict>'))
+    lines.append((depth + 2, _leaf('hdwd', entry.hdwd, ' xml:lang="%s"' % xmlattribute(entry.lang))))
+    lines.append((depth + 1, '</dict>'))
+    for infl in entry.infls:
+        lines.append((depth + 1, '<infl>'))
+        lines.append((depth + 2, '<term xml:lang="%s">' % xmlattribute(infl.lang)))
+        lines.append((depth + 3, _leaf('stem', infl.stem)))
+        lines.append((depth + 2, '</term>'))
+        if infl.pofs:
+            lines.append((depth + 2, '<pofs order="%s">%s</pofs>' % (xmlattribute(infl.pofs.order), xmltext(infl.pofs.name))))
+        lines.append((depth + 1, '</infl>'))
+    lines.append((depth, '</entry>'))
+
+RDF_ROOT = '<rdf:RDF xmlns:rdf="http://www.w3.org/1999/02/22-rdf-syntax-ns#"'
+
+'''
+writes out the rdf annotations of a document, keeping count of the
+namespace prefixes lxml would have made up for them so far
+'''
+class BspXmlWriter(object):
+
+    def __init__(self, stable_ids=False, created=None, shared=False):
+        self.created = created
+        self.bodies = BodyIds(stable_ids, shared)
+        self._prefixes = 0
+
+    def _prefix(self):
+        prefix = 'ns%d' % self._prefixes
+        self._prefixes += 1
+        return prefix
+
+    '''
+    returns the annotation of the analysis of one word as it is written one
+    level into the rdf root
+    '''
+    def annotation(self, word, pretty_print=False):
+        from datetime import datetime
+        oa = self._prefix()
+        lines = [(1, '<%s:Annotation xmlns:%s="http://www.w3.org/ns/oa#" rdf:about="%s">' % (oa, oa,
+            xmlattribute(make_annotation_uri(word.form, word.engine))))]
+        lines.append((2, '<%s:hasTarget>' % oa))
+        lines.append((3, '<rdf:Description rdf:about="%s"/>' % xmlattribute(word.uri)))
+        lines.append((2, '</%s:hasTarget>' % oa))
+        lines.append((2, '<dc:title xmlns:dc="http://purl.org/dc/elements/1.1/" xml:lang="eng">%s</dc:title>' % xmltext("Morphology of " + word.form)))
+        if word.chunk:
+            lines.append((2, _leaf('chunk', word.chunk)))
+        creator = self._prefix()
+        agent = self._prefix()
+        lines.append((2, '<%s:creator xmlns:%s="http://purl.org/dc/terms/">' % (creator, creator)))
+        lines.append((3, '<%s:Agent xmlns:%s="http://xmlns.com/foaf/0.1/" rdf:about="%s"/>' % (agent, agent,
+            xmlattribute(make_creator_uri(word.engine)))))
+        lines.append((2, '</%s:creator>' % creator))
+        created = self._prefix()
+        lines.append((2, '<%s:created xmlns:%s="http://purl.org/dc/terms/">%s</%s:created>' % (created, created,
+            xmltext(self.created or datetime.utcnow().isoformat()), created)))
+        for entry in word.entries:
+            entry_id, new = self.bodies.uri(entry, word.engine)
+            entry_id = xmlattribute(entry_id)
+            lines.append((2, '<%s:hasBody rdf:resource="%s"/>' % (oa, entry_id)))
+            if not new:
+                continue
+            lines.append((2, '<%s:Body rdf:resource="%s">' % (oa, entry_id)))
+            lines.append((3, '<rdf:type rdf:resource="http://www.w3.org/2008/content#ContentAsXML"/>'))
+            content = self._prefix()
+            lines.append((3, '<%s:rest xmlns:%s="http://www.w3.org/2008/content#">' % (content, content)))
+            _entrylines(lines, entry, 4)
+            lines.append((3, '</%s:rest>' % content))
+            lines.append((2, '</%s:Body>' % oa))
+        lines.append((1, '</%s:Annotation>' % oa))
+        return _join(lines, pretty_print)
+
+    '''
+    returns the whole document for an analysis, as UTF-8 bytes
+    '''
+    def document(self, analysis, pretty_print=True):
+        annotations = [self.annotation(word, pretty_print) for word in analysis]
+        if not annotations:
+            return XML_DECLARATION + (RDF_ROOT + '/>' + ('\n' if pretty_print else '')).encode('utf-8')
+        head = RDF_ROOT + ('>\n' if pretty_print else '>')
+        return XML_DECLARATION + (head + ''.join(annotations) + '</rdf:RDF>' + ('\n' if pretty_print else '')).encode('utf-8')
+
+'''
+returns an analysis in the morphology service xml format as UTF-8 bytes,
+what tostring(tobspmorphxml(...), pretty_print=True, xml_declaration=True,
+encoding='utf-8') gives
+'''
+def bspxml(analysis, stable_ids=False, created=None, shared=False):
+    return BspXmlWriter(stable_ids, created, shared).document(analysis)
+
+'''
+returns an analysis in the alpheios legacy service xml format as UTF-8
+bytes, what the pretty printed toalpheiosxml(...) with a declaration gives
+'''
+def alpheiosxml(analysis):
+    lines = []
+    for word in analysis:
+        lines.append((1, '<word>'))
+        lines.append((2, _leaf('form', word.form, ' xml:lang="%s"' % xmlattribute(word.lang))))
+        for entry in word.entries:
+            _entrylines(lines, entry, 2)
+        lines.append((1, '</word>'))
+    if not lines:
+        return XML_DECLARATION + b'<words/>\n'
+    return XML_DECLARATION + ('<words>\n' + _join(lines, True) + '</words>\n').encode('utf-8')
+
+def _jsonstring(value):
+    return 'null' if value is None else encode_basestring_ascii(value)
+
+def _jsonone(values):
+    # a single value is written as is, several as a list
+    return values[0] if len(values) == 1 else '[' + ', '.join(values) + ']'
+
+'''
+returns the annotation of the analysis of one word as JSON, what
+dumps(annotationtojson(...)) gives
+'''
+def bspjsonannotation(word, stable_ids=False, created=None, bodies=None):
+    from datetime import datetime
+    bodies = bodies or BodyIds(stable_ids)
+    parts = [
+        '{"about": ', _jsonstring(make_annotation_uri(word.form, word.engine)),
+        ', "hasTarget": {"Description": {"about": ', _jsonstring(word.uri), '}}',
+        ', "title": ', _jsonstring("Morphology of " + word.form)
+    ]
+    if word.chunk:
+        parts.extend([', "chunk": ', _jsonstring(word.chunk)])
+    parts.extend([
+        ', "creator": {"Agent": {"about": ', _jsonstring(make_creator_uri(word.engine)), '}}',
+        ', "created": ', _jsonstring(created or datetime.utcnow().isoformat())
+    ])
+    hasbodies = []
+    written = []
+    for entry in word.entries:
+        entry_id, new = bodies.uri(entry, word.engine)
+        entry_id = _jsonstring(entry_id)
+        hasbodies.append('{"resource": ' + entry_id + '}')
+        if not new:
+            continue
+        infls = []
+        for infl in entry.infls:
+            term = '{"term": {"lang": ' + _jsonstring(infl.lang) + ', "stem": ' + _jsonstring(infl.stem) + '}'
+            if infl.pofs:
+                term += ', "pofs": {"order": ' + _jsonstring(infl.pofs.order) + ', "$": ' + _jsonstring(infl.pofs.name) + '}'
+            infls.append(term + '}')
+        body = '{"about": ' + entry_id + ', "rest": {"entry": {"dict": {"hdwd": {"lang": ' + _jsonstring(entry.lang) + \
+            ', "$": ' + _jsonstring(entry.hdwd) + '}}'
+        if infls:
+            body += ', "infl": ' + _jsonone(infls)
+        written.append(body + '}}}')
+    if hasbodies:
+        parts.extend([', "hasBody": ', _jsonone(hasbodies)])
+    if written:
+        parts.extend([', "Body": ', _jsonone(written)])
+    parts.append('}')
+    return ''.join(parts)
+
+'''
+returns an analysis in the morphology service JSON format as bytes, what
+dumps(tobspmorphjson(...)) gives
+'''
+def bspjson(analysis, stable_ids=False, created=None, shared=False):
+    bodies = BodyIds(stable_ids, shared)
+    annotations = [bspjsonannotation(word, stable_ids, created, bodies) for word in analysis]
+    if not annotations:
+        return b'{"RDF": {}}'
+    return ('{"RDF": {"Annotation": ' + _jsonone(annotations) + '}}').encode('ascii')
+
+def _jsonbackend(name):
+    if name == 'orjson':
+        import orjson
+        return orjson.dumps
+    if name == 'ujson':
+        import ujson
+        return lambda obj: ujson.dumps(obj, escape_forward_slashes=False).encode('utf-8')
+    return lambda obj: json.dumps(obj).encode('ascii')
+
+JSON_BACKEND = os.environ.get('MORPHSERVICE_JSON', 'json')
+try:
+    dumpjson = _jsonbackend(JSON_BACKEND)
+except ImportError as e:
+    print("%s is not installed, writing JSON with json" % JSON_BACKEND)
+    JSON_BACKEND = 'json'
+    dumpjson = _jsonbackend(JSON_BACKEND)
@@ -0,0 +1,160 @@
+'''
+Engine registry.
+
+An engine is a plugin that analyzes words, and possibly whole texts, in
+one or more languages. Engines describe themselves (what they are, which
+languages they analyze, which request options they take and which kinds
+of analysis, or capabilities, they offer) and register with the registry
+here, which the resources dispatch requests through and the engine list
+and engine detail resources are generated from. Adding an engine is a
+matter of subclassing Engine and registering an instance of it.
+
+Engines load their models on first use, so an engine costs nothing in a
+worker that never gets a request for it, unless it is preloaded.
+'''
+from __future__ import unicode_literals
+import threading
+
+'''
+the kinds of analysis an engine can offer
+'''
+WORD = 'word'
+WORDS = 'words'
+TEXT = 'text'
+DOCUMENT = 'document'
+CHUNKS = 'chunks'
+
+'''
+raised when an engine is asked for an analysis it doesn't offer
+'''
+class EngineUnavailable(Exception):
+    pass
+
+'''
+the plugin interface of an analysis engine. Subclasses set the class
+attributes describing the engine and implement load() and analyze(),
+and analyze_text() if they offer TEXT or DOCUMENT analysis.
+'''
+class Engine(object):
+    id = None
+    description = ''
+    languages = []
+    options = []
+    capabilities = []
+    # a word to warm the engine up with, see app.warmup
+    sample = None
+
+    def __init__(self):
+        self._loaded = False
+        self._load_lock = threading.Lock()
+
+    '''
+    identifies the engine release and models, so that cached analyses
+    are not reused after either of them changes
+    '''
+    @property
+    def version(self):
+        return self.id
+
+    '''
+    when the models of the engine last changed, as a unix time, or None if
+    that isn't known
+    '''
+    @property
+    def modified(self):
+        return None
+
+    @property
+    def loaded(self):
+        return self._loaded
+
+    '''
+    loads the models of the engine, once
+    '''
+    def load(self):
+        if not self._loaded:
+            with self._load_lock:
+                if not self._loaded:
+                    self.loadmodels()
+                    self._loaded = True
+        return self
+
+    def loadmodels(self):
+        pass
+
+    def supports(self, capability):
+        return capability in self.capabilities
+
+    '''
+    returns the form a word is analyzed (and cached) as
+    '''
+    def normalizeform(self, word):
+        return word
+
+    '''
+    returns the list of analyses of a single word, uri being the uri the
+    analyses are about
+    '''
+    def analyze(self, word, uri):
+        raise EngineUnavailable('%s does not offer word analysis' % self.id)
+
+    '''
+    returns one list of analyses per word, in order. Engines that can
+    analyze many words at once more cheaply than one by one override this.
+    '''
+    def analyze_batch(self, words, uris):
+        return [self.analyze(word, uri) for word, uri in zip(words, uris)]
+
+    '''
+    returns an iterable over the analyses of every word of a text, in order.
+    With chunks, engines offering CHUNKS label each word with the phrase
+    chunk it is in as well.
+    '''
+    def analyze_text(self, text, uri, chunks=False):
+        raise EngineUnavailable('%s does not offer text analysis' % self.id)
+
+    '''
+    returns the description of the engine the engine resources serve
+    '''
+    def describe(self):
+        return {
+            'id': self.id,
+            'description': self.description,
+            'languages': list(self.languages),
+            'options': list(self.options),
+            'capabilities': list(self.capabilities)
+        }
+
+_engines = []
+
+'''
+adds an engine to the registry, returning it
+'''
+def register(engine):
+    _engines.append(engine)
+    return engine
+
+'''
+returns the registered engines, in the order they were registered
+'''
+def engines():
+    return list(_engines)
+
+'''
+returns the engine registered as engine_id, or None if there is no such engine
+'''
+def getengine(engine_id):
+    for engine in _engines:
+        if engine.id == engine_id:
+            return engine
+    return None
+
+'''
+loads the models of the engines named in preload, a comma separated list
+of engine ids. 'all' (or '1') loads every registered engine.
+'''
+def preload(names):
+    names = [name.strip() for name in (names or '').split(',') if name.strip()]
+    for engine in _engines:
+        if engine.id in names or 'all' in names or '1' in names:
+            engine.load()
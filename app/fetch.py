@@ -0,0 +1,338 @@
+'''
+Fetching of remote documents and texts.
+
+Connections are kept alive and reused per host, responses are read and
+decoded incrementally with a cap on their size, and a fetch can be made
+conditional on the ETag or Last-Modified of an earlier one so that an
+unchanged document doesn't have to be transferred (or analyzed) again.
+
+Served over ASGI, a request's fetches are deferred instead: the request
+stops where it would fetch, the server fetches the document on its event
+loop with an AsyncDocumentFetcher, and then runs the request again with
+the outcome, so a slow host doesn't keep a thread waiting.
+'''
+from __future__ import unicode_literals
+import asyncio
+import http.client
+import codecs
+import ssl
+import threading
+import time
+import urllib.parse
+
+REDIRECTS = (301, 302, 303, 307, 308)
+
+'''
+raised when a document can't be fetched. code is the status the service
+should answer with.
+'''
+class FetchError(Exception):
+    def __init__(self, message, code=502):
+        Exception.__init__(self, message)
+        self.code = code
+
+'''
+the outcome of a fetch. text is None when the server said the document was
+not modified.
+'''
+class Fetched(object):
+    def __init__(self, uri, text, etag=None, last_modified=None):
+        self.uri = uri
+        self.text = text
+        self.etag = etag
+        self.last_modified = last_modified
+
+    @property
+    def modified(self):
+        return self.text is not None
+
+'''
+returns the charset of a Content-Type header, utf-8 if it names none or
+one python doesn't know
+'''
+def contentcharset(content_type):
+    charset = 'utf-8'
+    for param in (content_type or '').split(';')[1:]:
+        name, _, value = param.strip().partition('=')
+        if name.lower() == 'charset' and value:
+            charset = value.strip('"\'')
+    try:
+        codecs.lookup(charset)
+    except LookupError:
+        charset = 'utf-8'
+    return charset
+
+'''
+raised by DeferredFetches in place of fetching a document
+'''
+class FetchDeferred(FetchError):
+    def __init__(self, uri):
+        FetchError.__init__(self, 'fetching %s was deferred' % uri, 503)
+
+'''
+the fetches of a request that are made outside of it. The first fetch the
+request wants that hasn't been made yet raises FetchDeferred and is
+remembered in wanted, so that the server can make it and run the request
+again with the outcome added.
+'''
+class DeferredFetches(object):
+
+    def __init__(self):
+        self.wanted = None
+        self._outcomes = {}
+
+    '''
+    returns the outcome of a fetch made earlier: the Fetched document and
+    how long fetching it took. Raises the FetchError it failed with, or
+    FetchDeferred if it hasn't been made.
+    '''
+    def fetch(self, uri, etag=None, last_modified=None):
+        key = (uri, etag, last_modified)
+        if key not in self._outcomes:
+            self.wanted = key
+            raise FetchDeferred(uri)
+        fetched, seconds = self._outcomes[key]
+        if isinstance(fetched, FetchError):
+            raise fetched
+        return fetched, seconds
+
+    '''
+    makes the wanted fetch with an AsyncDocumentFetcher
+    '''
+    async def run(self, fetcher):
+        key, self.wanted = self.wanted, None
+        started = time.time()
+        try:
+            fetched = await fetcher.fetch(*key)
+        except FetchError as e:
+            fetched = e
+        self._outcomes[key] = (fetched, time.time() - started)
+
+'''
+fetches http(s) documents over a pool of keep-alive connections
+'''
+class DocumentFetcher(object):
+
+    def __init__(self, timeout=10, max_bytes=10 * 1024 * 1024, max_idle=4, chunk_size=64 * 1024):
+        self.timeout = timeout
+        self.max_bytes = max_bytes
+        self.max_idle = max_idle
+        self.chunk_size = chunk_size
+        self._idle = {}
+        self._lock = threading.Lock()
+
+    def _connect(self, scheme, netloc):
+        with self._lock:
+            idle = self._idle.get((scheme, netloc))
+            if idle:
+                return idle.pop()
+        if scheme == 'https':
+            return http.client.HTTPSConnection(netloc, timeout=self.timeout)
+        return http.client.HTTPConnection(netloc, timeout=self.timeout)
+
+    def _release(self, scheme, netloc, connection):
+        with self._lock:
+            idle = self._idle.setdefault((scheme, netloc), [])
+            if len(idle) < self.max_idle:
+                idle.append(connection)
+                return
+        connection.close()
+
+    '''
+    fetches uri, following redirects. Pass the etag and last_modified of an
+    earlier fetch to only get the document back if it has changed since.
+    '''
+    def fetch(self, uri, etag=None, last_modified=None):
+        for redirect in range(6):
+            parts = urllib.parse.urlsplit(uri)
+            if parts.scheme not in ('http', 'https'):
+                raise FetchError('unsupported document uri ' + uri, 400)
+            headers = {'Accept-Encoding': 'identity'}
+            if etag:
+                headers['If-None-Match'] = etag
+            if last_modified:
+                headers['If-Modified-Since'] = last_modified
+            path = parts.path or '/'
+            if parts.query:
+                path += '?' + parts.query
+            response, connection = self._request(parts.scheme, parts.netloc, path, headers)
+            if response.status in REDIRECTS and response.getheader('Location'):
+                self._discard(parts.scheme, parts.netloc, response, connection)
+                uri = urllib.parse.urljoin(uri, response.getheader('Location'))
+                continue
+            if response.status == 304:
+                self._discard(parts.scheme, parts.netloc, response, connection)
+                return Fetched(uri, None, etag, last_modified)
+            if response.status != 200:
+                self._discard(parts.scheme, parts.netloc, response, connection)
+                raise FetchError('fetching %s failed with status %d' % (uri, response.status))
+            text = self._read(response, connection)
+            self._release(parts.scheme, parts.netloc, connection)
+            return Fetched(uri, text, response.getheader('ETag'), response.getheader('Last-Modified'))
+        raise FetchError('too many redirects fetching ' + uri)
+
+    def _request(self, scheme, netloc, path, headers):
+        # a pooled connection may have been closed by the server in the
+        # meantime, in which case the request is retried on a new one
+        for attempt in range(2):
+            connection = self._connect(scheme, netloc)
+            try:
+                connection.request('GET', path, headers=headers)
+                return connection.getresponse(), connection
+            except (http.client.HTTPException, ConnectionError) as e:
+                connection.close()
+                error = e
+            except (OSError, IOError) as e:
+                connection.close()
+                raise FetchError('unable to fetch %s://%s%s: %s' % (scheme, netloc, path, e))
+        raise FetchError('unable to fetch %s://%s%s: %s' % (scheme, netloc, path, error))
+
+    def _discard(self, scheme, netloc, response, connection):
+        # the body has to be drained before the connection can be reused
+        try:
+            if len(response.read(self.chunk_size + 1)) <= self.chunk_size:
+                self._release(scheme, netloc, connection)
+                return
+        except (http.client.HTTPException, OSError, IOError):
+            pass
+        connection.close()
+
+    def _read(self, response, connection):
+        length = response.getheader('Content-Length')
+        if length and length.isdigit() and int(length) > self.max_bytes:
+            connection.close()
+            raise FetchError('document is larger than %d bytes' % self.max_bytes, 413)
+        decoder = codecs.getincrementaldecoder(self._charset(response))(errors='replace')
+        text = []
+        size = 0
+        try:
+            while True:
+                chunk = response.read(self.chunk_size)
+                if not chunk:
+                    break
+                size += len(chunk)
+                if size > self.max_bytes:
+                    connection.close()
+                    raise FetchError('document is larger than %d bytes' % self.max_bytes, 413)
+                text.append(decoder.decode(chunk))
+        except (http.client.HTTPException, OSError, IOError) as e:
+            connection.close()
+            raise FetchError('unable to read document: %s' % e)
+        text.append(decoder.decode(b'', True))
+        return ''.join(text)
+
+    def _charset(self, response):
+        return contentcharset(response.getheader('Content-Type'))
+
+'''
+fetches http(s) documents on an asyncio event loop, as DocumentFetcher
+does but without keeping connections alive. timeout limits a whole fetch.
+'''
+class AsyncDocumentFetcher(object):
+
+    def __init__(self, timeout=10, max_bytes=10 * 1024 * 1024, chunk_size=64 * 1024):
+        self.timeout = timeout
+        self.max_bytes = max_bytes
+        self.chunk_size = chunk_size
+
+    async def fetch(self, uri, etag=None, last_modified=None):
+        try:
+            return await asyncio.wait_for(self._fetch(uri, etag, last_modified), self.timeout)
+        except asyncio.TimeoutError:
+            raise FetchError('unable to fetch %s: timed out' % uri)
+
+    async def _fetch(self, uri, etag, last_modified):
+        for redirect in range(6):
+            parts = urllib.parse.urlsplit(uri)
+            if parts.scheme not in ('http', 'https'):
+                raise FetchError('unsupported document uri ' + uri, 400)
+            headers = {'Accept-Encoding': 'identity'}
+            if etag:
+                headers['If-None-Match'] = etag
+            if last_modified:
+                headers['If-Modified-Since'] = last_modified
+            path = parts.path or '/'
+            if parts.query:
+                path += '?' + parts.query
+            status, response, reader, writer = await self._request(parts, path, headers)
+            try:
+                if status in REDIRECTS and response.get('location'):
+                    uri = urllib.parse.urljoin(uri, response['location'])
+                    continue
+                if status == 304:
+                    return Fetched(uri, None, etag, last_modified)
+                if status != 200:
+                    raise FetchError('fetching %s failed with status %d' % (uri, status))
+                text = await self._read(reader, response)
+                return Fetched(uri, text, response.get('etag'), response.get('last-modified'))
+            finally:
+                writer.close()
+        raise FetchError('too many redirects fetching ' + uri)
+
+    '''
+    sends the request and reads the head of the response, returning its
+    status, its headers by lowercased name and the open connection
+    '''
+    async def _request(self, parts, path, headers):
+        port = parts.port or (443 if parts.scheme == 'https' else 80)
+        context = ssl.create_default_context() if parts.scheme == 'https' else None
+        lines = ['GET %s HTTP/1.1' % path, 'Host: ' + parts.netloc, 'Connection: close']
+        lines += ['%s: %s' % header for header in headers.items()]
+        try:
+            reader, writer = await asyncio.open_connection(parts.hostname, port, ssl=context)
+        except (OSError, ValueError) as e:
+            raise FetchError('unable to fetch %s://%s%s: %s' % (parts.scheme, parts.netloc, path, e))
+        try:
+            writer.write(('\r\n'.join(lines) + '\r\n\r\n').encode('ascii'))
+            status = int((await reader.readline()).split(None, 2)[1])
+            response = {}
+            while True:
+                line = (await reader.readline()).decode('latin-1')
+                if not line.strip():
+                    break
+                name, _, value = line.partition(':')
+                response[name.strip().lower()] = value.strip()
+        except (OSError, ValueError, IndexError) as e:
+            writer.close()
+            raise FetchError('unable to fetch %s://%s%s: %s' % (parts.scheme, parts.netloc, path, e))
+        return status, response, reader, writer
+
+    async def _read(self, reader, response):
+        length = response.get('content-length')
+        if length and length.isdigit() and int(length) > self.max_bytes:
+            raise FetchError('document is larger than %d bytes' % self.max_bytes, 413)
+        decoder = codecs.getincrementaldecoder(contentcharset(response.get('content-type')))(errors='replace')
+        text = []
+        size = 0
+        try:
+            async for chunk in self._body(reader, response):
+                size += len(chunk)
+                if size > self.max_bytes:
+                    raise FetchError('document is larger than %d bytes' % self.max_bytes, 413)
+                text.append(decoder.decode(chunk))
+        except (OSError, ValueError, asyncio.IncompleteReadError) as e:
+            raise FetchError('unable to read document: %s' % e)
+        text.append(decoder.decode(b'', True))
+        return ''.join(text)
+
+    '''
+    yields the body of a response as it arrives, whether it is chunked, of
+    a given length or runs until the connection closes
+    '''
+    async def _body(self, reader, response):
+        if 'chunked' in response.get('transfer-encoding', '').lower():
+            while True:
+                size = int((await reader.readline()).split(b';')[0].strip(), 16)
+                if not size:
+                    return
+                yield await reader.readexactly(size)
+                await reader.readexactly(2)
+        length = response.get('content-length')
+        remaining = int(length) if length and length.isdigit() else None
+        while remaining is None or remaining > 0:
+            chunk = await reader.read(self.chunk_size if remaining is None else min(self.chunk_size, remaining))
+            if not chunk:
+                return
+            if remaining is not None:
+                remaining -= len(chunk)
+            yield chunk
@@ -0,0 +1,82 @@
+'''
+Background analysis jobs.
+
+A job runs an analysis outside of the request that asked for it. Job state
+and results are kept in the analysis cache, so any worker sharing that
+cache can report on a job. Jobs are run by a local, in-process thread pool,
+which needs no services beyond the cache.
+'''
+from __future__ import unicode_literals
+from concurrent.futures import ThreadPoolExecutor
+import threading
+import time
+import uuid
+
+QUEUED = 'queued'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+
+'''
+queues jobs on a local thread pool and records their progress in the cache
+'''
+class JobQueue(object):
+
+    def __init__(self, cache, workers=2, timeout=24 * 60 * 60):
+        self.cache = cache
+        self.workers = workers
+        self.timeout = timeout
+        self._executor = None
+        self._lock = threading.Lock()
+
+    def _jobkey(self, job_id):
+        return 'morph:job:' + job_id
+
+    def _pool(self):
+        # started on first use so that processes which never queue a job
+        # don't carry idle threads around
+        if self._executor is None:
+            with self._lock:
+                if self._executor is None:
+                    self._executor = ThreadPoolExecutor(max_workers=self.workers)
+        return self._executor
+
+    '''
+    records the job with the changes, returning it, or None if the cache
+    wouldn't store it
+    '''
+    def _update(self, job_id, job, **changes):
+        job = dict(job, **changes)
+        if not self.cache.set(self._jobkey(job_id), job, self.timeout):
+            print("unable to store the state of job %s" % job_id)
+            return None
+        return job
+
+    '''
+    queues func(*args) and returns the id of the job. func should return
+    the cache key its result was stored under. Returns None, without
+    queuing anything, if the state of the job can't be kept in the cache,
+    as nobody could follow it then.
+    '''
+    def submit(self, func, *args):
+        job_id = uuid.uuid4().hex
+        job = self._update(job_id, {}, status=QUEUED, submitted=time.time())
+        if job is None:
+            return None
+        self._pool().submit(self._run, job_id, job, func, args)
+        return job_id
+
+    def _run(self, job_id, job, func, args):
+        job = self._update(job_id, job, status=RUNNING, started=time.time()) or job
+        try:
+            result_key = func(*args)
+        except Exception as e:
+            self._update(job_id, job, status=FAILED, finished=time.time(), error=str(e))
+        else:
+            self._update(job_id, job, status=DONE, finished=time.time(), result_key=result_key)
+
+    '''
+    returns the state of a job, or None if there is no such job (anymore)
+    '''
+    def get(self, job_id):
+        return self.cache.get(self._jobkey(job_id))
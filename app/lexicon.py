@@ -0,0 +1,153 @@
+'''
+Persistent lexicon of precomputed analyses.
+
+The lexicon is an SQLite file mapping normalized forms to the stem, lemma
+and context-free POS tag hazm gives them. Workers open it read-only and
+memory-mapped, so every mod_wsgi daemon process reads the same pages from
+the OS page cache instead of holding its own copy. It is built ahead of
+time from a word list or corpus with buildlexicon.py.
+'''
+from __future__ import unicode_literals
+import sqlite3
+import threading
+import os
+
+'''
+how much of the lexicon file sqlite may map into memory
+'''
+MMAP_SIZE = 1 << 30
+
+'''
+how many forms are looked up or written per statement
+'''
+BATCH_SIZE = 500
+
+'''
+read-only access to a built lexicon, safe to share between request threads
+'''
+class Lexicon(object):
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        # the file whose version was checked when the lexicon was opened
+        self._opened = self._open()
+        self.version = self._version(self._opened)
+        self._local.connection = self._opened
+
+    def _open(self):
+        # immutable tells sqlite the file can't change under it so it
+        # can skip locking, which is what lets the pages be shared
+        uri = 'file:' + os.path.abspath(self.path) + '?mode=ro&immutable=1'
+        connection = sqlite3.connect(uri, uri=True, check_same_thread=False)
+        connection.execute('PRAGMA mmap_size = %d' % MMAP_SIZE)
+        return connection
+
+    def _version(self, connection):
+        return connection.execute("SELECT value FROM meta WHERE key = 'version'").fetchone()[0]
+
+    def _connection(self):
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            # buildlexicon may have replaced the file since it was opened,
+            # with a lexicon for other models: threads then share the
+            # connection to the file that was checked instead
+            try:
+                connection = self._open()
+                if self._version(connection) != self.version:
+                    connection.close()
+                    connection = None
+            except sqlite3.Error:
+                connection = None
+            if connection is None:
+                connection = self._opened
+            self._local.connection = connection
+        return connection
+
+    '''
+    returns (stem, lemma, tag) for a normalized form or None if it isn't in
+    the lexicon
+    '''
+    def get(self, form):
+        return self._connection().execute('SELECT stem, lemma, tag FROM lexicon WHERE form = ?', (form,)).fetchone()
+
+    '''
+    returns a dict of (stem, lemma, tag) for those of the forms in the lexicon
+    '''
+    def get_many(self, forms):
+        forms = list(forms)
+        found = {}
+        for start in range(0, len(forms), BATCH_SIZE):
+            batch = forms[start:start + BATCH_SIZE]
+            query = 'SELECT form, stem, lemma, tag FROM lexicon WHERE form IN (%s)' % ','.join('?' * len(batch))
+            for form, stem, lemma, tag in self._connection().execute(query, batch):
+                found[form] = (stem, lemma, tag)
+        return found
+
+    def __len__(self):
+        return self._connection().execute('SELECT COUNT(*) FROM lexicon').fetchone()[0]
+
+'''
+opens the lexicon at path for the given pipeline. Returns None when there is
+no lexicon there or when it was built with a different hazm release or
+tagger model than the one the pipeline would use.
+'''
+def openlexicon(path, pipeline):
+    if not path or not os.path.exists(path):
+        return None
+    try:
+        lexicon = Lexicon(path)
+    except sqlite3.Error as e:
+        print("unable to open lexicon %s: %s" % (path, e))
+        return None
+    if lexicon.version != pipeline.version:
+        print("ignoring lexicon %s built for %s, running %s" % (path, lexicon.version, pipeline.version))
+        return None
+    print("using lexicon %s" % path)
+    return lexicon
+
+'''
+analyzes every distinct word in words with the pipeline and writes the
+results to a new lexicon at path. The file is written next to path and
+moved into place once complete so that running workers never see a
+partial lexicon. Returns the number of forms written.
+'''
+def buildlexicon(path, words, pipeline, progress=None):
+    building = path + '.building'
+    if os.path.exists(building):
+        os.remove(building)
+    connection = sqlite3.connect(building)
+    connection.execute('CREATE TABLE meta (key TEXT PRIMARY KEY, value TEXT)')
+    connection.execute('CREATE TABLE lexicon (form TEXT PRIMARY KEY, stem TEXT, lemma TEXT, tag TEXT) WITHOUT ROWID')
+    connection.execute("INSERT INTO meta VALUES ('version', ?)", (pipeline.version,))
+    seen = set()
+    written = 0
+    batch = []
+    for word in words:
+        form = pipeline.normalizeform(word)
+        if form and form not in seen:
+            seen.add(form)
+            batch.append(form)
+        if len(batch) >= BATCH_SIZE:
+            written += _writebatch(connection, batch, pipeline)
+            batch = []
+            if progress:
+                progress(written)
+    if batch:
+        written += _writebatch(connection, batch, pipeline)
+    connection.commit()
+    connection.execute('VACUUM')
+    connection.close()
+    os.replace(building, path)
+    return written
+
+def _writebatch(connection, forms, pipeline):
+    from hazm import word_tokenize
+    tokens = dict((form, word_tokenize(form)) for form in forms)
+    taggable = [form for form in forms if tokens[form]]
+    tagged = {}
+    for form, formtagged in zip(taggable, pipeline.tag_sents([tokens[form] for form in taggable])):
+        tagged[form] = formtagged[0][1]
+    rows = [(form, pipeline.stem(form), pipeline.lemmatize(form), tagged.get(form)) for form in forms]
+    connection.executemany('INSERT OR REPLACE INTO lexicon VALUES (?, ?, ?, ?)', rows)
+    return len(rows)
@@ -0,0 +1,143 @@
+'''
+Bounded memo tables with frequency aware eviction.
+
+Word frequencies in Persian text follow Zipf's law: a few thousand forms
+make up most of any text, while most forms are seen once. A plain LRU
+table lets a run of those one-off forms push the common ones out, so the
+tables here keep the TinyLFU scheme instead. Every lookup is counted in a
+small count-min sketch whose counters are halved from time to time, so
+they follow what is popular now, and a form only takes the place of
+another when it has been asked for more often than the one it would push
+out. New forms wait in a small LRU window first, which gives them the
+chance to become popular.
+'''
+from __future__ import unicode_literals
+from collections import OrderedDict
+import threading
+
+'''
+rows of the frequency sketch, and the most a counter in it counts to
+'''
+SKETCH_DEPTH = 4
+SKETCH_MAX = 15
+
+'''
+approximate counts of how often keys were seen recently
+'''
+class FrequencySketch(object):
+
+    def __init__(self, size):
+        width = 16
+        while width < size:
+            width *= 2
+        self._mask = width - 1
+        self._rows = [bytearray(width) for i in range(SKETCH_DEPTH)]
+        # the counters are halved after this many additions
+        self._sample = 10 * width
+        self._additions = 0
+
+    def _indexes(self, key):
+        hashed = hash(key)
+        step = (hashed >> 16) | 1
+        return [(hashed + i * step) & self._mask for i in range(SKETCH_DEPTH)]
+
+    def increment(self, key):
+        for row, index in zip(self._rows, self._indexes(key)):
+            if row[index] < SKETCH_MAX:
+                row[index] += 1
+        self._additions += 1
+        if self._additions >= self._sample:
+            self._rows = [bytearray(count >> 1 for count in row) for row in self._rows]
+            self._additions //= 2
+
+    def frequency(self, key):
+        return min(row[index] for row, index in zip(self._rows, self._indexes(key)))
+
+_missing = object()
+
+'''
+a memo table of at most maxsize entries, safe to share between threads.
+A maxsize of 0 turns it off.
+'''
+class FrequencyMemo(object):
+
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self._window_size = max(1, maxsize // 100)
+        self._main_size = max(0, maxsize - self._window_size)
+        self._window = OrderedDict()
+        self._main = OrderedDict()
+        self._sketch = FrequencySketch(maxsize)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self._window) + len(self._main)
+
+    def get(self, key, default=None):
+        if not self.maxsize:
+            return default
+        with self._lock:
+            self._sketch.increment(key)
+            for entries in (self._main, self._window):
+                value = entries.get(key, _missing)
+                if value is not _missing:
+                    entries.move_to_end(key)
+                    self.hits += 1
+                    return value
+            self.misses += 1
+            return default
+
+    def put(self, key, value):
+        if not self.maxsize:
+            return
+        with self._lock:
+            if key in self._main:
+                self._main[key] = value
+                return
+            self._window[key] = value
+            self._window.move_to_end(key)
+            if len(self._window) <= self._window_size:
+                return
+            # the oldest new form either moves on to the main table, if
+            # there is room or it is more popular than the least recently
+            # used form there, or is dropped
+            candidate, candidate_value = self._window.popitem(last=False)
+            if len(self._main) < self._main_size:
+                self._main[candidate] = candidate_value
+                return
+            self.evictions += 1
+            if self._main:
+                victim = next(iter(self._main))
+                if self._sketch.frequency(candidate) > self._sketch.frequency(victim):
+                    del self._main[victim]
+                    self._main[candidate] = candidate_value
+
+    '''
+    returns the value memoized for key, computing it with compute(key) and
+    remembering it if there is none
+    '''
+    def lookup(self, key, compute):
+        value = self.get(key, _missing)
+        if value is _missing:
+            value = compute(key)
+            self.put(key, value)
+        return value
+
+    def clear(self):
+        with self._lock:
+            self._window.clear()
+            self._main.clear()
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            'size': len(self),
+            'maxsize': self.maxsize,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'hit_ratio': float(self.hits) / lookups if lookups else None
+        }
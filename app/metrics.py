@@ -0,0 +1,159 @@
+'''
+Lightweight instrumentation of the analysis hot paths.
+
+Stages are timed with a context manager and recorded as a count and a sum
+per (stage, endpoint, engine), events such as cache hits are counted per
+(event, result, endpoint, engine), both aggregated over all the threads
+of the process and rendered in the Prometheus text format. When
+server_timing is on, each request also collects its own stage timings so
+they can be sent back in a Server-Timing header.
+'''
+from __future__ import unicode_literals
+from flask import g, has_request_context, request
+import threading
+import time
+
+try:
+    perf_counter = time.perf_counter
+except AttributeError:
+    perf_counter = time.time
+
+class _Timer(object):
+    __slots__ = ('metrics', 'stage', 'engine', 'start')
+
+    def __init__(self, metrics, stage, engine):
+        self.metrics = metrics
+        self.stage = stage
+        self.engine = engine
+
+    def __enter__(self):
+        self.start = perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.metrics.observe(self.stage, perf_counter() - self.start, self.engine)
+
+'''
+the counters and timers of one process
+'''
+class Metrics(object):
+
+    def __init__(self, server_timing=False, started=None):
+        self.server_timing = server_timing
+        self.started = started or time.time()
+        self.first_response = None
+        self._timers = {}
+        self._counters = {}
+        self._gauges = {}
+        self._lock = threading.Lock()
+
+    '''
+    times the block it is used for as stage, e.g.
+    with metrics.timer('tag', 'hazm'): ...
+    '''
+    def timer(self, stage, engine=None):
+        return _Timer(self, stage, engine)
+
+    def observe(self, stage, seconds, engine=None):
+        endpoint = None
+        if has_request_context():
+            endpoint = request.endpoint
+            if self.server_timing:
+                timings = g.setdefault('stage_timings', {})
+                timings[stage] = timings.get(stage, 0) + seconds
+        key = (stage, endpoint, engine)
+        with self._lock:
+            timer = self._timers.get(key)
+            if timer is None:
+                self._timers[key] = [1, seconds]
+            else:
+                timer[0] += 1
+                timer[1] += seconds
+
+    '''
+    counts an event, e.g. metrics.count('cache', 'hit', 'hazm')
+    '''
+    def count(self, event, result, engine=None):
+        endpoint = request.endpoint if has_request_context() else None
+        key = (event, result, endpoint, engine)
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + 1
+
+    '''
+    sets a gauge to func(), evaluated whenever the metrics are rendered
+    '''
+    def gauge(self, name, func, help=''):
+        with self._lock:
+            self._gauges[name] = (func, help)
+
+    '''
+    marks the start of the current request
+    '''
+    def startrequest(self):
+        g.request_started = perf_counter()
+
+    '''
+    records how long the current request took and returns the value of
+    its Server-Timing header, or None when server_timing is off
+    '''
+    def endrequest(self):
+        started = g.get('request_started')
+        if started is None:
+            return None
+        elapsed = perf_counter() - started
+        if self.first_response is None:
+            self.first_response = time.time() - self.started
+            print("first response %.3fs after the process started" % self.first_response)
+        timing = None
+        if self.server_timing:
+            timings = sorted(g.get('stage_timings', {}).items())
+            timings.append(('total', elapsed))
+            timing = ', '.join('%s;dur=%.3f' % (stage, seconds * 1000) for stage, seconds in timings)
+        self.observe('request', elapsed)
+        return timing
+
+    '''
+    renders all metrics in the Prometheus text exposition format
+    '''
+    def render(self):
+        with self._lock:
+            timers = sorted(self._timers.items(), key=_sortkey)
+            counters = sorted(self._counters.items(), key=_sortkey)
+            gauges = sorted(self._gauges.items())
+        lines = [
+            '# HELP morphservice_stage_seconds Time spent in each stage of handling requests.',
+            '# TYPE morphservice_stage_seconds summary'
+        ]
+        for (stage, endpoint, engine), (count, total) in timers:
+            labels = _labels(stage=stage, endpoint=endpoint, engine=engine)
+            lines.append('morphservice_stage_seconds_count%s %d' % (labels, count))
+            lines.append('morphservice_stage_seconds_sum%s %.6f' % (labels, total))
+        lines.append('# HELP morphservice_events_total Counted events such as cache hits and misses.')
+        lines.append('# TYPE morphservice_events_total counter')
+        for (event, result, endpoint, engine), count in counters:
+            lines.append('morphservice_events_total%s %d' % (_labels(event=event, result=result, endpoint=endpoint, engine=engine), count))
+        for name, (func, help) in gauges:
+            try:
+                value = func()
+            except Exception:
+                continue
+            if value is None:
+                continue
+            lines.append('# HELP morphservice_%s %s' % (name, help))
+            lines.append('# TYPE morphservice_%s gauge' % name)
+            lines.append('morphservice_%s %s' % (name, value))
+        if self.first_response is not None:
+            lines.append('morphservice_first_response_seconds %.3f' % self.first_response)
+        lines.append('morphservice_uptime_seconds %.3f' % (time.time() - self.started))
+        return '\n'.join(lines) + '\n'
+
+def _sortkey(item):
+    return tuple(part or '' for part in item[0])
+
+def _labels(**labels):
+    parts = []
+    for name in sorted(labels):
+        if labels[name] is not None:
+            value = str(labels[name]).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+            parts.append('%s="%s"' % (name, value))
+    return '{' + ','.join(parts) + '}' if parts else ''
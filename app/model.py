@@ -0,0 +1,124 @@
+'''
+The analysis data model.
+
+An analysis is a list of Analysis objects, one per word, each holding the
+dictionary entries the engine found for the word and the inflections of
+each entry. They are small __slots__ classes rather than nested dicts, so
+a document's worth of them takes a fraction of the memory, and the
+serializers read them directly. The language strings and the parts of
+speech, of which there are only a handful, are shared by every analysis.
+
+They pickle as their class and constructor arguments only, which keeps
+cached analyses and the ones sent back from the analysis workers small,
+and parts of speech unpickle as the shared records of the tag set.
+'''
+from __future__ import unicode_literals
+from sys import intern
+
+def _intern(value):
+    return intern(value) if value else value
+
+'''
+base of the model classes: the constructor takes the slots in order, and
+equality, pickling and repr follow from that
+'''
+class _Record(object):
+    __slots__ = ()
+
+    def _values(self):
+        return tuple(getattr(self, name) for name in self.__slots__)
+
+    def __reduce__(self):
+        return (self.__class__, self._values())
+
+    def __eq__(self, other):
+        return type(self) is type(other) and self._values() == other._values()
+
+    def __ne__(self, other):
+        return not self == other
+
+    __hash__ = None
+
+    def __repr__(self):
+        return '%s(%s)' % (self.__class__.__name__, ', '.join(repr(value) for value in self._values()))
+
+'''
+a part of speech: its name and its number in the order parts of speech are
+listed in, as a string since that is how it is serialized. There is one
+record per part of speech of a tag set, shared by every inflection.
+'''
+class PartOfSpeech(_Record):
+    __slots__ = ('name', 'order')
+
+    def __init__(self, name, order):
+        self.name = _intern(name)
+        self.order = _intern(str(order))
+
+    def __setattr__(self, name, value):
+        if hasattr(self, name):
+            raise AttributeError('parts of speech are immutable')
+        _Record.__setattr__(self, name, value)
+
+    def __hash__(self):
+        return hash(self._values())
+
+    # unpickled as the shared record of the tag set, not a copy per analysis
+    def __reduce__(self):
+        return (_partofspeech, self._values())
+
+'''
+returns the record of the tag set for a part of speech, or a new one if the
+tag set has none like it
+'''
+def _partofspeech(name, order):
+    # imported here, as the tag set is made of these records
+    from app.tagset import PARTS_OF_SPEECH
+    pofs = PARTS_OF_SPEECH.get(name)
+    if pofs is None or pofs.order != str(order):
+        pofs = PartOfSpeech(name, order)
+    return pofs
+
+'''
+one inflection of an entry: the stem in lang and its part of speech, if
+the engine gave one
+'''
+class Inflection(_Record):
+    __slots__ = ('stem', 'lang', 'pofs')
+
+    def __init__(self, stem, lang, pofs=None):
+        self.stem = stem
+        self.lang = _intern(lang)
+        self.pofs = pofs
+
+'''
+a dictionary entry: the headword in lang and its inflections
+'''
+class Entry(_Record):
+    __slots__ = ('hdwd', 'lang', 'infls')
+
+    def __init__(self, hdwd, lang, infls=()):
+        self.hdwd = hdwd
+        self.lang = _intern(lang)
+        self.infls = tuple(infls)
+
+'''
+the analysis of one word: its form in lang, the uri the analysis is about,
+the engine that made it, the entries found for it and, for chunked texts,
+the chunk label of the word
+'''
+class Analysis(_Record):
+    __slots__ = ('form', 'lang', 'uri', 'engine', 'entries', 'chunk')
+
+    def __init__(self, form, lang, uri, engine, entries=(), chunk=None):
+        self.form = form
+        self.lang = _intern(lang)
+        self.uri = uri
+        self.engine = _intern(engine)
+        self.entries = tuple(entries)
+        self.chunk = _intern(chunk)
+
+    '''
+    returns the same analysis about another uri. The entries are shared.
+    '''
+    def withuri(self, uri):
+        return Analysis(self.form, self.lang, uri, self.engine, self.entries, self.chunk)
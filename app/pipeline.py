@@ -0,0 +1,383 @@
+'''
+Shared hazm analysis pipeline.
+
+Loading the hazm Normalizer, Stemmer, Lemmatizer and especially the
+POSTagger model is expensive, so each worker process builds a single
+pipeline the first time it is needed (or at startup, see app.wsgi)
+and reuses it for every request. hazm itself, which pulls in nltk, is
+only imported then too.
+
+Everything but the tagger, which lives in libwapiti, is pickled into a
+snapshot file the first time it is built, and later processes load it
+from there, which is several times faster than building it again.
+'''
+from __future__ import unicode_literals
+from app.chunker import loadchunker
+from app.memo import FrequencyMemo
+import pickle
+import sys
+import threading
+import time
+import re
+import os
+
+try:
+    import resource
+except ImportError:
+    # not available on windows
+    resource = None
+
+'''
+returns the resident set size of the current process in kilobytes
+'''
+def rss_kb():
+    try:
+        with open('/proc/self/status') as status:
+            for line in status:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1])
+    except (IOError, OSError, ValueError):
+        pass
+    if resource is not None:
+        # ru_maxrss is a high water mark but it is the best we can do here
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return 0
+
+'''
+character fixes that hazm's Normalizer also makes, plus the zero width
+joiner, bidi marks and alef maksura that it leaves alone
+'''
+PRENORMALIZE = dict((ord(src), dst) for src, dst in [
+    ('\u0643', '\u06a9'),  # arabic kaf
+    ('\u064a', '\u06cc'),  # arabic yeh
+    ('\u0649', '\u06cc'),  # alef maksura
+    ('\u0640', None),  # keshide
+    ('\u200d', '\u200c'),  # zero width joiner
+    ('\u200e', None),  # left-to-right mark
+    ('\u200f', None),  # right-to-left mark
+    ('\r', None)
+] + [(chr(diacritic), None) for diacritic in range(0x064b, 0x0653)])
+
+ZWNJ_RUNS = re.compile('\u200c{2,}')
+
+'''
+cheap normalization applied to a word before it is looked up anywhere, so
+that spellings differing only in these characters share one analysis
+'''
+def prenormalize(word):
+    word = word.translate(PRENORMALIZE).strip()
+    return ZWNJ_RUNS.sub('\u200c', word).strip('\u200c')
+
+'''
+number of forms each memo table of a pipeline (normalized forms, stems,
+lemmas and context free tags) remembers
+'''
+MEMO_SIZE = 50000
+
+'''
+part of the pipeline version: bumped when the tags the pipeline gives
+change for the same models, so lexicons built with the old ones aren't used
+'''
+TAGGING_REVISION = 2
+
+'''
+returns the headword of a lemma. hazm lemmatizes verbs to their past and
+present stems, as past#present, and the past stem is the headword.
+'''
+def headword(lemma):
+    return lemma.split('#')[0] if lemma else lemma
+
+'''
+returns the installed hazm release
+'''
+def hazmversion():
+    try:
+        from importlib.metadata import version
+        return version('hazm')
+    except Exception:
+        pass
+    try:
+        from pkg_resources import get_distribution
+        return get_distribution('hazm').version
+    except Exception:
+        return 'unknown'
+
+'''
+identifies what a snapshot can be read by, as pickled hazm objects only
+load into the same hazm and python they were made with
+'''
+def snapshotkey():
+    return 'hazm-%s-py%d.%d' % (hazmversion(), sys.version_info[0], sys.version_info[1])
+
+'''
+returns the pipeline state pickled in the snapshot at path, or None if
+there is no snapshot there that this process can use
+'''
+def readsnapshot(path):
+    try:
+        with open(path, 'rb') as snapshot:
+            if pickle.load(snapshot) != snapshotkey():
+                return None
+            return pickle.load(snapshot)
+    except (IOError, OSError, EOFError, pickle.UnpicklingError, AttributeError, ImportError):
+        return None
+
+def writesnapshot(path, state):
+    building = '%s.%d' % (path, os.getpid())
+    try:
+        with open(building, 'wb') as snapshot:
+            pickle.dump(snapshotkey(), snapshot, pickle.HIGHEST_PROTOCOL)
+            pickle.dump(state, snapshot, pickle.HIGHEST_PROTOCOL)
+        os.replace(building, path)
+    except (IOError, OSError, pickle.PicklingError) as e:
+        print("unable to write the pipeline snapshot %s: %s" % (path, e))
+        try:
+            os.remove(building)
+        except OSError:
+            pass
+
+_untagged = object()
+
+'''
+holds the hazm models for one worker process. The models are loaded
+once, on first use, and are safe to share between request threads.
+The chunker is only loaded once something is chunked, from the compiled
+model shared between processes if compact_chunker is set. snapshot is
+the path of the snapshot to load from and write, None for none.
+'''
+class HazmPipeline(object):
+
+    def __init__(self, model_path, compact_chunker=False, snapshot=None):
+        self.model_path = model_path
+        self.compact_chunker = compact_chunker
+        self.snapshot = snapshot
+        self.from_snapshot = False
+        self.normalizer = None
+        self.stemmer = None
+        self.lemmatizer = None
+        self.tagger = None
+        self.chunker = None
+        self.warmup_seconds = None
+        self.memory_kb = None
+        self._version = None
+        self._modified = None
+        self._forms = FrequencyMemo(MEMO_SIZE)
+        self._stems = FrequencyMemo(MEMO_SIZE)
+        self._lemmas = FrequencyMemo(MEMO_SIZE)
+        self._tags = FrequencyMemo(MEMO_SIZE)
+        self._load_lock = threading.Lock()
+        # the wapiti model behind the tagger is not reentrant
+        self._tag_lock = threading.Lock()
+        # called as observe('load', seconds, 'hazm') once the models are loaded
+        self.observe = None
+
+    @property
+    def loaded(self):
+        return self.tagger is not None
+
+    '''
+    loads the models if that hasn't happened yet, recording how long
+    it took and how much the process grew
+    '''
+    def load(self):
+        if self.loaded:
+            return self
+        with self._load_lock:
+            if self.loaded:
+                return self
+            start = time.time()
+            rss_before = rss_kb()
+            from hazm import POSTagger, word_tokenize, sent_tokenize
+            state = readsnapshot(self.snapshot) if self.snapshot else None
+            self.from_snapshot = state is not None
+            if state is None:
+                from hazm import Normalizer, Stemmer, Lemmatizer
+                state = { 'normalizer': Normalizer(), 'stemmer': Stemmer(), 'lemmatizer': Lemmatizer() }
+                if self.snapshot:
+                    writesnapshot(self.snapshot, state)
+            self.normalizer = state['normalizer']
+            self.stemmer = state['stemmer']
+            self.lemmatizer = state['lemmatizer']
+            self._word_tokenize = word_tokenize
+            self._sent_tokenize = sent_tokenize
+            tagger = POSTagger(model=os.path.join(self.model_path, "postagger.model"))
+            # warm the tagger so the first request doesn't pay for it
+            tagger.tag(word_tokenize('سلام'))
+            self.tagger = tagger
+            self.warmup_seconds = time.time() - start
+            self.memory_kb = max(rss_kb() - rss_before, 0)
+            print("hazm pipeline loaded in %.3fs using %dkB%s" % (self.warmup_seconds, self.memory_kb,
+                ' from snapshot' if self.from_snapshot else ''))
+            if self.observe is not None:
+                self.observe('load', self.warmup_seconds, 'hazm')
+        return self
+
+    '''
+    identifies the hazm release and tagger model in use, so that cached
+    analyses are not reused after either of them changes
+    '''
+    @property
+    def version(self):
+        if self._version is None:
+            try:
+                model = os.stat(os.path.join(self.model_path, "postagger.model"))
+                modelstamp = '%d.%d' % (model.st_size, int(model.st_mtime))
+                self._modified = int(model.st_mtime)
+            except OSError:
+                modelstamp = 'nomodel'
+            self._version = 'hazm-%s-%s-t%d' % (hazmversion(), modelstamp, TAGGING_REVISION)
+        return self._version
+
+    '''
+    when the tagger model last changed, as a unix time, None without one
+    '''
+    @property
+    def modified(self):
+        # stat'ed along with the version
+        self.version
+        return self._modified
+
+    def normalize(self, text):
+        return self.load().normalizer.normalize(text)
+
+    '''
+    returns the normalized form of a single word, which is what analyses
+    are computed from and cached by. Results are remembered by their
+    prenormalized spelling.
+    '''
+    def normalizeform(self, word):
+        return self._forms.lookup(prenormalize(word), self.normalize)
+
+    def word_tokenize(self, text):
+        return self.load()._word_tokenize(text)
+
+    def sent_tokenize(self, text):
+        return self.load()._sent_tokenize(text)
+
+    def stem(self, word):
+        return self._stems.lookup(word, self._stem)
+
+    def _stem(self, word):
+        return self.load().stemmer.stem(word)
+
+    '''
+    returns the lemma of a word, past#present for verbs, see headword()
+    '''
+    def lemmatize(self, word):
+        return self._lemmas.lookup(word, self._lemmatize)
+
+    def _lemmatize(self, word):
+        return self.load().lemmatizer.lemmatize(word)
+
+    def tag(self, tokens):
+        self.load()
+        with self._tag_lock:
+            return self.tagger.tag(tokens)
+
+    '''
+    tags each of the sentences on its own: hazm's tag_sents hands them to
+    the tagger as one text, which tags them as a single sequence (see
+    HazmChunker.tag)
+    '''
+    def tag_sents(self, sentences):
+        self.load()
+        with self._tag_lock:
+            return [self.tagger.tag(tokens) if tokens else [] for tokens in sentences]
+
+    '''
+    returns the POS tag of each of the forms, tagged on its own (out of
+    context), as a dict. Forms that aren't remembered are tagged one at a
+    time, so that a tag doesn't depend on the forms tagged with it.
+    '''
+    def tagwords(self, forms):
+        tags = {}
+        tokens = {}
+        for form in forms:
+            if form in tags or form in tokens:
+                continue
+            tag = self._tags.get(form, _untagged)
+            if tag is _untagged:
+                tokens[form] = self.word_tokenize(form)
+            else:
+                tags[form] = tag
+        taggable = [form for form in tokens if tokens[form]]
+        tagged = self.tag_sents([tokens[form] for form in taggable]) if taggable else []
+        for form, formtagged in zip(taggable, tagged):
+            tags[form] = formtagged[0][1]
+        for form in tokens:
+            tags.setdefault(form, None)
+            self._tags.put(form, tags[form])
+        return tags
+
+    def tagword(self, form):
+        return self.tagwords([form])[form]
+
+    '''
+    returns the chunk labels (B-NP, I-NP, ...) of every word of each of
+    the POS-tagged sentences
+    '''
+    def chunk_sents(self, tagged_sents):
+        if self.chunker is None:
+            with self._load_lock:
+                if self.chunker is None:
+                    start = time.time()
+                    self.chunker = loadchunker(os.path.join(self.model_path, "chunker.model"), self.compact_chunker)
+                    print("hazm chunker loaded in %.3fs" % (time.time() - start))
+        return self.chunker.tag_sents(tagged_sents)
+
+    '''
+    reports the warm-up time and memory footprint of the pipeline
+    '''
+    def stats(self):
+        return {
+            'loaded': self.loaded,
+            'warmup_seconds': self.warmup_seconds,
+            'from_snapshot': self.from_snapshot,
+            'memory_kb': self.memory_kb,
+            'memos': self.memostats(),
+            'rss_kb': rss_kb(),
+            'pid': os.getpid()
+        }
+
+    '''
+    forgets every form the memo tables remember, e.g. to time the pipeline
+    cold
+    '''
+    def clearmemos(self):
+        for memo in (self._forms, self._stems, self._lemmas, self._tags):
+            memo.clear()
+
+    '''
+    reports the size and hit ratio of each of the memo tables
+    '''
+    def memostats(self):
+        return {
+            'form': self._forms.stats(),
+            'stem': self._stems.stats(),
+            'lemma': self._lemmas.stats(),
+            'tag': self._tags.stats()
+        }
+
+_pipeline = None
+_pipeline_lock = threading.Lock()
+
+'''
+returns the pipeline shared by this process, creating it (but not
+loading the models) on first call
+'''
+def get_pipeline(model_path, compact_chunker=False, snapshot=None):
+    global _pipeline
+    if _pipeline is None:
+        with _pipeline_lock:
+            if _pipeline is None:
+                _pipeline = HazmPipeline(model_path, compact_chunker, snapshot)
+    return _pipeline
+
+'''
+returns the pipeline of a newly started worker process, loaded and ready.
+Workers are started from a fresh interpreter (see app/workers.py), so this
+is the pipeline the worker made when it imported the app, which may
+already have been loaded then.
+'''
+def load_worker_pipeline(model_path, compact_chunker=False, snapshot=None):
+    return get_pipeline(model_path, compact_chunker, snapshot).load()
@@ -0,0 +1,151 @@
+'''
+Mapping of tagger tags to parts of speech.
+
+A tag map turns the tags of one tag set into the parts of speech the
+service reports, with one shared PartOfSpeech record per part of speech.
+Tags the map doesn't know are counted, so that a tagger model with tags
+nobody mapped yet shows up in the coverage statistics (and the log)
+instead of quietly losing the part of speech of its words.
+
+The tag sets of the hazm taggers are defined here: bijankhan, the tags of
+the models hazm released up to 0.8, and universal, the universal
+dependencies tags of the later ones. Either marks the words taking an
+ezafe with a variant of the tag of the word (Ne, NOUN,EZ), which maps to
+the same part of speech. More tag sets are added with addtagset().
+'''
+from __future__ import unicode_literals
+from app.model import PartOfSpeech
+import threading
+
+'''
+the parts of speech, in the order they are numbered in
+'''
+PARTS_OF_SPEECH = dict((name, PartOfSpeech(name, order)) for order, name in enumerate([
+    'noun', 'interjection', 'determiner', 'adjective', 'preposition', 'pronoun', 'conjunction',
+    'verb', 'adverb', 'postposition', 'numeral', 'classifier', 'ezafe', 'punctuation', 'residual'
+], 1))
+
+'''
+maps the tags of one tag set to parts of speech, counting how many of the
+tags it was asked for it knew. Safe to share between threads.
+'''
+class TagMap(object):
+
+    def __init__(self, name, tags):
+        self.name = name
+        self._tags = {}
+        self._lock = threading.Lock()
+        self.mapped = 0
+        self.unmapped = {}
+        self.extend(tags)
+
+    '''
+    adds the tags in tags, a dict of tag to part of speech name, to the map
+    '''
+    def extend(self, tags):
+        for tag, name in tags.items():
+            self._tags[tag] = PARTS_OF_SPEECH[name]
+
+    '''
+    returns the part of speech of tag, or None when it has none
+    '''
+    def map(self, tag):
+        pofs = self._tags.get(tag)
+        with self._lock:
+            if pofs is not None:
+                self.mapped += 1
+            elif tag:
+                if tag not in self.unmapped:
+                    print("no part of speech for %s tag %s" % (self.name, tag))
+                self.unmapped[tag] = self.unmapped.get(tag, 0) + 1
+        return pofs
+
+    '''
+    reports the share of the tags asked for that were mapped, and how
+    often each unmapped tag was seen
+    '''
+    def stats(self):
+        with self._lock:
+            unmapped = dict(self.unmapped)
+            lookups = self.mapped + sum(unmapped.values())
+            return {
+                'tagset': self.name,
+                'mapped': self.mapped,
+                'unmapped': unmapped,
+                'coverage': float(self.mapped) / lookups if lookups else None
+            }
+
+'''
+returns the tags of a tag set, together with the variants marking an
+ezafe, made by ezafe(tag), of those with a part of speech taking one
+'''
+def withezafe(tags, ezafe):
+    tags = dict(tags)
+    for tag, name in list(tags.items()):
+        if name in ('noun', 'adjective', 'adverb', 'pronoun', 'determiner', 'preposition', 'conjunction', 'numeral', 'postposition'):
+            tags.setdefault(ezafe(tag), name)
+    return tags
+
+_tagsets = {
+    'bijankhan': withezafe({
+        'N': 'noun',
+        'INT': 'interjection',
+        'DET': 'determiner',
+        'AJ': 'adjective',
+        'P': 'preposition',
+        'PRO': 'pronoun',
+        'CONJ': 'conjunction',
+        'V': 'verb',
+        'ADV': 'adverb',
+        'POSTP': 'postposition',
+        'NUM': 'numeral',
+        'Num': 'numeral',
+        'CL': 'classifier',
+        'e': 'ezafe',
+        'PUNC': 'punctuation',
+        'RES': 'residual'
+    }, lambda tag: tag + 'e'),
+    'universal': withezafe({
+        'NOUN': 'noun',
+        'PROPN': 'noun',
+        'INTJ': 'interjection',
+        'DET': 'determiner',
+        'ADJ': 'adjective',
+        'ADP': 'preposition',
+        'PRON': 'pronoun',
+        'CCONJ': 'conjunction',
+        'SCONJ': 'conjunction',
+        'VERB': 'verb',
+        'AUX': 'verb',
+        'ADV': 'adverb',
+        'NUM': 'numeral',
+        'PUNCT': 'punctuation',
+        'SYM': 'residual',
+        'X': 'residual'
+    }, lambda tag: tag + ',EZ')
+}
+
+'''
+adds a tag set, a dict of tag to part of speech name, or more tags to an
+existing one
+'''
+def addtagset(name, tags):
+    _tagsets.setdefault(name, {}).update(tags)
+
+'''
+returns a new tag map for the tag set called name
+'''
+def gettagmap(name):
+    if name not in _tagsets:
+        raise ValueError('unknown tag set ' + name)
+    return TagMap(name, _tagsets[name])
+
+'''
+returns the name of the tag set the models of a hazm release tag with
+'''
+def hazmtagset(version):
+    try:
+        release = tuple(int(part) for part in version.split('.')[:2])
+    except ValueError:
+        return 'bijankhan'
+    return 'bijankhan' if release < (0, 9) else 'universal'
@@ -0,0 +1,134 @@
+'''
+Process pool for CPU-bound analysis.
+
+hazm tagging runs in Python and holds the GIL, so a long text analyzed in
+one request thread only ever uses one core. A WorkerPool spreads chunks of
+work over a pool of worker processes that each load the models once, and
+hands the results back in order. A pool of size 0, or one that couldn't be
+started, runs everything in-process instead.
+'''
+from __future__ import unicode_literals
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+import multiprocessing
+import os
+import threading
+
+'''
+returns the context worker processes are started with. The pool is started
+from a request thread, and a forked child would inherit whatever locks
+other threads held at the time (the tag map's, the metrics') held forever,
+so workers start from a fresh interpreter instead. That is the python of
+MORPHSERVICE_WORKER_PYTHON when it is set, as under mod_wsgi sys.executable
+isn't python.
+'''
+def startcontext():
+    methods = multiprocessing.get_all_start_methods()
+    context = multiprocessing.get_context('forkserver' if 'forkserver' in methods else 'spawn')
+    executable = os.environ.get('MORPHSERVICE_WORKER_PYTHON')
+    if executable:
+        context.set_executable(executable)
+    return context
+
+'''
+a lazily started pool of worker processes
+'''
+class WorkerPool(object):
+
+    def __init__(self, size, initializer=None, initargs=()):
+        self.size = size
+        self.initializer = initializer
+        self.initargs = initargs
+        self._executor = None
+        self._lock = threading.Lock()
+
+    def _pool(self):
+        if self._executor is None:
+            with self._lock:
+                if self._executor is None and self.size > 0:
+                    try:
+                        self._executor = ProcessPoolExecutor(max_workers=self.size, mp_context=startcontext(),
+                            initializer=self.initializer, initargs=self.initargs)
+                    except (OSError, ValueError, TypeError, NotImplementedError) as e:
+                        print("unable to start %d analysis workers, analyzing in process: %s" % (self.size, e))
+                        self.size = 0
+        return self._executor
+
+    def _broken(self):
+        with self._lock:
+            if self._executor is not None:
+                print("analysis workers died, restarting them")
+                self._executor.shutdown(wait=False)
+                self._executor = None
+
+    '''
+    calls func(chunk, *args) for every chunk and yields the results in
+    order. Only a couple of chunks per worker are in flight at a time so
+    that a long input is never queued up in memory all at once.
+    '''
+    def imap(self, func, chunks, *args):
+        executor = self._pool()
+        if executor is None:
+            for chunk in chunks:
+                yield func(chunk, *args)
+            return
+        window = deque()
+        for chunk in chunks:
+            window.append((chunk, self._submit(executor, func, chunk, args)))
+            if len(window) >= self.size * 2:
+                yield self._result(window.popleft(), func, args)
+        while window:
+            yield self._result(window.popleft(), func, args)
+
+    def _submit(self, executor, func, chunk, args):
+        try:
+            return executor.submit(func, chunk, *args)
+        except (BrokenProcessPool, RuntimeError):
+            self._broken()
+            return None
+
+    def _result(self, submitted, func, args):
+        chunk, future = submitted
+        if future is not None:
+            try:
+                return future.result()
+            except BrokenProcessPool:
+                self._broken()
+        # the worker is gone, so do this chunk here rather than lose it
+        return func(chunk, *args)
+
+    def shutdown(self):
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown()
+                self._executor = None
+
+'''
+limits how many analyses run at once, for servers whose threads mostly wait
+on the network: size 0 doesn't limit them. Used as a context manager around
+each stretch of analysis; it counts the analyses running and waiting.
+'''
+class Slots(object):
+
+    def __init__(self, size=0):
+        self.size = size
+        self.busy = 0
+        self.waiting = 0
+        self._free = threading.Condition()
+
+    def __enter__(self):
+        with self._free:
+            self.waiting += 1
+            try:
+                while self.size and self.busy >= self.size:
+                    self._free.wait()
+            finally:
+                self.waiting -= 1
+            self.busy += 1
+        return self
+
+    def __exit__(self, *exc_info):
+        with self._free:
+            self.busy -= 1
+            self._free.notify()
@@ -0,0 +1,189 @@
+#!flask/bin/python3.4
+'''
+Benchmarks for the hot paths of the morphology service.
+
+Times each stage of the hazm pipeline and each serializer on their own, then
+drives the word, legacy alpheios and text endpoints through the Flask test
+client, once with an empty cache (cold) and once with the cache primed
+(warm). Reports p50/p99 latency, throughput and the peak RSS of the process.
+
+    python benchmarks/bench.py                      run everything
+    python benchmarks/bench.py --quick              fewer repetitions
+    python benchmarks/bench.py --json out.json      also save the results
+    python benchmarks/bench.py --baseline out.json  fail if anything got slower
+
+The analysis cache is replaced with an in-process SimpleCache so the results
+don't depend on a memcached server.
+'''
+import argparse
+import json
+import os
+import sys
+import time
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+here = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(here))
+
+import app
+from app.cache import TieredCache
+from hazm import word_tokenize
+from werkzeug.contrib.cache import SimpleCache
+
+def peakrss():
+    if resource is None:
+        return 0
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+def percentile(times, p):
+    times = sorted(times)
+    return times[min(len(times) - 1, int(len(times) * p / 100.0))]
+
+'''
+calls func on every input repeat times, timing each call
+'''
+def measure(name, func, inputs, repeat, before=None):
+    times = []
+    for i in range(repeat):
+        for item in inputs:
+            if before:
+                before()
+            start = time.perf_counter()
+            func(item)
+            times.append(time.perf_counter() - start)
+    total = sum(times)
+    result = {
+        'name': name,
+        'calls': len(times),
+        'p50_ms': percentile(times, 50) * 1000,
+        'p99_ms': percentile(times, 99) * 1000,
+        'per_s': len(times) / total if total else 0,
+        'peak_rss_kb': peakrss()
+    }
+    print('%-34s %7d %10.3f %10.3f %12.1f %10d' % (name, result['calls'], result['p50_ms'],
+        result['p99_ms'], result['per_s'], result['peak_rss_kb']))
+    return result
+
+def readlines(name):
+    with open(os.path.join(here, name), encoding='utf-8') as lines:
+        return [line.strip() for line in lines if line.strip()]
+
+def stages(words, repeat):
+    pipeline = app.pipeline.load()
+    forms = [pipeline.normalize(word) for word in words]
+    analyses = [app.hazmtoalpheios(word, 'urn:word:' + word) for word in words]
+    return [
+        measure('Normalizer.normalize', pipeline.normalizer.normalize, words, repeat),
+        measure('Stemmer.stem', pipeline.stemmer.stem, forms, repeat),
+        measure('Lemmatizer.lemmatize', pipeline.lemmatizer.lemmatize, forms, repeat),
+        measure('POSTagger.tag', lambda form: pipeline.tag(word_tokenize(form)), forms, repeat),
+        measure('hazmtoalpheios', lambda word: app.hazmtoalpheios(word, 'urn:word:' + word), words, repeat),
+        measure('tobspmorphjson', lambda analysis: json.dumps(app.tobspmorphjson(analysis)), analyses, repeat),
+        measure('tobspmorphxml', lambda analysis: app.etree.tostring(app.tobspmorphxml(analysis), pretty_print=True), analyses, repeat),
+        measure('toalpheiosxml', lambda analysis: app.etree.tostring(app.toalpheiosxml(analysis), pretty_print=True), analyses, repeat),
+        measure('bspjson', app.bspjson, analyses, repeat),
+        measure('bspxml', app.bspxml, analyses, repeat),
+        measure('alpheiosxml', app.alpheiosxml, analyses, repeat),
+    ]
+
+'''
+checks that the template encoders write exactly what the lxml and dict
+serializers they replace do
+'''
+def parity(words):
+    analyses = [app.hazmtoalpheios(word, 'urn:word:' + word) for word in words]
+    analyses.append([word for analysis in analyses for word in analysis])
+    created = '2015-11-07T00:00:00'
+    for analysis in analyses:
+        assert app.bspjson(analysis, True, created) == json.dumps(app.tobspmorphjson(analysis, True, created)).encode('ascii')
+        assert app.bspxml(analysis, True, created) == app.etree.tostring(app.tobspmorphxml(analysis, True, created),
+            pretty_print=True, xml_declaration=True, encoding='utf-8')
+        assert app.alpheiosxml(analysis) == app.etree.tostring(app.toalpheiosxml(analysis),
+            pretty_print=True, xml_declaration=True, encoding='utf-8')
+    print('encoders match the serializers on %d analyses' % len(analyses))
+
+def endpoints(words, corpus, repeat):
+    client = app.app.test_client()
+    results = []
+    def get(path, accept):
+        def request(word):
+            response = client.get(path % word, headers={'Accept': accept})
+            response.get_data()
+            assert response.status_code < 400, response.get_data()
+        return request
+    def posttext(accept):
+        def request(text):
+            response = client.post('/morphologyservice/analysis/text', headers={'Accept': accept},
+                data={'text': text, 'lang': 'per', 'mime_type': 'text/plain'})
+            response.get_data()
+            assert response.status_code < 400, response.get_data()
+        return request
+    requests = [
+        ('word json', get('/morphologyservice/analysis/word?lang=per&engine=hazm&word=%s', 'application/json'), words),
+        ('word xml', get('/morphologyservice/analysis/word?lang=per&engine=hazm&word=%s', 'application/xml'), words),
+        ('alpheios xml', get('/alpheiosservice/hazm?word=%s', 'application/xml'), words),
+        ('text json', posttext('application/json'), corpus),
+        ('text xml', posttext('application/xml'), corpus),
+    ]
+    def cold():
+        # forget the cached analyses and the forms the pipeline remembers
+        app.cache.clear()
+        app.pipeline.clearmemos()
+    for name, request, inputs in requests:
+        results.append(measure(name + ' cold', request, inputs, repeat, before=cold))
+        for item in inputs:
+            request(item)
+        results.append(measure(name + ' warm', request, inputs, repeat))
+    return results
+
+'''
+returns the benchmarks that got slower than the baseline by more than tolerance
+'''
+def regressions(results, baseline, tolerance):
+    before = dict((result['name'], result) for result in baseline)
+    slower = []
+    for result in results:
+        old = before.get(result['name'])
+        if old and result['p50_ms'] > old['p50_ms'] * (1 + tolerance):
+            slower.append((result['name'], old['p50_ms'], result['p50_ms']))
+    return slower
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the morphology service hot paths.')
+    parser.add_argument('--quick', action='store_true', help='one repetition per input')
+    parser.add_argument('--repeat', type=int, default=5, help='repetitions per input (default %(default)s)')
+    parser.add_argument('--json', help='write the results to this file')
+    parser.add_argument('--baseline', help='compare against results written earlier with --json')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='allowed p50 slowdown against the baseline (default %(default)s)')
+    args = parser.parse_args()
+    repeat = 1 if args.quick else args.repeat
+
+    app.cache = TieredCache(SimpleCache(threshold=100000), local_kinds=('word', 'form', 'response'))
+    app.jobs.cache = app.cache.backend
+    words = readlines('words.txt')
+    corpus = readlines('corpus.txt')
+
+    start = time.perf_counter()
+    app.pipeline.load()
+    print('pipeline warm-up %.3fs, %dkB' % (time.perf_counter() - start, app.pipeline.memory_kb))
+    parity(words)
+    print('%-34s %7s %10s %10s %12s %10s' % ('benchmark', 'calls', 'p50 ms', 'p99 ms', 'per s', 'peak kB'))
+    results = stages(words, repeat) + endpoints(words, corpus, repeat)
+
+    if args.json:
+        with open(args.json, 'w') as out:
+            json.dump(results, out, indent=2)
+    if args.baseline:
+        with open(args.baseline) as baseline:
+            slower = regressions(results, json.load(baseline), args.tolerance)
+        for name, old, new in slower:
+            print('REGRESSION %s: p50 %.3fms -> %.3fms' % (name, old, new))
+        if slower:
+            sys.exit(1)
+
+if __name__ == '__main__':
+    main()
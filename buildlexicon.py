@@ -0,0 +1,42 @@
+#!flask/bin/python3.4
+'''
+Builds the lexicon of precomputed analyses that the service reads before
+running hazm, see app/lexicon.py.
+
+    buildlexicon.py words.txt                 one word per line
+    buildlexicon.py --corpus corpus.txt ...   running Persian text
+'''
+import argparse
+import sys
+import time
+from app import pipeline, lexicon_path
+from app.lexicon import buildlexicon
+from hazm import sent_tokenize, word_tokenize
+
+def readwords(paths, corpus):
+    for path in paths:
+        with open(path, encoding='utf-8') as lines:
+            for line in lines:
+                if corpus:
+                    for sentence in sent_tokenize(pipeline.normalize(line)):
+                        for word in word_tokenize(sentence):
+                            yield word
+                else:
+                    word = line.strip()
+                    if word:
+                        yield word
+
+def main():
+    parser = argparse.ArgumentParser(description='Build the lexicon of precomputed hazm analyses.')
+    parser.add_argument('files', nargs='+', help='word lists, or texts with --corpus')
+    parser.add_argument('--corpus', action='store_true', help='tokenize the files as running text')
+    parser.add_argument('-o', '--output', default=lexicon_path, help='lexicon to write (default %(default)s)')
+    args = parser.parse_args()
+    start = time.time()
+    def progress(written):
+        print('%d forms, %.0f forms/s' % (written, written / (time.time() - start)), file=sys.stderr)
+    written = buildlexicon(args.output, readwords(args.files, args.corpus), pipeline.load(), progress)
+    print('wrote %d forms to %s in %.1fs' % (written, args.output, time.time() - start))
+
+if __name__ == '__main__':
+    main()
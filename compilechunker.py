@@ -0,0 +1,29 @@
+#!flask/bin/python3.4
+'''
+Compiles the chunker model into the memory mapped form the service reads
+when MORPHSERVICE_CHUNKER is set to compact, see app/chunker.py. The
+service compiles it itself on first use if it can write next to the
+model; run this when deploying if it can't.
+
+    compilechunker.py                   compiles app/chunker.model
+    compilechunker.py -o chunker.bin    writes it somewhere else
+'''
+import argparse
+import os
+import time
+from app.chunker import compilemodel
+
+here = os.path.dirname(os.path.abspath(__file__))
+
+def main():
+    model = os.path.join(here, 'app', 'chunker.model')
+    parser = argparse.ArgumentParser(description='Compile the Wapiti chunker model for the compact chunker.')
+    parser.add_argument('model', nargs='?', default=model, help='Wapiti model to compile (default %(default)s)')
+    parser.add_argument('-o', '--output', help='compiled model to write (default the model path plus .bin)')
+    args = parser.parse_args()
+    start = time.time()
+    path = compilemodel(args.model, args.output or args.model + '.bin')
+    print('wrote %s (%d bytes) in %.1fs' % (path, os.path.getsize(path), time.time() - start))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,154 @@
+'''
+Tests the TieredCache, app/cache.py: getorcompute reading through both
+tiers, single flight across the threads of a worker and across workers
+sharing a backend through leases, and revalidation of values about to
+expire.
+'''
+import sys
+import threading
+import time
+
+from werkzeug.contrib.cache import SimpleCache
+
+from app.cache import TieredCache, makecachekey
+
+# app.cache is the application's cache once the app is imported
+cachemodule = sys.modules[TieredCache.__module__]
+
+WORD = makecachekey('word', 'hazm', 'per', 'سلام', '1')
+TEXT = makecachekey('text', 'hazm', 'per', 'سلام بر شما', '1')
+
+'''
+a compute() that counts its calls and, if gate is given, waits for it to
+be set before returning
+'''
+class Compute(object):
+
+    def __init__(self, value='analysis', gate=None):
+        self.value = value
+        self.gate = gate
+        self.calls = 0
+        self.started = threading.Event()
+
+    def __call__(self):
+        self.calls += 1
+        self.started.set()
+        if self.gate is not None:
+            assert self.gate.wait(5)
+        return self.value
+
+def test_compute_a_missing_value_once():
+    cache = TieredCache(SimpleCache())
+    compute = Compute()
+    assert cache.getorcompute(WORD, compute) == ('analysis', 'miss')
+    assert cache.getorcompute(WORD, compute) == ('analysis', 'hit')
+    assert compute.calls == 1
+    assert cache.backend.get(WORD) == 'analysis'
+    assert cache.stats()['local']['hits'] == 1
+
+def test_read_through_the_backend():
+    backend = SimpleCache()
+    backend.set(WORD, 'cached')
+    cache = TieredCache(backend)
+    compute = Compute()
+    assert cache.getorcompute(WORD, compute) == ('cached', 'hit')
+    assert compute.calls == 0
+    assert cache.stats()['backend'] == {'hits': 1, 'misses': 0}
+    assert WORD in cache._local
+
+def test_keep_only_local_kinds_in_process():
+    cache = TieredCache(SimpleCache(), local_kinds=('word',))
+    cache.getorcompute(WORD, Compute())
+    cache.getorcompute(TEXT, Compute())
+    cache.set('morph:job:1', 'queued')
+    assert list(cache._local) == [WORD]
+    assert cache.getorcompute(TEXT, Compute()) == ('analysis', 'hit')
+    assert cache.get('morph:job:1') == 'queued'
+
+def test_evict_the_least_recently_used():
+    cache = TieredCache(SimpleCache(), maxsize=2)
+    cache.set('a', 1)
+    cache.set('b', 2)
+    cache.get('a')
+    cache.set('c', 3)
+    assert list(cache._local) == ['a', 'c']
+    assert cache.get('b') == 2
+
+def test_coalesce_the_threads_of_a_worker():
+    cache = TieredCache(SimpleCache())
+    gate = threading.Event()
+    compute = Compute(gate=gate)
+    results = []
+    def get():
+        results.append(cache.getorcompute(WORD, compute))
+    threads = [threading.Thread(target=get) for i in range(8)]
+    for thread in threads:
+        thread.start()
+    assert compute.started.wait(5)
+    # let the others reach the flight before it lands
+    time.sleep(0.1)
+    gate.set()
+    for thread in threads:
+        thread.join(5)
+    assert compute.calls == 1
+    assert sorted(result for value, result in results) == ['coalesced'] * 7 + ['miss']
+    assert all(value == 'analysis' for value, result in results)
+
+def test_raise_the_error_of_the_flight_in_every_thread():
+    cache = TieredCache(SimpleCache())
+    gate = threading.Event()
+    def compute():
+        gate.wait(5)
+        raise ValueError('unanalyzable')
+    errors = []
+    def get():
+        try:
+            cache.getorcompute(WORD, compute)
+        except ValueError as e:
+            errors.append(e)
+    threads = [threading.Thread(target=get) for i in range(4)]
+    for thread in threads:
+        thread.start()
+    time.sleep(0.1)
+    gate.set()
+    for thread in threads:
+        thread.join(5)
+    assert len(errors) == 4
+    assert cache.backend.get(WORD) is None
+
+def test_wait_for_the_worker_holding_the_lease():
+    backend = SimpleCache()
+    holder, waiter = TieredCache(backend), TieredCache(backend)
+    gate = threading.Event()
+    computing = Compute(gate=gate)
+    thread = threading.Thread(target=holder.getorcompute, args=(WORD, computing))
+    thread.start()
+    assert computing.started.wait(5)
+    assert backend.get(WORD + ':lease') is not None
+    threading.Timer(0.1, gate.set).start()
+    waiting = Compute('computed again')
+    assert waiter.getorcompute(WORD, waiting) == ('analysis', 'coalesced')
+    thread.join(5)
+    assert waiting.calls == 0
+    assert backend.get(WORD + ':lease') is None
+
+def test_compute_when_the_lease_runs_out(monkeypatch):
+    monkeypatch.setattr(cachemodule, 'LEASE_TIMEOUT', 0.1)
+    backend = SimpleCache()
+    backend.add(WORD + ':lease', 1, 60)
+    cache = TieredCache(backend)
+    compute = Compute()
+    assert cache.getorcompute(WORD, compute) == ('analysis', 'miss')
+    assert compute.calls == 1
+
+def test_revalidate_a_value_about_to_expire():
+    cache = TieredCache(SimpleCache(), stale_while_revalidate=10)
+    cache.set(WORD, 'stale', timeout=5)
+    compute = Compute('fresh')
+    assert cache.getorcompute(WORD, compute) == ('stale', 'hit')
+    deadline = time.time() + 5
+    while cache.stats()['flights']['revalidated'] == 0 and time.time() < deadline:
+        time.sleep(0.01)
+    assert compute.calls == 1
+    assert cache.get(WORD) == 'fresh'
+    assert cache.backend.get(WORD + ':lease') is None
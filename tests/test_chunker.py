@@ -0,0 +1,65 @@
+'''
+Tests that the compact chunker, app/chunker.py, labels sentences the way
+hazm's Wapiti chunker does with the same model.
+'''
+import io
+import os
+import sys
+import tempfile
+
+import pytest
+
+from app.chunker import CompactChunker, HazmChunker, compilemodel, loadchunker
+
+chunkermodule = sys.modules[loadchunker.__module__]
+
+root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+model_path = os.path.join(root, 'app')
+chunker_model = os.path.join(model_path, 'chunker.model')
+
+pytestmark = pytest.mark.skipif(not os.path.exists(os.path.join(model_path, 'postagger.model')),
+    reason='the hazm POS tagger model is not installed')
+
+@pytest.fixture(scope='module')
+def sentences():
+    from hazm import Normalizer, POSTagger, sent_tokenize, word_tokenize
+    tagger = POSTagger(model=os.path.join(model_path, 'postagger.model'))
+    with io.open(os.path.join(root, 'benchmarks', 'corpus.txt'), encoding='utf-8') as corpus:
+        text = Normalizer().normalize(corpus.read())
+    with io.open(os.path.join(root, 'benchmarks', 'words.txt'), encoding='utf-8') as words:
+        # words on their own are sentences the chunker sees the edges of
+        singles = [[word] for word in words.read().split()]
+    return tagger.tag_sents([word_tokenize(sentence) for sentence in sent_tokenize(text)] + singles)
+
+@pytest.fixture(scope='module')
+def hazm():
+    return HazmChunker(chunker_model)
+
+def test_compiled_model_matches_hazm(tmpdir, sentences, hazm):
+    path = str(tmpdir.join('chunker.bin'))
+    compilemodel(chunker_model, path)
+    assert CompactChunker(path).tag_sents(sentences) == hazm.tag_sents(sentences)
+
+def test_compile_without_leaving_files_behind(tmpdir):
+    path = str(tmpdir.join('chunker.bin'))
+    compilemodel(chunker_model, path)
+    assert os.listdir(str(tmpdir)) == ['chunker.bin']
+
+def test_load_a_private_model_when_it_cant_be_shared(tmpdir, monkeypatch, sentences, hazm):
+    model = tmpdir.join('chunker.model')
+    model.write_binary(open(chunker_model, 'rb').read())
+    def compile(model_path, path):
+        if path == model_path + '.bin':
+            raise OSError('read-only file system')
+        compilemodel(model_path, path)
+    monkeypatch.setattr(chunkermodule, 'compilemodel', compile)
+    monkeypatch.setattr(tempfile, 'tempdir', str(tmpdir.mkdir('tmp')))
+    chunker = loadchunker(str(model))
+    assert os.listdir(tempfile.tempdir) == []
+    assert not os.path.exists(str(model) + '.bin')
+    assert chunker.tag_sents(sentences) == hazm.tag_sents(sentences)
+
+def test_tag_empty_sentences(tmpdir, hazm):
+    path = str(tmpdir.join('chunker.bin'))
+    compilemodel(chunker_model, path)
+    assert CompactChunker(path).tag_sents([[]]) == hazm.tag_sents([[]]) == [[]]
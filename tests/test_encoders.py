@@ -0,0 +1,55 @@
+'''
+Tests that the streaming encoders, app/encoders.py, write exactly what
+serializing the element trees and dicts built for the same analyses does.
+'''
+import io
+import json
+import os
+
+import pytest
+
+import app
+
+root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+CREATED = '2015-11-07T00:00:00'
+
+pytestmark = pytest.mark.skipif(not os.path.exists(os.path.join(root, 'app', 'postagger.model')),
+    reason='the hazm POS tagger model is not installed')
+
+def readlines(name):
+    with io.open(os.path.join(root, 'benchmarks', name), encoding='utf-8') as lines:
+        return [line.strip() for line in lines if line.strip()]
+
+def tostring(element):
+    return app.etree.tostring(element, pretty_print=True, xml_declaration=True, encoding='utf-8')
+
+@pytest.fixture(scope='module')
+def words():
+    analyses = [app.hazmtoalpheios(word, 'urn:word:' + word) for word in readlines('words.txt')]
+    # and all of them in one response
+    return analyses + [[word for analysis in analyses for word in analysis]]
+
+@pytest.fixture(scope='module')
+def texts():
+    engine = app.getengine('hazm')
+    return [list(engine.analyze_text(text, 'urn:text', chunks)) for text in readlines('corpus.txt') for chunks in (False, True)]
+
+def test_bspjson(words, texts):
+    for analysis in words + texts:
+        assert app.bspjson(analysis, True, CREATED) == json.dumps(app.tobspmorphjson(analysis, True, CREATED)).encode('ascii')
+
+def test_bspjson_shared_bodies(texts):
+    for analysis in texts:
+        assert app.bspjson(analysis, True, CREATED, True) == json.dumps(app.tobspmorphjson(analysis, True, CREATED, True)).encode('ascii')
+
+def test_bspxml(words, texts):
+    for analysis in words + texts:
+        assert app.bspxml(analysis, True, CREATED) == tostring(app.tobspmorphxml(analysis, True, CREATED))
+
+def test_bspxml_shared_bodies(texts):
+    for analysis in texts:
+        assert app.bspxml(analysis, True, CREATED, True) == tostring(app.tobspmorphxml(analysis, True, CREATED, True))
+
+def test_alpheiosxml(words):
+    for analysis in words:
+        assert app.alpheiosxml(analysis) == tostring(app.toalpheiosxml(analysis))
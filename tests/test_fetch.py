@@ -0,0 +1,142 @@
+'''
+Tests the document fetchers, app/fetch.py, against a local HTTP server
+standing in for the hosts documents are fetched from: conditional fetches
+answered with 304, the size cap on documents sent with a Content-Length
+and chunked, reuse of kept-alive connections, redirects and the decoding
+of the charset a document is sent in.
+'''
+import asyncio
+import threading
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+
+import pytest
+
+from app.fetch import AsyncDocumentFetcher, DocumentFetcher, FetchError
+
+MAX_BYTES = 1000
+TEXT = 'سلام بر شما'
+ETAG = '"v1"'
+LAST_MODIFIED = 'Sun, 01 Jan 2017 00:00:00 GMT'
+
+class StandInServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+    connections = 0
+
+    def get_request(self):
+        self.connections += 1
+        return HTTPServer.get_request(self)
+
+'''
+answers the paths the tests fetch. Speaks HTTP/1.1, so connections are
+kept alive unless a response says otherwise.
+'''
+class StandInHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, *args):
+        pass
+
+    def send(self, status, body=b'', headers=()):
+        self.send_response(status)
+        for name, value in headers:
+            self.send_header(name, value)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path == '/doc':
+            if self.headers.get('If-None-Match') == ETAG or self.headers.get('If-Modified-Since') == LAST_MODIFIED:
+                return self.send(304, headers=[('ETag', ETAG)])
+            return self.send(200, TEXT.encode('utf-8'), [('Content-Type', 'text/plain; charset=utf-8'),
+                ('ETag', ETAG), ('Last-Modified', LAST_MODIFIED)])
+        if self.path == '/moved':
+            return self.send(302, b'moved', [('Location', '/doc')])
+        if self.path == '/loop':
+            return self.send(301, headers=[('Location', '/loop')])
+        if self.path == '/windows-1256':
+            return self.send(200, TEXT.encode('windows-1256'), [('Content-Type', 'text/plain; charset="windows-1256"')])
+        if self.path == '/unknown-charset':
+            return self.send(200, TEXT.encode('utf-8'), [('Content-Type', 'text/plain; charset=nonsense')])
+        if self.path == '/large':
+            return self.send(200, b'x' * (MAX_BYTES + 1))
+        if self.path == '/large-chunked':
+            self.send_response(200)
+            self.send_header('Transfer-Encoding', 'chunked')
+            self.end_headers()
+            for i in range(4):
+                chunk = b'x' * (MAX_BYTES // 2)
+                self.wfile.write(b'%x\r\n%s\r\n' % (len(chunk), chunk))
+            self.wfile.write(b'0\r\n\r\n')
+            return
+        self.send(404, b'not found')
+
+'''
+fetches with an AsyncDocumentFetcher the way DocumentFetcher does, so that
+both can be put through the same tests
+'''
+class SyncFetcher(object):
+
+    def __init__(self, **kwargs):
+        self.fetcher = AsyncDocumentFetcher(**kwargs)
+
+    def fetch(self, uri, etag=None, last_modified=None):
+        return asyncio.run(self.fetcher.fetch(uri, etag, last_modified))
+
+@pytest.fixture
+def server():
+    server = StandInServer(('127.0.0.1', 0), StandInHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    server.base = 'http://127.0.0.1:%d' % server.server_address[1]
+    yield server
+    server.shutdown()
+    server.server_close()
+
+@pytest.fixture(params=[DocumentFetcher, SyncFetcher], ids=['threads', 'asyncio'])
+def fetcher(request):
+    return request.param(timeout=5, max_bytes=MAX_BYTES, chunk_size=256)
+
+def test_fetch(server, fetcher):
+    fetched = fetcher.fetch(server.base + '/doc')
+    assert fetched.text == TEXT
+    assert fetched.etag == ETAG
+    assert fetched.last_modified == LAST_MODIFIED
+
+def test_revalidate_with_if_none_match(server, fetcher):
+    again = fetcher.fetch(server.base + '/doc', ETAG)
+    assert not again.modified
+    assert again.etag == ETAG
+
+def test_revalidate_with_if_modified_since(server, fetcher):
+    assert not fetcher.fetch(server.base + '/doc', None, LAST_MODIFIED).modified
+
+def test_follow_a_redirect(server, fetcher):
+    moved = fetcher.fetch(server.base + '/moved')
+    assert moved.text == TEXT
+    assert moved.uri == server.base + '/doc'
+
+def test_reuse_the_kept_alive_connection(server):
+    # the asyncio fetcher closes its connections
+    fetcher = DocumentFetcher(timeout=5, max_bytes=MAX_BYTES, chunk_size=256)
+    fetcher.fetch(server.base + '/doc')
+    fetcher.fetch(server.base + '/doc', ETAG)
+    fetcher.fetch(server.base + '/moved')
+    assert server.connections == 1
+
+@pytest.mark.parametrize('path,code', [('/loop', 502), ('/missing', 502), ('/large', 413), ('/large-chunked', 413)])
+def test_fail(server, fetcher, path, code):
+    with pytest.raises(FetchError) as error:
+        fetcher.fetch(server.base + path)
+    assert error.value.code == code
+
+def test_decode_the_charset_of_the_document(server, fetcher):
+    assert fetcher.fetch(server.base + '/windows-1256').text == TEXT
+
+def test_fall_back_to_utf8_for_an_unknown_charset(server, fetcher):
+    assert fetcher.fetch(server.base + '/unknown-charset').text == TEXT
+
+def test_fetch_again_after_a_capped_document(server, fetcher):
+    with pytest.raises(FetchError):
+        fetcher.fetch(server.base + '/large-chunked')
+    assert fetcher.fetch(server.base + '/doc').text == TEXT